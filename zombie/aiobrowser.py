@@ -0,0 +1,401 @@
+"""
+An asyncio-native mirror of :mod:`zombie.browser` (Python 3.5+), e.g.,
+::
+    async def title(url):
+        async with AsyncBrowser() as browser:
+            await browser.visit(url)
+            return await browser.text('title')
+
+Methods which talk to node.js are coroutines; so are the properties which
+read from it (e.g., ``await browser.location``, ``await node.innerHTML``).
+Properties can't be assigned asynchronously, so ``DOMNode.value = x`` and
+``DOMNode.checked = x`` become :meth:`AsyncDOMNode.set_value` and
+:meth:`AsyncDOMNode.set_checked`.
+"""
+from zombie.browser import DOMSnapshot
+from zombie.proxy.aioclient import AsyncZombieProxyClient
+from zombie.proxy.server import ZombieProxyServer
+
+__all__ = ['AsyncBrowser', 'AsyncDOMNode']
+
+
+class AsyncBrowser(object):
+    """
+    An asyncio counterpart of :class:`zombie.browser.Browser`.
+    """
+
+    def __init__(self, server=None, ttl=None, timeout=None, logger=None):
+        """
+        Start a new AsyncBrowser instance.
+
+        :param server: an (optional) instance of
+                       :class:`zombie.proxy.server.ZombieProxyServer` (or
+                       :class:`zombie.proxy.server.ZombieProxyServerPool`).
+        :param ttl: an (optional) number of seconds the browser may be idle
+                    before the server destroys it.
+        :param timeout: an (optional) default number of seconds to wait for
+                        node.js to respond before raising
+                        :class:`zombie.proxy.client.TimeoutError`.
+        :param logger: an (optional) :class:`logging.Logger` for the log
+                       records node.js sends about this browser.
+        """
+        #
+        # If a proxy server isn't specified, spawn one automatically.
+        #
+        if server is None:
+            server = ZombieProxyServer()
+        self.server = server
+        self.worker = server.acquire()
+        self.client = AsyncZombieProxyClient(
+            self.worker.socket, ttl=ttl, timeout=timeout, server=self.worker,
+            logger=logger)
+
+    async def close(self):
+        """
+        Destroy this browser (and any elements it references) in the
+        node.js server.
+        """
+        await self.client.close()
+        if self.worker is not None:
+            self.server.release(self.worker)
+            self.worker = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    def batch(self):
+        """
+        An asynchronous context manager which queues browser operations and
+        sends them to node.js in a single round trip when the block exits,
+        e.g.,
+        ::
+            async with browser.batch() as batch:
+                await browser.fill('q', 'Zombie.js')
+                await browser.pressButton('Search')
+            batch.results  # [None, None]
+
+        See :meth:`zombie.browser.Browser.batch`.
+        """
+        return self.client.batch()
+
+    #
+    # Forms
+    #
+    async def fill(self, field, value):
+        await self.client.call('fill', field, value)
+        return self
+
+    async def pressButton(self, selector, timeout=None):
+        await self.client.call('pressButton', selector, timeout=timeout)
+        return self
+
+    async def check(self, selector):
+        await self.client.call('check', selector)
+        return self
+
+    async def uncheck(self, selector):
+        await self.client.call('uncheck', selector)
+        return self
+
+    async def select(self, selector, value):
+        await self.client.call('select', selector, value)
+        return self
+
+    async def selectOption(self, selector):
+        await self.client.call('selectOption', selector)
+        return self
+
+    async def unselect(self, selector, value):
+        await self.client.call('unselect', selector, value)
+        return self
+
+    async def attach(self, selector, filename):
+        await self.client.call('attach', selector, filename)
+        return self
+
+    async def choose(self, selector):
+        await self.client.call('choose', selector)
+        return self
+
+    #
+    # query
+    #
+    async def field(self, selector, context=None):
+        element = await self.client.call_element('field', selector, context)
+        return AsyncDOMNode.factory(element, self)
+
+    #
+    # Document Content
+    #
+    async def load(self, html):
+        await self.client.call('load', html)
+
+    @property
+    async def body(self):
+        element = await self.client.call_element('body')
+        return AsyncDOMNode.factory(element, self)
+
+    async def html(self, selector=None, context=None):
+        return await self.client.call('html', selector, context)
+
+    async def query(self, selector, context=None, snapshot=False):
+        if snapshot:
+            data = await self.client.call('query_snapshot', selector, context)
+            return AsyncDOMSnapshot.factory(data, self)
+        element = await self.client.call_element('query', selector, context)
+        return AsyncDOMNode.factory(element, self)
+
+    async def queryAll(self, selector, context=None, attrs=None,
+                       snapshot=False):
+        if attrs is not None:
+            return await self.client.call(
+                'query_attrs', selector, context, list(attrs))
+        if snapshot:
+            data = await self.client.call(
+                'query_all_snapshots', selector, context)
+            return [AsyncDOMSnapshot(d, self) for d in data]
+        elements = await self.client.call_elements(
+            'queryAll', selector, context)
+        return [AsyncDOMNode(e, self) for e in elements]
+
+    async def css(self, selector, context=None, attrs=None, snapshot=False):
+        return await self.queryAll(selector, context, attrs, snapshot)
+
+    async def text(self, selector, context=None):
+        return await self.client.call('text', selector, context)
+
+    async def unselectOption(self, selector):
+        node = await self.query(selector)
+        await node.unselectOption()
+        return self
+
+    #
+    # Navigation
+    #
+    async def clickLink(self, selector, timeout=None):
+        await self.client.call('clickLink', selector, timeout=timeout)
+        return self
+
+    @property
+    async def location(self):
+        return await self.client.call('location')
+
+    async def visit(self, url, timeout=None):
+        await self.client.call('visit', url, timeout=timeout)
+        return self
+
+    async def back(self, timeout=None):
+        await self.client.call('back', timeout=timeout)
+        return self
+
+    async def link(self, selector):
+        element = await self.client.call_element('link', selector)
+        return AsyncDOMNode.factory(element, self)
+
+    async def reload(self, timeout=None):
+        await self.client.call('reload', timeout=timeout)
+        return self
+
+    @property
+    async def statusCode(self):
+        return await self.client.call('statusCode')
+
+    @property
+    async def success(self):
+        return await self.client.call('success')
+
+    @property
+    async def redirected(self):
+        return await self.client.call('redirected')
+
+    async def fire(self, selector, event_name, timeout=None):
+        await self.client.call('fire', selector, event_name, timeout=timeout)
+        return self
+
+    #
+    # Debugging
+    #
+    async def dump(self):
+        await self.client.json('browser.dump()')
+
+    async def get_resource(self, url):
+        return await self.client.call('get_resource', url)
+
+    async def post_resource(self, url, form_params):
+        options = {
+            'headers': {
+                'content-type': 'application/x-www-form-urlencoded'},
+            'params': form_params}
+        return await self.client.call('post_resource', url, options)
+
+    async def evaluate(self, code):
+        return await self.client.call('evaluate', code)
+
+    async def wait(self, wait_argument=None, timeout=None):
+        arguments = [] if wait_argument is None else [wait_argument]
+        await self.client.call('wait', *arguments, timeout=timeout)
+
+
+class AsyncDOMNode(object):
+    """
+    An asyncio counterpart of :class:`zombie.browser.DOMNode`.
+    """
+    @staticmethod
+    def factory(element, browser):
+        if element is None:
+            return None
+        return AsyncDOMNode(element, browser)
+
+    def __init__(self, element, browser):
+        self.element = element
+        self.client = browser.client
+        self.browser = browser
+
+    async def query(self, selector, snapshot=False):
+        return await self.browser.query(selector, self.element, snapshot)
+
+    async def queryAll(self, selector, attrs=None, snapshot=False):
+        return await self.browser.queryAll(
+            selector, self.element, attrs, snapshot)
+
+    async def css(self, selector, attrs=None, snapshot=False):
+        return await self.queryAll(selector, attrs, snapshot)
+
+    #
+    # Forms
+    #
+    async def fill(self, value):
+        return await self.browser.fill(self.element, value)
+
+    async def pressButton(self):
+        return await self.browser.pressButton(self.element)
+
+    async def check(self):
+        return await self.browser.check(self.element)
+
+    async def uncheck(self):
+        return await self.browser.uncheck(self.element)
+
+    async def select(self, value):
+        return await self.browser.select(self.element, value)
+
+    async def selectOption(self):
+        return await self.browser.selectOption(self.element)
+
+    async def unselect(self, value):
+        return await self.browser.unselect(self.element, value)
+
+    async def unselectOption(self):
+        return await self.client.call('unselectOption', self.element)
+
+    async def attach(self, filename):
+        return await self.browser.attach(self.element, filename)
+
+    async def choose(self):
+        return await self.browser.choose(self.element)
+
+    def field(self):
+        return self
+
+    #
+    # Attribute (normal and specialized)
+    # access methods.
+    #
+    @property
+    async def text(self):
+        return await self._jsonattr('textContent')
+
+    @property
+    async def innerText(self):
+        return await self._jsonattr('textContent')
+
+    @property
+    async def html(self):
+        return await self._jsonattr('innerHTML')
+
+    @property
+    async def tagName(self):
+        return (await self._jsonattr('tagName')).lower()
+
+    @property
+    async def value(self):
+        attrs = await self.attrs('tagName', 'value', 'textContent')
+        if attrs['tagName'].lower() == 'textarea':
+            return attrs['textContent']
+        return attrs['value']
+
+    async def set_value(self, value):
+        """
+        Used to set the ``value`` of form elements.
+        """
+        await self.client.call('set_field', self.element, value)
+
+    @property
+    async def checked(self):
+        return await self._jsonattr('checked')
+
+    async def set_checked(self, value):
+        """
+        Used to set the ``checked`` attribute of an ``<input
+        type="checkbox">``.
+        """
+        await self.client.call('check_field', self.element, value)
+
+    async def attrs(self, *names):
+        return await self.client.call('attrs', self.element, list(names))
+
+    async def _jsonattr(self, attr):
+        return await self.client.call('attr', self.element, attr)
+
+    def __getattr__(self, name):
+        return self._jsonattr(name)
+
+    def __getitem__(self, name):
+        return self._jsonattr(name)
+
+    #
+    # Events
+    #
+    async def fire(self, event):
+        await self.browser.fire(self.element, event)
+        return self
+
+    async def click(self):
+        await self.fire('click')
+        return self
+
+    #
+    # Private methods
+    #
+    @property
+    def json(self):
+        return self.element.json
+
+    @property
+    def ref(self):
+        return self.element.ref
+
+    def __repr__(self):
+        # Describing the node would take a round trip; see attrs().
+        return "<AsyncDOMNode %s>" % self.element.json
+
+
+class AsyncDOMSnapshot(DOMSnapshot):
+    """
+    A :class:`zombie.browser.DOMSnapshot` whose :meth:`live` node is an
+    :class:`AsyncDOMNode`.
+    """
+
+    __slots__ = ()
+
+    @staticmethod
+    def factory(data, browser):
+        if data is None:
+            return None
+        return AsyncDOMSnapshot(data, browser)
+
+    def live(self):
+        return AsyncDOMNode(self.element, self.browser)
@@ -0,0 +1,251 @@
+"""
+Benchmarks for the round trip to node.js and common browser operations,
+run against pages served locally (by :mod:`zombie.tests.webserver`), e.g.,
+::
+    $ python -m zombie.bench --iterations 200 --json results.json
+
+Each benchmark reports the latency of its operation (``p50``, ``p95`` and
+``p99``, as well as ``min``, ``max`` and ``mean``, in milliseconds) and its
+throughput (``per_second``).  The JSON output is meant to be kept, so runs
+can be compared for regressions.
+"""
+import collections
+import math
+import platform
+import sys
+import time
+import timeit
+
+from zombie.browser import Browser
+from zombie.compat import to_bytes
+from zombie.proxy.server import NodeProcess
+from zombie.tests.webserver import WSGIRunner, build_test_app
+
+__all__ = ['run', 'summarize', 'percentile', 'BENCHMARKS', 'Options']
+
+#
+# Every benchmark, by name: a function of (browser, site, options) which
+# prepares the browser and returns a (prepare, operation) pair.  Only
+# ``operation`` is timed; ``prepare`` (if not None) runs before each call.
+#
+BENCHMARKS = collections.OrderedDict()
+
+
+def benchmark(name):
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+def table_page(rows):
+    """
+    A page with a table of ``rows`` rows (of three cells each).
+    """
+    cells = ''.join(
+        '<tr><td class="id">%d</td><td class="name">Row %d</td>'
+        '<td><a href="/rows/%d">details</a></td></tr>' % (i, i, i)
+        for i in range(rows))
+    return (
+        '<!doctype html><html><head><title>Table</title></head><body>'
+        '<table id="rows">%s</table></body></html>' % cells)
+
+
+def large_page(size):
+    """
+    A page of (about) ``size`` kilobytes of paragraphs.
+    """
+    paragraph = '<p>%s</p>' % ('Lorem ipsum dolor sit amet. ' * 36)
+    count = int(math.ceil(size * 1024.0 / len(paragraph)))
+    return (
+        '<!doctype html><html><head><title>Large</title></head><body>'
+        '%s</body></html>' % (paragraph * count))
+
+
+class Site(object):
+    """
+    Serves the test application of :mod:`zombie.tests.webserver`, as well
+    as the generated pages the benchmarks need, on a random port.
+    """
+
+    def __init__(self, options):
+        builder = build_test_app()
+        self.add_page(builder, '/table', table_page(options.rows))
+        self.add_page(builder, '/large', large_page(options.size))
+        self.runner = WSGIRunner(builder)
+
+    def add_page(self, builder, path, html):
+        contents = to_bytes(html)
+
+        def action(environ, start_response):
+            start_response('200 OK', [('Content-Type', 'text/html')])
+            return contents
+
+        builder.add_route('GET', path, action)
+
+    def url(self, path):
+        return 'http://127.0.0.1:%s%s' % (self.runner.port, path)
+
+    def __enter__(self):
+        self.runner.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.runner.stop()
+
+
+@benchmark('ping')
+def ping(browser, site, options):
+    """
+    A round trip to node.js which doesn't touch a browser.
+    """
+    return None, browser.client.ping
+
+
+@benchmark('visit')
+def visit(browser, site, options):
+    url = site.url('/')
+    return None, lambda: browser.visit(url)
+
+
+@benchmark('query_all')
+def query_all(browser, site, options):
+    """
+    Fetch a property of every cell of an ``--rows`` row table.
+    """
+    browser.visit(site.url('/table'))
+    return None, lambda: browser.queryAll('td', attrs=['textContent'])
+
+
+@benchmark('query_all_nodes')
+def query_all_nodes(browser, site, options):
+    """
+    Like ``query_all``, but fetch the property from each node in turn.
+    """
+    browser.visit(site.url('/table'))
+    return None, lambda: [node.text for node in browser.queryAll('td.name')]
+
+
+@benchmark('fill_submit')
+def fill_submit(browser, site, options):
+    """
+    Fill a form's text field and submit it (loading the next page).
+    """
+    url = site.url('/')
+
+    def submit():
+        browser.fill('q', 'Zombie.js')
+        browser.pressButton('Search')
+
+    return lambda: browser.visit(url), submit
+
+
+@benchmark('html')
+def html(browser, site, options):
+    """
+    Fetch the HTML of a ``--size`` kilobyte page.
+    """
+    browser.visit(site.url('/large'))
+    return None, browser.html
+
+
+def percentile(samples, p):
+    """
+    The ``p`` percentile (by nearest rank) of a sorted list of samples.
+    """
+    rank = int(math.ceil(p / 100.0 * len(samples)))
+    return samples[min(max(rank, 1), len(samples)) - 1]
+
+
+def summarize(samples):
+    """
+    Summarize a list of durations (in seconds) in milliseconds.
+    """
+    ordered = sorted(samples)
+    total = sum(ordered)
+    return {
+        'iterations': len(ordered),
+        'min': ordered[0] * 1000,
+        'max': ordered[-1] * 1000,
+        'mean': total / len(ordered) * 1000,
+        'p50': percentile(ordered, 50) * 1000,
+        'p95': percentile(ordered, 95) * 1000,
+        'p99': percentile(ordered, 99) * 1000,
+        'per_second': len(ordered) / total if total else None
+    }
+
+
+def measure(prepare, operation, iterations, warmup):
+    """
+    Time ``iterations`` calls of ``operation`` (after ``warmup`` untimed
+    ones), and return the durations in seconds.
+    """
+    timer = timeit.default_timer
+    samples = []
+    for i in range(warmup + iterations):
+        if prepare is not None:
+            prepare()
+        started = timer()
+        operation()
+        if i >= warmup:
+            samples.append(timer() - started)
+    return samples
+
+
+class Options(object):
+    """
+    The default options of :func:`run`.
+    """
+    iterations = 100
+    warmup = 5
+    rows = 500
+    size = 512
+
+
+def run(names=None, **options):
+    """
+    Run benchmarks (by default, all of :data:`BENCHMARKS`), each with its
+    own browser, in a node.js server spawned for the run, and return their
+    results, ready to be serialized as JSON.
+
+    :param names: the names of the benchmarks to run.
+    :param iterations: how many times to time each operation.
+    :param warmup: how many (untimed) times to run each operation first.
+    :param rows: the number of rows of the ``query_all`` benchmarks' table.
+    :param size: the size (in kilobytes) of the ``html`` benchmark's page.
+    """
+    for name in names or []:
+        if name not in BENCHMARKS:
+            raise ValueError("Unknown benchmark: %s" % name)
+    settings = Options()
+    for key, value in options.items():
+        if not hasattr(Options, key):
+            raise TypeError("Unknown option: %s" % key)
+        setattr(settings, key, value)
+    if settings.iterations < 1:
+        raise ValueError("iterations must be at least 1")
+
+    results = collections.OrderedDict()
+    server = NodeProcess()
+    try:
+        with Site(settings) as site:
+            for name, setup in BENCHMARKS.items():
+                if names and name not in names:
+                    continue
+                with Browser(server=server) as browser:
+                    prepare, operation = setup(browser, site, settings)
+                    results[name] = summarize(measure(
+                        prepare, operation,
+                        settings.iterations, settings.warmup))
+    finally:
+        server.stop()
+
+    return {
+        'timestamp': time.time(),
+        'python': platform.python_version(),
+        'platform': sys.platform,
+        'options': dict(
+            (key, getattr(settings, key))
+            for key in ('iterations', 'warmup', 'rows', 'size')),
+        'benchmarks': results
+    }
@@ -0,0 +1,88 @@
+"""
+Run the benchmarks of :mod:`zombie.bench` and print their results, e.g.,
+::
+    $ python -m zombie.bench ping visit --iterations 500
+    $ python -m zombie.bench --json - > results.json
+"""
+import argparse
+import json
+import sys
+
+from zombie.bench import BENCHMARKS, Options, run
+
+COLUMNS = ('p50', 'p95', 'p99', 'mean', 'max', 'per_second')
+
+
+def cell(value):
+    """
+    Format a value of the table (``-`` if it's missing, e.g., the throughput
+    of operations too fast to time).
+    """
+    if value is None:
+        return '%12s' % '-'
+    return '%12.2f' % value
+
+
+def report(results, out):
+    """
+    Print a table of results (latencies in milliseconds).
+    """
+    out.write('%-16s' % 'benchmark' +
+              ''.join('%12s' % column for column in COLUMNS) + '\n')
+    for name, stats in results['benchmarks'].items():
+        out.write('%-16s' % name +
+                  ''.join(cell(stats[column]) for column in COLUMNS) + '\n')
+
+
+def positive(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError('must be at least 1: %s' % value)
+    return number
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m zombie.bench',
+        description='Benchmark python-zombie against local pages.')
+    parser.add_argument(
+        'names', nargs='*', metavar='benchmark',
+        help='the benchmarks to run (%s; by default, all of them)' %
+             ', '.join(BENCHMARKS))
+    parser.add_argument(
+        '--iterations', type=positive, default=Options.iterations,
+        help='how many times to time each operation (default: %(default)s)')
+    parser.add_argument(
+        '--warmup', type=int, default=Options.warmup,
+        help='how many untimed runs come first (default: %(default)s)')
+    parser.add_argument(
+        '--rows', type=int, default=Options.rows,
+        help='the rows of the query_all table (default: %(default)s)')
+    parser.add_argument(
+        '--size', type=int, default=Options.size,
+        help='the kilobytes of the html page (default: %(default)s)')
+    parser.add_argument(
+        '--json', metavar='PATH',
+        help='write the results as JSON to PATH (- for stdout)')
+    args = parser.parse_args(argv)
+
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error('unknown benchmarks: %s' % ', '.join(unknown))
+
+    results = run(
+        args.names, iterations=args.iterations, warmup=args.warmup,
+        rows=args.rows, size=args.size)
+
+    if args.json == '-':
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+        return
+    report(results, sys.stdout)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,7 @@
 from zombie.proxy.server import ZombieProxyServer
-from zombie.proxy.client import ZombieProxyClient
+from zombie.proxy.client import ZombieProxyClient, encode_call
 
-__all__ = ['Browser', 'DOMNode']
+__all__ = ['Browser', 'DOMNode', 'DOMSnapshot']
 
 
 class Literal(object):
@@ -13,17 +13,58 @@ class Literal(object):
         return self.__value
 
 
+def describe(tagName, id, className):
+    """
+    A short, CSS-like description of a node, e.g., ``<FORM#form.search>``.
+    """
+    name = tagName.upper()
+    if id and className:
+        name = "%s#%s.%s" % (name, id, className)
+    elif id:
+        name = "%s#%s" % (name, id)
+    elif className:
+        name = "%s.%s" % (name, className)
+    return "<%s>" % name
+
+
 class Browser(object):
     """
     A Browser object, analogous to zombie.js' ``Browser``.
     """
 
-    def __init__(self, server=None):
+    def __init__(self, server=None, ttl=None, cache=False, timeout=None,
+                 replay=False, logger=None):
         """
         Start a new Browser instance.
 
         :param server: an (optional) instance of
-                       :class:`zombie.proxy.server.ZombieProxyServer`.
+                       :class:`zombie.proxy.server.ZombieProxyServer` (or
+                       :class:`zombie.proxy.server.ZombieProxyServerPool`,
+                       which assigns the browser to one of its servers).
+        :param ttl: an (optional) number of seconds the browser may be idle
+                    before the server destroys it.
+        :param cache: when True, remember the results of :attr:`location`,
+                      :attr:`statusCode`, :attr:`success`,
+                      :attr:`redirected`, :meth:`html` and :meth:`text`
+                      until the browser navigates (``visit``, ``back``,
+                      ``reload``, ``clickLink``, ``pressButton``, ``fire``,
+                      ``load``, ``wait`` or ``evaluate``).  Changes made to
+                      the document by other means (e.g., page timers) aren't
+                      noticed.
+        :param timeout: an (optional) default number of seconds to wait for
+                        node.js to respond before raising
+                        :class:`zombie.proxy.client.TimeoutError`; the
+                        navigation methods also accept their own
+                        ``timeout``.
+        :param replay: when True, if the node.js server dies and is
+                       respawned, revisit the last URL passed to
+                       :meth:`visit` in the new server (the call which
+                       noticed still raises
+                       :class:`zombie.proxy.client.ServerRestarted`).
+        :param logger: an (optional) :class:`logging.Logger` for the log
+                       records node.js sends about this browser, e.g., the
+                       console output of its pages (if the server was
+                       spawned with a ``log_level``).
         """
         #
         # If a proxy server isn't specified, spawn one automatically.
@@ -31,7 +72,95 @@ class Browser(object):
         if server is None:
             server = ZombieProxyServer()
         self.server = server
-        self.client = ZombieProxyClient(server.socket)
+        self.worker = server.acquire()
+        self.client = ZombieProxyClient(
+            self.worker.socket, ttl=ttl, timeout=timeout, server=self.worker,
+            logger=logger)
+        if replay:
+            self.client.on_restart = self._replay
+        # The last URL visited (successfully)
+        self.last_visit = None
+        self.cache = cache
+        self.__results = {}
+        self.__results_key = None
+
+    def _cached_call(self, op, *args):
+        """
+        ``self.client.call(op, *args)``, served from the cache (if enabled)
+        while the document hasn't changed.
+        """
+        if not self.cache or self.client._batch is not None:
+            return self.client.call(op, *args)
+
+        key = (op, encode_call(args))
+        if (self.__results_key == (self.client.session,
+                                   self.client.generation) and
+                key in self.__results):
+            return self.__results[key]
+
+        result = self.client.call(op, *args)
+        # The response reported the generation of the session's document
+        results_key = (self.client.session, self.client.generation)
+        if self.__results_key != results_key:
+            self.__results.clear()
+            self.__results_key = results_key
+        self.__results[key] = result
+        return result
+
+    def _replay(self):
+        """
+        Revisit :attr:`last_visit` after the server has been respawned.
+        """
+        # If revisiting kills the server again, don't try a second time
+        url, self.last_visit = self.last_visit, None
+        if url is None:
+            return
+        try:
+            self.visit(url)
+        except Exception:
+            # The restart is reported either way
+            pass
+
+    def close(self):
+        """
+        Destroy this browser (and any elements it references) in the
+        node.js server.  Other browsers sharing the server are unaffected.
+        If the browser came from a
+        :class:`zombie.proxy.server.ZombieProxyServerPool`, its server is
+        handed back to the pool.
+
+        Browsers can also be used as context managers, which close them on
+        exit, e.g.,
+        ::
+            with Browser() as browser:
+                browser.visit('http://www.example.com/')
+        """
+        self.client.close()
+        if self.worker is not None:
+            self.server.release(self.worker)
+            self.worker = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def batch(self):
+        """
+        A context manager which queues browser operations and sends them to
+        node.js in a single round trip when the block exits, e.g.,
+        ::
+            with browser.batch() as batch:
+                browser.fill('q', 'Zombie.js').check('mycheckbox')
+                browser.pressButton('Search')
+            batch.results  # [None, None, None]
+
+        Operations which need a result straight away (e.g., ``query``)
+        can't be used inside of a batch.  See
+        :meth:`zombie.proxy.client.ZombieProxyClient.batch`.
+        """
+        return self.client.batch()
 
     #
     # Forms
@@ -44,53 +173,54 @@ class Browser(object):
         :param value: any string value
         :return: self to allow function chaining.
         """
-        self.client.nowait('browser.fill', (field, value))
+        self.client.call('fill', field, value)
         return self
 
-    def pressButton(self, selector):
+    def pressButton(self, selector, timeout=None):
         """
         Press a specific button.
 
         :param selector: CSS selector or innerText
+        :param timeout: an (optional) number of seconds to wait for the
+                        resulting page to load.
         :return: self to allow function chaining.
         """
-        self.client.wait('browser.pressButton', selector)
+        self.client.call('pressButton', selector, timeout=timeout)
         return self
 
     def check(self, selector):
-        self.client.nowait('browser.check', (selector,))
+        self.client.call('check', selector)
         return self
 
     def uncheck(self, selector):
-        self.client.nowait('browser.uncheck', (selector,))
+        self.client.call('uncheck', selector)
         return self
 
     def select(self, selector, value):
-        self.client.nowait('browser.select', (selector, value))
+        self.client.call('select', selector, value)
         return self
 
     def selectOption(self, selector):
-        self.client.nowait('browser.selectOption', (selector,))
+        self.client.call('selectOption', selector)
         return self
 
     def unselect(self, selector, value):
-        self.client.nowait('browser.unselect', (selector, value))
+        self.client.call('unselect', selector, value)
         return self
 
     def attach(self, selector, filename):
-        self.client.nowait('browser.attach', (selector, filename))
+        self.client.call('attach', selector, filename)
         return self
 
     def choose(self, selector):
-        self.client.nowait('browser.choose', (selector, ))
+        self.client.call('choose', selector)
         return self
 
     #
     # query
     #
     def field(self, selector, context=None):
-        element = self.client.create_element(
-            'browser.field', (selector, context))
+        element = self.client.call_element('field', selector, context)
         return DOMNode(element, self)
 
     #
@@ -100,7 +230,7 @@ class Browser(object):
         """
         Loads raw html
         """
-        self.client.wait('browser.load', html)
+        self.client.call('load', html)
 
     @property
     def body(self):
@@ -108,7 +238,7 @@ class Browser(object):
         Returns a :class:`zombie.dom.DOMNode` representing the body element of
         the current document.
         """
-        element = self.client.create_element('browser.body')
+        element = self.client.call_element('body')
         return DOMNode(element, self)
 
     def html(self, selector=None, context=None):
@@ -119,9 +249,37 @@ class Browser(object):
                         (http://zombie.labnotes.org/selectors)
         :param context: an (optional) instance of :class:`zombie.dom.DOMNode`
         """
-        return self.client.json('browser.html', (selector, context))
+        return self._cached_call('html', selector, context)
+
+    def iter_html(self, selector=None, context=None, chunk_size=65536):
+        """
+        Like :meth:`html`, but yields the HTML in pieces (of up to
+        ``chunk_size`` characters) as they arrive from node.js.
 
-    def query(self, selector, context=None):
+        :param selector: an optional string CSS selector
+                        (http://zombie.labnotes.org/selectors)
+        :param context: an (optional) instance of :class:`zombie.dom.DOMNode`
+        :param chunk_size: the length of each piece
+        """
+        return self.client.stream(
+            'browser.html', (selector, context), chunk_size)
+
+    def save_html(self, path, selector=None, context=None, chunk_size=65536):
+        """
+        Write the HTML content of the current document to a file (as UTF-8)
+        without holding all of it in memory.
+
+        :param path: the filename to write
+        :param selector: an optional string CSS selector
+                        (http://zombie.labnotes.org/selectors)
+        :param context: an (optional) instance of :class:`zombie.dom.DOMNode`
+        :param chunk_size: the length of each piece written
+        """
+        with open(path, 'wb') as f:
+            for chunk in self.iter_html(selector, context, chunk_size):
+                f.write(chunk.encode('utf-8'))
+
+    def query(self, selector, context=None, snapshot=False):
         """
         Evaluate a CSS selector against the document (or an optional context
         :class:`zombie.dom.DOMNode`) and return a single
@@ -130,34 +288,55 @@ class Browser(object):
         :param selector: a string CSS selector
                         (http://zombie.labnotes.org/selectors)
         :param context: an (optional) instance of :class:`zombie.dom.DOMNode`
+        :param snapshot: when True, return a :class:`DOMSnapshot` instead.
         """
-        element = self.client.create_element(
-            'browser.query', (selector, context))
+        if snapshot:
+            data = self.client.call('query_snapshot', selector, context)
+            return DOMSnapshot.factory(data, self)
+        element = self.client.call_element('query', selector, context)
         return DOMNode.factory(element, self)
 
-    def queryAll(self, selector, context=None):
+    def queryAll(self, selector, context=None, attrs=None, snapshot=False):
         """
         Evaluate a CSS selector against the document (or an optional context
         :class:`zombie.dom.DOMNode`) and return a list of
-        :class:`zombie.dom.DOMNode` objects.
+        :class:`zombie.dom.DOMNode` (or, if ``snapshot`` is True,
+        :class:`DOMSnapshot`) objects.
+
+        If ``attrs`` is given, a list of dictionaries holding those
+        properties of each matched element is returned instead, e.g.,
+        ::
+            browser.queryAll('a', attrs=['href', 'textContent'])
+            [{'href': 'http://...', 'textContent': 'Home'}, ...]
+
+        ...which takes a single round trip, however many elements match.
 
         :param selector: a string CSS selector
                         (http://zombie.labnotes.org/selectors)
         :param context: an (optional) instance of :class:`zombie.dom.DOMNode`
-        """
-        elements = self.client.create_elements(
-            'browser.queryAll', (selector, context))
+        :param attrs: an (optional) list of property names to fetch
+        :param snapshot: when True, return :class:`DOMSnapshot` objects.
+        """
+        if attrs is not None:
+            return self.client.call(
+                'query_attrs', selector, context, list(attrs))
+        if snapshot:
+            data = self.client.call('query_all_snapshots', selector, context)
+            return [DOMSnapshot(d, self) for d in data]
+        elements = self.client.call_elements('queryAll', selector, context)
         return [DOMNode(e, self) for e in elements]
 
-    def css(self, selector, context=None):
+    def css(self, selector, context=None, attrs=None, snapshot=False):
         """
         An alias for :class:`zombie.browser.Browser.queryAll`.
 
         :param selector: a string CSS selector
                         (http://zombie.labnotes.org/selectors)
         :param context: an (optional) instance of :class:`zombie.dom.DOMNode`
+        :param attrs: an (optional) list of property names to fetch
+        :param snapshot: when True, return :class:`DOMSnapshot` objects.
         """
-        return self.queryAll(selector, context)
+        return self.queryAll(selector, context, attrs, snapshot)
 
     def text(self, selector, context=None):
         """
@@ -167,7 +346,7 @@ class Browser(object):
                         (http://zombie.labnotes.org/selectors)
         :param context: an (optional) instance of :class:`zombie.dom.DOMNode`
         """
-        return self.client.json('browser.text', (selector, context))
+        return self._cached_call('text', selector, context)
 
     def unselectOption(self, selector):
         """
@@ -184,16 +363,18 @@ class Browser(object):
     #
     # Navigation
     #
-    def clickLink(self, selector):
+    def clickLink(self, selector, timeout=None):
         """
         Clicks on a link. The first argument is the link text or CSS selector.
 
         :param selector: an optional string CSS selector
                         (http://zombie.labnotes.org/selectors) or inner text
+        :param timeout: an (optional) number of seconds to wait for the
+                        resulting page to load.
 
         Returns the :class:`zombie.browser.Browser` to allow function chaining.
         """
-        self.client.wait('browser.clickLink', selector)
+        self.client.call('clickLink', selector, timeout=timeout)
         return self
 
     @property
@@ -202,7 +383,7 @@ class Browser(object):
         Returns the location of the current document (same as
         ``window.location.toString()``).
         """
-        return self.client.json('browser.location.toString()')
+        return self._cached_call('location')
 
     @location.setter
     def location(self, url):
@@ -213,22 +394,32 @@ class Browser(object):
         """
         self.visit(url)
 
-    def visit(self, url):
+    def visit(self, url, timeout=None):
         """
         A shortcut to load the document from the specified URL.
 
+        :param timeout: an (optional) number of seconds to wait for the page
+                        to load before raising
+                        :class:`zombie.proxy.client.TimeoutError` (and
+                        stopping the page from loading).
+
         Returns the :class:`zombie.browser.Browser` to allow function chaining.
         """
-        self.client.wait('browser.visit', url)
+        self.client.call('visit', url, timeout=timeout)
+        if self.client._batch is None:
+            self.last_visit = url
         return self
 
-    def back(self):
+    def back(self, timeout=None):
         """
         Navigate to the previous page in history.
 
+        :param timeout: an (optional) number of seconds to wait for the page
+                        to load.
+
         Returns the :class:`zombie.browser.Browser` to allow function chaining.
         """
-        self.client.wait('browser.back')
+        self.client.call('back', timeout=timeout)
         return self
 
     def link(self, selector):
@@ -240,16 +431,19 @@ class Browser(object):
         :param selector: an optional string CSS selector
                         (http://zombie.labnotes.org/selectors) or inner text
         """
-        element = self.client.create_element('browser.link', (selector,))
+        element = self.client.call_element('link', selector)
         return DOMNode(element, self)
 
-    def reload(self):
+    def reload(self, timeout=None):
         """
         Reloads the current page.
 
+        :param timeout: an (optional) number of seconds to wait for the page
+                        to load.
+
         Returns the :class:`zombie.browser.Browser` to allow function chaining.
         """
-        self.client.wait('browser.reload')
+        self.client.call('reload', timeout=timeout)
         return self
 
     @property
@@ -257,24 +451,24 @@ class Browser(object):
         """
         Returns the status code returned for this page request (200, 303, etc).
         """
-        return self.client.json('browser.statusCode')
+        return self._cached_call('statusCode')
 
     @property
     def success(self):
         """
         Returns ``True`` if the status code is 2xx.
         """
-        return self.client.json('browser.success')
+        return self._cached_call('success')
 
     @property
     def redirected(self):
         """
         Returns ``True`` if the page request followed a redirect.
         """
-        return self.client.json('browser.redirected')
+        return self._cached_call('redirected')
 
-    def fire(self, selector, event_name):
-        self.client.wait('browser.fire', selector, event_name)
+    def fire(self, selector, event_name, timeout=None):
+        self.client.call('fire', selector, event_name, timeout=timeout)
         return self
 
     #
@@ -292,21 +486,21 @@ class Browser(object):
         """
         Gets a resource and returns a json with information
         """
-        return self.client.wait_return('browser.resources.get', url)
+        return self.client.call('get_resource', url)
 
     def post_resource(self, url, form_params):
         options = {
             'headers': {
                 'content-type': 'application/x-www-form-urlencoded'},
             'params': form_params}
-        return self.client.wait_return('browser.resources.post', url, options)
+        return self.client.call('post_resource', url, options)
 
     def evaluate(self, code):
-        return self.client.json('browser.evaluate', (code, ))
+        return self.client.call('evaluate', code)
 
-    def wait(self, wait_argument=None):
+    def wait(self, wait_argument=None, timeout=None):
         arguments = [] if wait_argument is None else [wait_argument]
-        self.client.wait('browser.wait', *arguments)
+        self.client.call('wait', *arguments, timeout=timeout)
 
     @property
     def resources(self):
@@ -361,31 +555,36 @@ class DOMNode(object):
         self.client = browser.client
         self.browser = browser
 
-    def query(self, selector):
+    def query(self, selector, snapshot=False):
         """
         Evaluate a CSS selector against this element and return a single
         (child) :class:`zombie.dom.DOMNode` object.
 
         :param selector: a string CSS selector
                         (http://zombie.labnotes.org/selectors)
+        :param snapshot: when True, return a :class:`DOMSnapshot` instead.
         """
-        return self.browser.query(selector, self.element)
+        return self.browser.query(selector, self.element, snapshot)
 
-    def queryAll(self, selector):
+    def queryAll(self, selector, attrs=None, snapshot=False):
         """
         Evaluate a CSS selector against this element and return a list of
-        (child) :class:`zombie.dom.DOMNode` objects.
+        (child) :class:`zombie.dom.DOMNode` objects (or, if ``attrs`` is
+        given, dictionaries of their properties; see
+        :class:`zombie.browser.Browser.queryAll`).
 
         :param selector: a string CSS selector
                         (http://zombie.labnotes.org/selectors)
+        :param attrs: an (optional) list of property names to fetch
+        :param snapshot: when True, return :class:`DOMSnapshot` objects.
         """
-        return self.browser.queryAll(selector, self.element)
+        return self.browser.queryAll(selector, self.element, attrs, snapshot)
 
-    def css(self, selector):
+    def css(self, selector, attrs=None, snapshot=False):
         """
         An alias for :class:`zombie.dom.DOMNode.queryAll`.
         """
-        return self.queryAll(selector)
+        return self.queryAll(selector, attrs, snapshot)
 
     #
     # Forms
@@ -458,7 +657,7 @@ class DOMNode(object):
 
         Returns the :class:`zombie.dom.DOMNode` to allow function chaining.
         """
-        return self.client.nowait('browser.unselectOption', (self.element,))
+        return self.client.call('unselectOption', self.element)
 
     def attach(self, filename):
         """
@@ -519,17 +718,17 @@ class DOMNode(object):
         """
         The ``value`` of the current node.
         """
-        if self.tagName == 'textarea':
-            return self.textContent
-        return self._jsonattr('value')
+        attrs = self.attrs('tagName', 'value', 'textContent')
+        if attrs['tagName'].lower() == 'textarea':
+            return attrs['textContent']
+        return attrs['value']
 
     @value.setter
     def value(self, value):
         """
         Used to set the ``value`` of form elements.
         """
-        self.client.nowait(
-            'set_field', (Literal('browser'), self.element, value))
+        self.client.call('set_field', self.element, value)
 
     @property
     def checked(self):
@@ -544,11 +743,20 @@ class DOMNode(object):
         Used to set the ``checked`` attribute of an ``<input
         type="checkbox">``.
         """
-        self.client.nowait(
-            'check_field', (Literal('browser'), self.element, value))
+        self.client.call('check_field', self.element, value)
+
+    def attrs(self, *names):
+        """
+        Fetch several properties of the current node in a single round trip
+        and return them as a dictionary, e.g.,
+        ::
+            node.attrs('id', 'className')
+            {'id': 'submit', 'className': 'button'}
+        """
+        return self.client.call('attrs', self.element, list(names))
 
     def _jsonattr(self, attr):
-        return self.client.json("%s.%s" % (self.element.json, attr))
+        return self.client.call('attr', self.element, attr)
 
     def __getattr__(self, name):
         return self._jsonattr(name)
@@ -586,12 +794,79 @@ class DOMNode(object):
     def json(self):
         return self.element.json
 
+    @property
+    def ref(self):
+        return self.element.ref
+
+    def __repr__(self):
+        attrs = self.attrs('tagName', 'id', 'className')
+        return describe(attrs['tagName'], attrs['id'], attrs['className'])
+
+
+class DOMSnapshot(object):
+    """
+    A read-only copy of a node's ``tagName``, ``id``, ``className``,
+    ``value``, ``textContent``, ``checked`` and (HTML) ``attributes``,
+    fetched in a single round trip with the query that matched it.  Reading
+    these never touches the node.js server.
+
+    Snapshots are *not* kept up to date: once the page changes (e.g., after
+    navigating or filling in a field) they are stale.  Use :meth:`live` to
+    get a :class:`DOMNode` referencing the same element.
+    """
+
+    __slots__ = ('element', 'browser', 'tagName', 'id', 'className', 'value',
+                 'textContent', 'checked', 'attributes')
+
+    @staticmethod
+    def factory(data, browser):
+        if data is None:
+            return None
+        return DOMSnapshot(data, browser)
+
+    def __init__(self, data, browser):
+        self.element = browser.client.element(data['index'])
+        self.browser = browser
+        self.tagName = data['tagName'].lower()
+        self.id = data['id']
+        self.className = data['className']
+        self.textContent = data['textContent']
+        self.checked = data['checked']
+        self.attributes = data['attributes']
+        self.value = data['value']
+        if self.tagName == 'textarea':
+            self.value = self.textContent
+
+    @property
+    def text(self):
+        """
+        The ``textContent`` of the node.
+        """
+        return self.textContent
+
+    @property
+    def innerText(self):
+        """
+        The ``textContent`` of the node.
+        """
+        return self.textContent
+
+    def live(self):
+        """
+        Returns a (live) :class:`DOMNode` for the same element.
+        """
+        return DOMNode(self.element, self.browser)
+
+    def __getitem__(self, name):
+        return getattr(self, name)
+
+    @property
+    def json(self):
+        return self.element.json
+
+    @property
+    def ref(self):
+        return self.element.ref
+
     def __repr__(self):
-        name, id, className = self.tagName.upper(), self.id, self.className
-        if id and className:
-            name = "%s#%s.%s" % (name, id, className)
-        elif id:
-            name = "%s#%s" % (name, id)
-        elif className:
-            name = "%s.%s" % (name, className)
-        return "<%s>" % name
+        return describe(self.tagName, self.id, self.className)
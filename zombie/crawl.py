@@ -0,0 +1,184 @@
+"""
+Visit many URLs in parallel and extract a few fields from each, e.g.,
+::
+    spec = {'title': 'title', 'links': ('a', 'href')}
+    for result in crawl(urls, spec, concurrency=8, timeout=30):
+        if result.error is None:
+            print(result.url, result.fields['title'], result.fields['links'])
+
+A spec maps each field to a CSS selector and the property to read from
+every element it matches (``textContent`` if only a selector is given);
+each field's value is the list of those properties.  Each URL is visited
+and extracted in a single round trip.
+
+Pass a :class:`zombie.proxy.server.ZombieProxyServerPool` as ``server`` to
+spread the browsers across several node.js processes.
+"""
+import collections
+import threading
+
+try:
+    import queue
+except ImportError:  # pragma: nocover
+    import Queue as queue
+
+from zombie.browser import Browser
+from zombie.proxy.client import TimeoutError
+from zombie.proxy.server import ZombieProxyServer
+
+__all__ = ['crawl', 'CrawlResult', 'CrawlTimeout']
+
+#
+# The outcome of visiting a URL: ``fields`` maps each field of the spec to
+# its values, unless visiting (or extracting) failed, in which case
+# ``fields`` is None and ``error`` holds the exception.
+#
+CrawlResult = collections.namedtuple('CrawlResult', ['url', 'fields', 'error'])
+
+# Returned by Crawler.next_url once every URL has been handed out
+DONE = object()
+
+
+class CrawlTimeout(Exception):
+    """
+    The error reported for a URL which took longer than the crawl's
+    ``timeout``.
+    """
+    pass
+
+
+def parse_spec(spec):
+    """
+    Turn a spec into a list of ``(name, selector, property)`` tuples.
+    """
+    fields = []
+    for name, field in spec.items():
+        if isinstance(field, (tuple, list)):
+            selector, prop = field
+        else:
+            selector, prop = field, 'textContent'
+        fields.append((name, selector, prop))
+    return fields
+
+
+def visit(browser, url, fields):
+    """
+    Visit a URL and extract fields (see :func:`parse_spec`) from it, in a
+    single round trip.
+    """
+    with browser.batch() as batch:
+        browser.visit(url)
+        for name, selector, prop in fields:
+            browser.queryAll(selector, attrs=[prop])
+    return dict(
+        (name, [attrs[prop] for attrs in values])
+        for (name, selector, prop), values in zip(fields, batch.results[1:])
+    )
+
+
+class CrawlWorker(threading.Thread):
+    """
+    Visits URLs, one at a time, with its own :class:`zombie.browser.Browser`.
+    A visit which takes longer than the crawl's ``timeout`` is aborted (by
+    node.js, too) and reported as a :class:`CrawlTimeout`.
+    """
+
+    def __init__(self, crawler):
+        super(CrawlWorker, self).__init__()
+        self.crawler = crawler
+        self.browser = Browser(server=crawler.server, timeout=crawler.timeout)
+        self.daemon = True
+
+    def run(self):
+        crawler = self.crawler
+        try:
+            while True:
+                url = crawler.next_url()
+                if url is DONE:
+                    break
+                try:
+                    result = CrawlResult(
+                        url, visit(self.browser, url, crawler.fields), None)
+                except TimeoutError:
+                    result = CrawlResult(url, None, CrawlTimeout(
+                        "%s took longer than %s seconds" %
+                        (url, crawler.timeout)))
+                except Exception as e:
+                    result = CrawlResult(url, None, e)
+                crawler.results.put(result)
+        finally:
+            try:
+                self.browser.close()
+            except Exception:
+                pass
+            crawler.results.put(self)
+
+
+class Crawler(object):
+    """
+    The state of a :func:`crawl`.
+    """
+
+    def __init__(self, urls, spec, concurrency=4, timeout=None, server=None):
+        self.urls = iter(urls)
+        self.fields = parse_spec(spec)
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.server = server or ZombieProxyServer()
+        self.results = queue.Queue()
+        self.lock = threading.Lock()
+        self.stopped = False
+
+    def next_url(self):
+        """
+        Hand a worker its next URL (or ``DONE``).
+        """
+        with self.lock:
+            if self.stopped:
+                return DONE
+            try:
+                return next(self.urls)
+            except StopIteration:
+                return DONE
+
+    def __iter__(self):
+        workers = set()
+        try:
+            for i in range(self.concurrency):
+                worker = CrawlWorker(self)
+                workers.add(worker)
+                worker.start()
+
+            # Workers put themselves on the queue once they've closed their
+            # browser
+            while workers:
+                result = self.results.get()
+                if isinstance(result, CrawlWorker):
+                    result.join()
+                    workers.discard(result)
+                else:
+                    yield result
+        finally:
+            # Whatever the workers are visiting is dropped
+            with self.lock:
+                self.stopped = True
+
+
+def crawl(urls, spec, concurrency=4, timeout=None, server=None):
+    """
+    Visit URLs with several browsers at once, and yield a
+    :class:`CrawlResult` for each as soon as it's done (i.e., in completion
+    order rather than the order of ``urls``).  Errors (including timeouts)
+    are reported in the results rather than raised.
+
+    :param urls: an iterable of URLs, consumed as browsers become free.
+    :param spec: a dictionary of the fields to extract from each page; see
+                 :mod:`zombie.crawl`.
+    :param concurrency: the number of pages to visit at once.
+    :param timeout: the number of seconds a URL may take before it's
+                    aborted and reported as a :class:`CrawlTimeout`.
+    :param server: an (optional) instance of
+                   :class:`zombie.proxy.server.ZombieProxyServer` or
+                   :class:`zombie.proxy.server.ZombieProxyServerPool`.
+    """
+    return iter(Crawler(urls, spec, concurrency, timeout, server))
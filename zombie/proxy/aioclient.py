@@ -0,0 +1,330 @@
+"""
+An asyncio-native counterpart of :mod:`zombie.proxy.client`, so many
+browsing sessions can be driven from a single event loop (Python 3.5+).
+"""
+import asyncio
+import itertools
+import socket
+import weakref
+
+from zombie.proxy import metrics
+from zombie.proxy.client import (
+    HEADER,
+    Batch,
+    TimeoutError,
+    ZombieProxyClient,
+    abort_message,
+    call_script,
+    create_element_script,
+    create_elements_script,
+    dumps,
+    frame,
+    nowait_script,
+    timeout_option,
+    wait_script)
+
+__all__ = ['AsyncZombieProxyClient']
+
+
+class AsyncChannel(object):
+    """
+    A persistent unix socket connection to a node.js server, shared by every
+    :class:`AsyncZombieProxyClient` on the same event loop.  Like
+    :class:`zombie.proxy.client.Channel`, requests are tagged with an id so
+    any number of them can be in flight at once.
+    """
+
+    __channels = weakref.WeakKeyDictionary()
+    # Held while connecting, by loop and address, so concurrent requests
+    # share a single connection
+    __locks = weakref.WeakKeyDictionary()
+
+    @classmethod
+    async def for_address(cls, socket_address, loop=None):
+        """
+        Return the (shared) channel for a unix socket address on an event
+        loop, (re)connecting if necessary.
+        """
+        loop = loop or asyncio.get_event_loop()
+        channels = cls.__channels.setdefault(loop, {})
+        channel = channels.get(socket_address)
+        if channel is not None and not channel.closed:
+            return channel
+        locks = cls.__locks.setdefault(loop, {})
+        lock = locks.get(socket_address)
+        if lock is None:
+            lock = locks[socket_address] = asyncio.Lock()
+        async with lock:
+            channel = channels.get(socket_address)
+            if channel is None or channel.closed:
+                reader, writer = await asyncio.open_unix_connection(
+                    socket_address)
+                channel = channels[socket_address] = cls(reader, writer, loop)
+        return channel
+
+    def __init__(self, reader, writer, loop):
+        self.closed = False
+        self.__reader = reader
+        self.__writer = writer
+        self.__loop = loop
+        self.__ids = itertools.count(1)
+        self.__pending = {}
+        self.__reading = loop.create_task(self.__read())
+
+    async def request(self, payload, timeout=None):
+        """
+        Send a (bytes) payload and wait for its response (or, if a
+        ``timeout`` is given, raise :class:`TimeoutError` after that many
+        seconds, aborting the request; it's aborted, too, if the waiting
+        task is cancelled).
+        """
+        if self.closed:
+            raise socket.error('Connection to the node.js server closed')
+        request_id = next(self.__ids) & 0xffffffff
+        response = self.__pending[request_id] = self.__loop.create_future()
+        try:
+            self.__writer.write(frame(payload, request_id))
+            await self.__writer.drain()
+            return await asyncio.wait_for(response, timeout)
+        except asyncio.TimeoutError:
+            self.abort(request_id)
+            raise TimeoutError(
+                "node.js didn't respond within %s seconds" % timeout)
+        except asyncio.CancelledError:
+            self.abort(request_id)
+            raise
+        finally:
+            self.__pending.pop(request_id, None)
+
+    def abort(self, request_id):
+        """
+        Have the server abort a request nobody is waiting for any more.
+        """
+        if not self.closed:
+            self.__writer.write(frame(
+                abort_message(request_id).encode('utf-8'),
+                next(self.__ids) & 0xffffffff))
+
+    def close(self):
+        """
+        Close the connection; requests still in flight fail with
+        :class:`socket.error`.
+        """
+        self.__close(socket.error('Connection to the node.js server closed'))
+
+    async def __read(self):
+        try:
+            while True:
+                size, request_id = HEADER.unpack(
+                    await self.__reader.readexactly(HEADER.size))
+                response = await self.__reader.readexactly(size)
+                pending = self.__pending.pop(request_id, None)
+                if pending is not None and not pending.done():
+                    pending.set_result(response)
+        except asyncio.IncompleteReadError:
+            self.__close(
+                socket.error('Connection closed by the node.js server'))
+        except Exception as e:
+            self.__close(e)
+
+    def __close(self, error):
+        if self.closed:
+            return
+        self.closed = True
+        self.__writer.close()
+        pending, self.__pending = self.__pending, {}
+        for response in pending.values():
+            if not response.done():
+                response.set_exception(error)
+
+
+class AsyncBatchContext(object):
+    """
+    The asynchronous context manager :meth:`AsyncZombieProxyClient.batch`
+    returns; it yields the client's :class:`zombie.proxy.client.Batch`, and
+    sends it once the (outermost) block exits.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.batch = None
+
+    async def __aenter__(self):
+        if self.client._batch is not None:
+            # Nested batches are merged into the outermost one
+            return self.client._batch
+        self.batch = self.client._batch = Batch()
+        return self.batch
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        batch = self.batch
+        if batch is None:
+            return
+        self.client._batch = None
+        if exc_type is not None:
+            return
+        batch.results = []
+        if batch.operations:
+            batch.results = await self.client._send(
+                batch.javascript, method='batch')
+
+
+class AsyncZombieProxyClient(ZombieProxyClient):
+    """
+    A :class:`zombie.proxy.client.ZombieProxyClient` whose methods are
+    coroutines.  Streaming isn't supported.
+    """
+
+    def __init__(self, socket_address, ttl=None, timeout=None, server=None,
+                 logger=None):
+        """
+        Establish a new :class:`AsyncZombieProxyClient`.
+
+        :param socket: a unix socket address to connect to.
+        :param ttl: the number of seconds the client's session may be idle
+                    before the server expires it (by default, the server's
+                    ``idle_timeout``).
+        :param timeout: the default number of seconds to wait for node.js
+                        to respond before raising :class:`TimeoutError` (by
+                        default, wait forever).
+        :param server: the (optional)
+                       :class:`zombie.proxy.server.NodeProcess` listening
+                       on ``socket_address``.
+        :param logger: a :class:`logging.Logger` for the log records node.js
+                       sends about this client's browser; needs ``server``.
+        """
+        super(AsyncZombieProxyClient, self).__init__(
+            socket_address, ttl, timeout, server, logger)
+        self.socket_address = socket_address
+        self.timeout = timeout
+
+    async def _send(self, javascript, timeout=None, method='script'):
+        """
+        Sends Javascript instructions to the zombie.js server within this
+        client's session.
+
+        Inside of a :meth:`batch`, the instructions are queued instead and
+        ``None`` is returned.
+
+        :param js: the Javascript string to execute
+        """
+        if self._batch is not None:
+            self._batch.append(javascript)
+            return None
+        return await self._session_request(
+            self._message(javascript), timeout, method)
+
+    async def _session_request(self, message, timeout=None, method=None):
+        with metrics.instrument(method) as timings:
+            try:
+                response = await self._raw_request(message, timeout, timings)
+                return self._session_result(response, timings)
+            except socket.error:
+                # Waiting for the server to be respawned blocks
+                await asyncio.get_event_loop().run_in_executor(
+                    None, self._check_restarted)
+                raise
+
+    async def _request(self, message, method=None):
+        """
+        Send a message as-is (i.e., outside of any client context) and
+        return its result.
+        """
+        with metrics.instrument(method) as timings:
+            response = await self._raw_request(message, timings=timings)
+            return self._handle_response(response, timings)
+
+    async def _raw_request(self, message, timeout=None, timings=None):
+        data = message.encode('utf-8')
+        if timings is not None:
+            timings['sent'] = len(data)
+            started = metrics.timer()
+        channel = await AsyncChannel.for_address(self.socket_address)
+        if timings is not None:
+            timings['connect'] = metrics.timer() - started
+        response = await channel.request(
+            data, self.timeout if timeout is None else timeout)
+        if timings is not None:
+            timings['received'] = len(response)
+        return response
+
+    async def call(self, op, *args, **kwargs):
+        timeout = timeout_option(kwargs)
+        if self._batch is not None:
+            self._batch.append(call_script(op, args))
+            return None
+        return await self._session_request(
+            self._call_message(op, args), timeout, op)
+
+    async def call_element(self, op, *args):
+        self._check_not_batched(op)
+        index = await self.call(op, *args)
+        if index is None:
+            return None
+        return self.element(index)
+
+    async def call_elements(self, op, *args):
+        self._check_not_batched(op)
+        return [self.element(index) for index in await self.call(op, *args)]
+
+    async def json(self, js, args=None):
+        return await self._send(
+            nowait_script("result = %s" % js, args), method='json')
+
+    async def nowait(self, js, args=None):
+        return await self._send(nowait_script(js, args), method='nowait')
+
+    async def wait(self, method, *args, **kwargs):
+        await self._send(
+            wait_script(method, args), timeout_option(kwargs), method)
+
+    async def wait_return(self, method, *args, **kwargs):
+        return await self._send(
+            wait_script(method, args, 'wait_n_return_callback'),
+            timeout_option(kwargs), method)
+
+    def stream(self, js, args=None, chunk_size=65536):
+        raise NotImplementedError(
+            "AsyncZombieProxyClient can't stream; use json() instead")
+
+    def batch(self):
+        """
+        An asynchronous context manager which queues every instruction sent
+        within it (the coroutines return None straight away) and sends them
+        in a single round trip when the block exits, e.g.,
+        ::
+            async with client.batch() as batch:
+                await client.call('visit', url)
+                await client.call('statusCode')
+            batch.results  # [None, 200]
+
+        See :meth:`zombie.proxy.client.ZombieProxyClient.batch`.
+        """
+        return AsyncBatchContext(self)
+
+    async def ping(self):
+        return await self._request('return_result(ping);', 'ping')
+
+    async def cleanup(self):
+        await self.nowait('cleanup()')
+        self._reset_session()
+
+    async def close(self):
+        self._released.clear()
+        await self._request(
+            "destroy_client(%s); return_result(null);" % dumps(self.session),
+            'close')
+        self._reset_session()
+
+    async def create_element(self, method, args=None):
+        self._check_not_batched('create_element')
+        index = await self.json(create_element_script(method, args))
+        if index is None:
+            return None
+
+        return self.element(index)
+
+    async def create_elements(self, method, args=[]):
+        self._check_not_batched('create_elements')
+        indexes = await self.json(create_elements_script(method, args))
+        return [self.element(index) for index in indexes]
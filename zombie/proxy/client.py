@@ -1,14 +1,61 @@
+import collections
 import contextlib
+import itertools
+import os
 import socket
+import struct
+import threading
+import uuid
+
+try:
+    import queue
+except ImportError:  # pragma: nocover
+    import Queue as queue
 
 try:
     from json import loads, dumps
 except ImportError:  # pragma: nocover
     from simplejson import loads, dumps  # noqa
 
-from zombie.compat import PY3
+from zombie.compat import PY3, PY26
+from zombie.proxy import metrics
+
+__all__ = ['ZombieProxyClient', 'NodeError', 'SessionExpired',
+           'ServerRestarted', 'TimeoutError', 'use_json_codec']
+
+#
+# Every message exchanged with the node.js server is prefixed with its
+# length (in bytes) and a request id, both unsigned, big-endian 32-bit
+# integers.  Responses carry the id of the request they answer, so any
+# number of requests can be in flight on a single connection.
+#
+HEADER = struct.Struct('!II')
 
-__all__ = ['ZombieProxyClient', 'NodeError']
+#
+# Responses are JSON encoded ``[errno, result, meta]`` lists: errno 0 means
+# success, 1 an error, 2 an expired session, 3 a partial result, which
+# is followed by more responses to the same request (see
+# ZombieProxyClient.stream), and 4 a request turned away because the server
+# is about to be respawned.  ``meta`` holds how long the server took to
+# handle the request (``time``) and evaluate it (``eval``), in milliseconds,
+# and (for requests made within a session) the generation of the session's
+# document (see ZombieProxyClient.generation).
+#
+PARTIAL = b'[3,'
+
+#
+# The most partial responses the server sends ahead of those the client has
+# consumed (the client lets it send more as it consumes them).
+#
+STREAM_WINDOW = 4
+
+
+def is_partial(response):
+    """
+    True if a (raw) response is followed by more responses to the same
+    request.
+    """
+    return response[:len(PARTIAL)] == PARTIAL
 
 
 def encode(obj):
@@ -36,23 +83,236 @@ def encode_args(args, extra=False):
     return methodargs
 
 
+def nowait_script(js, args=None):
+    """
+    Javascript which evaluates ``js`` (called with ``args``, if given) and
+    returns the value of ``result``.
+    """
+    if args:
+        js = "%s(%s)" % (js, encode_args(args))
+
+    return """
+            %s;
+            return_result(result);
+        """ % js
+
+
+def wait_script(method, args, callback='wait_callback'):
+    """
+    Javascript which calls a zombie.js Browser method that takes a callback.
+    """
+    methodargs = encode_args(args, extra=True)
+    return """
+        %s(%s %s);
+        """ % (method, methodargs, callback)
+
+
+def create_element_script(method, args=None):
+    """
+    A Javascript expression which stores the element returned by a browser
+    method in the ELEMENTS cache, and evaluates to its index.
+    """
+    if args is None:
+        arguments = ''
+    else:
+        arguments = "(%s)" % encode_args(args)
+    return """
+            create_element(ELEMENTS, %(method)s%(args)s);
+        """ % {
+        'method': method,
+        'args': arguments
+    }
+
+
+def create_elements_script(method, args=[]):
+    """
+    A Javascript expression which stores the elements returned by a browser
+    method in the ELEMENTS cache, and evaluates to a list of their indexes.
+    """
+    return """
+            create_elements(ELEMENTS, %(method)s(%(args)s))
+        """ % {
+        'method': method,
+        'args': encode_args(args),
+    }
+
+
+def reference(obj):
+    """
+    Encode an object json can't (i.e., an :class:`Element`, or a node which
+    wraps one) as the ``{"$element": index}`` reference operations expect.
+    """
+    if hasattr(obj, 'ref'):
+        return obj.ref
+    raise TypeError("%r can't be passed to an operation" % (obj,))
+
+
+def encode_call(obj):
+    """
+    Encode a call to an operation (or its arguments) to json.
+    """
+    return dumps(obj, default=reference)
+
+
+def call_script(op, args):
+    """
+    Javascript which calls an operation (e.g., as a step of a batch).
+    """
+    return """
+        call_operation(browser, ELEMENTS, %s, %s, wait_n_return_callback);
+        """ % (dumps(op), encode_call(list(args)))
+
+
+def timeout_option(kwargs):
+    """
+    Pop the (only) keyword argument methods which take ``*args`` accept.
+    """
+    timeout = kwargs.pop('timeout', None)
+    if kwargs:
+        raise TypeError(
+            "unexpected keyword arguments: %s" % ', '.join(sorted(kwargs)))
+    return timeout
+
+
+#
+# Messages about requests in flight, which the server handles even while it
+# drains them before being respawned (see CONTROL_MESSAGE in server.js).
+#
+def abort_message(request_id):
+    """
+    A message telling the server to drop a request the client has stopped
+    waiting for, and stop whatever the browser is doing for it.
+    """
+    return 'abort_request(%d); return_result(null);' % request_id
+
+
+def credit_message(request_id, count):
+    """
+    A message letting the server send ``count`` more pieces of a streamed
+    response, once the client has consumed as many.
+    """
+    return 'stream_credit(%d, %d); return_result(null);' % (
+        request_id, count)
+
+
+def frame(payload, request_id=0):
+    """
+    Prefix a (bytes) payload with its length and request id so it can be
+    sent over a persistent connection.
+    """
+    return HEADER.pack(len(payload), request_id) + payload
+
+
+def receive_exactly(con, size):
+    """
+    Read exactly ``size`` bytes from a socket straight into a single
+    (preallocated) ``bytearray``.
+    """
+    response = bytearray(size)
+    view = memoryview(response)
+    received = 0
+    while received < size:
+        count = con.recv_into(view[received:], min(size - received, 65536))
+        if not count:
+            raise socket.error('Connection closed by the node.js server')
+        received += count
+    return response
+
+
+if PY26:  # pragma: nocover
+    def receive_exactly(con, size):  # noqa
+        """
+        Read exactly ``size`` bytes from a socket into a ``bytearray``
+        (Python 2.6 has no memoryview to receive into).
+        """
+        response = bytearray()
+        while len(response) < size:
+            data = con.recv(min(size - len(response), 65536))
+            if not data:
+                raise socket.error('Connection closed by the node.js server')
+            response.extend(data)
+        return response
+
+
+def stdlib_loads(json):
+    """
+    Decode json (text or a UTF-8 encoded buffer) with the standard library.
+    """
+    if isinstance(json, bytearray):
+        json = bytes(json)
+    if PY3 and isinstance(json, bytes):  # pragma: nocover
+        json = str(json, 'utf-8')
+    return loads(json)
+
+
+#
+# JSON parsers which can decode node.js responses, by name.  Each accepts
+# the raw (UTF-8) response buffer as well as text.
+#
+JSON_CODECS = {'json': stdlib_loads}
+
+try:
+    import ujson
+except ImportError:  # pragma: nocover
+    pass
+else:  # pragma: nocover
+    JSON_CODECS['ujson'] = lambda json: ujson.loads(
+        bytes(json) if isinstance(json, bytearray) else json)
+
+try:
+    import orjson
+except ImportError:  # pragma: nocover
+    pass
+else:  # pragma: nocover
+    JSON_CODECS['orjson'] = orjson.loads
+
+
+def use_json_codec(name=None):
+    """
+    Pick the JSON parser responses are decoded with: ``json`` (the standard
+    library), ``ujson`` or ``orjson`` (if installed).  By default, the
+    fastest one installed is used.
+    """
+    global json_loads
+    if name is None:
+        name = [n for n in ('orjson', 'ujson', 'json') if n in JSON_CODECS][0]
+    if name not in JSON_CODECS:
+        raise ValueError("%s isn't an installed JSON codec" % name)
+    json_loads = JSON_CODECS[name]
+
+use_json_codec()
+
+
 def decode(json):
     """
-    Decode json.
+    Decode json (text or a UTF-8 encoded buffer).
 
     Returns None if None is given as json
     """
     if json is None:
         return None
-    return loads(json)
+    return json_loads(json)
 
 
 class Element(object):
     """
     Reference to an element stored in the nodejs server
+
+    If an ``on_release`` callback is given, it is called with the element's
+    index once the reference is garbage collected, so the server can free
+    the element.
     """
-    def __init__(self, index):
+    def __init__(self, index, on_release=None):
         self.__index = index
+        self.__on_release = on_release
+
+    def __del__(self):
+        if self.__on_release is not None:
+            try:
+                self.__on_release(self.__index)
+            except Exception:  # pragma: nocover
+                # e.g., during interpreter shutdown
+                pass
 
     @property
     def index(self):
@@ -62,10 +322,44 @@ class Element(object):
     def json(self):
         return "ELEMENTS[%s]" % self.__index
 
+    @property
+    def ref(self):
+        return {'$element': self.__index}
+
     def __str__(self):
         return self.json
 
 
+class Batch(object):
+    """
+    Operations queued by :meth:`ZombieProxyClient.batch`, and (once the batch
+    has been sent) their results.
+    """
+
+    #
+    # Each queued operation runs in its own function, with the response
+    # callbacks it would normally use bound to the next step of the batch.
+    #
+    step = """
+        function (return_result, return_error,
+                  wait_callback, wait_n_return_callback) {
+            var result = null;
+            %s
+        }"""
+
+    def __init__(self):
+        self.operations = []
+        self.results = None
+
+    def append(self, javascript):
+        self.operations.append(javascript)
+
+    @property
+    def javascript(self):
+        steps = ','.join([self.step % js for js in self.operations])
+        return "run_batch([%s], wait_n_return_callback);" % steps
+
+
 class NodeError(Exception):
     """
     An exception indicating node.js' failure to parse or evaluate Javascript
@@ -74,35 +368,368 @@ class NodeError(Exception):
     pass
 
 
-class ZombieServerConnection(object):
+class SessionExpired(NodeError):
+    """
+    An exception indicating the client's session (and the browser state
+    which belonged to it) no longer exists in the node.js server, e.g.,
+    because it was idle for too long or :meth:`ZombieProxyClient.cleanup`
+    was called.  The client starts a new session on its next request.
+    """
+    pass
+
+
+class ServerRestarted(SessionExpired):
+    """
+    An exception indicating the node.js server died (e.g., it ran out of
+    memory) and was respawned, losing the client's session.  The client
+    starts a new session on its next request.
+    """
+    pass
+
+
+class TimeoutError(NodeError):
+    """
+    An exception indicating node.js didn't respond in time.  The server is
+    told to abort the request (so the browser may be left half way through
+    loading a page).
+    """
+    pass
+
+
+class PendingResponse(object):
+    """
+    A response to a request sent over a :class:`Channel` which hasn't been
+    received yet.
+    """
+
+    def __init__(self):
+        self.request_id = None
+        self.__event = threading.Event()
+        self.__response = None
+        self.__error = None
+
+    def set(self, response):
+        self.__response = response
+        self.__event.set()
+
+    def fail(self, error):
+        self.__error = error
+        self.__event.set()
+
+    def get(self, timeout=None):
+        self.__event.wait(timeout)
+        if not self.__event.is_set():
+            raise TimeoutError(
+                "node.js didn't respond within %s seconds" % timeout)
+        if self.__error is not None:
+            raise self.__error
+        return self.__response
+
+
+class PendingStream(object):
+    """
+    The responses to a request sent over a :class:`Channel` which are
+    streamed back as several (partial) responses.  They're queued until
+    they're consumed; the server bounds how many (see
+    :meth:`Channel.stream`).
+    """
+
+    def __init__(self):
+        self.request_id = None
+        self.__responses = queue.Queue()
+        self.cancelled = False
+
+    def set(self, response):
+        if not self.cancelled:
+            self.__responses.put((response, None))
+
+    def fail(self, error):
+        self.__responses.put((None, error))
+
+    def get(self):
+        response, error = self.__responses.get()
+        if error is not None:
+            raise error
+        return response
+
+    def cancel(self):
+        """
+        Discard any responses which haven't been received yet.
+        """
+        self.cancelled = True
+
+
+class Channel(object):
+    """
+    A persistent unix socket connection to a node.js server which can be
+    shared by any number of threads.  Requests are tagged with an id, so
+    they can be pipelined and their responses may arrive in any order.  Use
+    :meth:`for_address` to share one channel between every client talking to
+    the same socket address (in the same process).
+    """
+
+    __channels = {}
+    __channels_lock = threading.Lock()
+
+    @classmethod
+    def for_address(cls, socket_address):
+        """
+        Return the (shared) channel for a unix socket address, (re)connecting
+        if necessary.
+        """
+        pid = os.getpid()
+        with cls.__channels_lock:
+            # A forked process inherits its parent's channels, but not their
+            # reader threads.  Forget them (without closing them, which
+            # would shut the parent's sockets down).
+            for key in [k for k in cls.__channels if k[0] != pid]:
+                del cls.__channels[key]
+            key = (pid, socket_address)
+            channel = cls.__channels.get(key)
+            if channel is None or channel.closed:
+                channel = cls.__channels[key] = cls(socket_address)
+            return channel
+
     def __init__(self, socket_address):
+        """
+        :param socket_address: the unix socket address to connect to.
+        """
+        self.socket_address = socket_address
+        self.closed = False
+        self.__ids = itertools.count(1)
+        self.__pending = {}
+        self.__lock = threading.Lock()
+        self.__send_lock = threading.Lock()
+
+        self.__sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.__sock.connect(socket_address)
+        except Exception:
+            self.__sock.close()
+            raise
+
+        reader = threading.Thread(target=self.__read)
+        reader.daemon = True
+        reader.start()
+
+    def request(self, payload, timeout=None):
+        """
+        Send a (bytes) payload and block until its response arrives (or, if
+        a ``timeout`` is given, raise :class:`TimeoutError` after that many
+        seconds, aborting the request).
+        """
+        pending = self.send(payload)
+        try:
+            return pending.get(timeout)
+        except TimeoutError:
+            self.abort(pending)
+            raise
+
+    def abort(self, pending):
+        """
+        Stop waiting for a request's response, and have the server abort it.
+        """
+        with self.__lock:
+            self.__pending.pop(pending.request_id, None)
+        try:
+            self.send(abort_message(pending.request_id).encode('utf-8'))
+        except socket.error:
+            pass
+
+    def stream(self, payload, window=0):
+        """
+        Send a (bytes) payload and yield its (partial) responses as they
+        arrive.  Closing the generator early aborts the request.
+
+        :param window: if the server sends no more than this many partial
+                       responses ahead of those consumed (see
+                       ``return_chunks`` in server.js), the number of
+                       responses consumed, so it can send more.  At most
+                       ``window`` responses are ever queued.
+        """
+        pending = self.send(payload, PendingStream())
+        finished = False
+        consumed = 0
+        try:
+            while True:
+                response = pending.get()
+                finished = not is_partial(response)
+                yield response
+                if finished:
+                    return
+                consumed += 1
+                if window and consumed >= max(window // 2, 1):
+                    try:
+                        self.send(credit_message(
+                            pending.request_id, consumed).encode('utf-8'))
+                    except socket.error:
+                        # The server may have sent the last responses and
+                        # gone away (e.g., recycled) already; if not, the
+                        # next one fails, too
+                        pass
+                    consumed = 0
+        finally:
+            pending.cancel()
+            if not finished:
+                self.abort(pending)
+
+    def send(self, payload, pending=None):
+        """
+        Send a (bytes) payload and return a :class:`PendingResponse` (or the
+        given :class:`PendingStream`) for it.
+        """
+        if pending is None:
+            pending = PendingResponse()
+        with self.__lock:
+            if self.closed:
+                raise socket.error('Connection to the node.js server closed')
+            request_id = pending.request_id = next(self.__ids) & 0xffffffff
+            self.__pending[request_id] = pending
+
+        try:
+            with self.__send_lock:
+                self.__sock.sendall(frame(payload, request_id))
+        except Exception as e:
+            self.__close(e)
+            raise
+        return pending
+
+    def close(self):
+        """
+        Close the connection; requests still in flight fail with
+        :class:`socket.error`.
+        """
+        self.__close(socket.error('Connection to the node.js server closed'))
+
+    def __read(self):
+        try:
+            while True:
+                size, request_id = HEADER.unpack(
+                    receive_exactly(self.__sock, HEADER.size))
+                response = receive_exactly(self.__sock, size)
+                with self.__lock:
+                    pending = self.__pending.pop(request_id, None)
+                    # Streams stay pending until their last response
+                    if (isinstance(pending, PendingStream) and
+                            is_partial(response)):
+                        self.__pending[request_id] = pending
+                if pending is not None:
+                    pending.set(response)
+        except Exception as e:
+            self.__close(e)
+
+    def __close(self, error):
+        with self.__lock:
+            was_closed, self.closed = self.closed, True
+            pending, self.__pending = self.__pending, {}
+        if not was_closed:
+            try:
+                self.__sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            self.__sock.close()
+        for response in pending.values():
+            response.fail(error)
+
+
+class ZombieServerConnection(object):
+    def __init__(self, socket_address, persistent=True, timeout=None):
+        """
+        :param socket_address: a unix socket address to connect to.
+        :param persistent: when True (the default), requests are pipelined
+                           over a single :class:`Channel` shared by every
+                           connection to the same address.
+        :param timeout: the default number of seconds to wait for a
+                        response before raising :class:`TimeoutError` (by
+                        default, wait forever).
+        """
         self.__socket_address = socket_address
+        self.persistent = persistent
+        self.timeout = timeout
 
-    def send(self, data):
+    @property
+    def channel(self):
+        if not self.persistent:
+            return None
+        return Channel.for_address(self.__socket_address)
+
+    def send(self, data, timeout=None):
+        response = self.request(data, timeout)
+        if PY3:  # pragma: nocover
+            return str(response, 'utf-8')
+        return bytes(response)
+
+    def request(self, data, timeout=None, timings=None):
+        """
+        Like :meth:`send`, but returns the undecoded response buffer.
+
+        :param timeout: the number of seconds to wait for the response (by
+                        default, the connection's ``timeout``).
+        :param timings: an (optional) dictionary to record the bytes
+                        ``sent`` and ``received`` and the ``connect`` time
+                        in (see :mod:`zombie.proxy.metrics`).
+        """
         if PY3:  # pragma: nocover
             data = bytes(data, 'utf-8')
+        if timeout is None:
+            timeout = self.timeout
+        if timings is not None:
+            timings['sent'] = len(data)
+            started = metrics.timer()
 
-        with self._open_connection() as con:
-            con.send(data)
-            response = self._receive(con)
+        if self.persistent:
+            channel = self.channel
+            if timings is not None:
+                timings['connect'] = metrics.timer() - started
+            response = channel.request(data, timeout)
+        else:
+            # Closing the connection aborts the request server-side
+            with self._open_connection() as con:
+                if timings is not None:
+                    timings['connect'] = metrics.timer() - started
+                con.settimeout(timeout)
+                try:
+                    con.sendall(frame(data))
+                    response = self._receive(con)
+                except socket.timeout:
+                    raise TimeoutError(
+                        "node.js didn't respond within %s seconds" % timeout)
 
+        if timings is not None:
+            timings['received'] = len(response)
         return response
 
+    def stream(self, data, window=0):
+        """
+        Like :meth:`request`, but yields each of the (partial) response
+        buffers a request is answered with.
+
+        :param window: see :meth:`Channel.stream`; connections which aren't
+                       persistent are read one response at a time anyway.
+        """
+        if PY3:  # pragma: nocover
+            data = bytes(data, 'utf-8')
+
+        if self.persistent:
+            for response in self.channel.stream(data, window):
+                yield response
+            return
+        with self._open_connection() as con:
+            con.sendall(frame(data))
+            while True:
+                response = self._receive(con)
+                yield response
+                if not is_partial(response):
+                    return
+
     def _open_connection(self):
         sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
         sock.connect(self.__socket_address)
         return contextlib.closing(sock)
 
     def _receive(self, con):
-        response = []
-        while True:
-            data = con.recv(4096)
-            if not data:
-                break
-            if PY3:  # pragma: nocover
-                data = str(data, 'utf-8')
-            response.append(data)
-        return ''.join(response)
+        size, request_id = HEADER.unpack(receive_exactly(con, HEADER.size))
+        return receive_exactly(con, size)
 
 
 class ZombieProxyClient(object):
@@ -112,40 +739,268 @@ class ZombieProxyClient(object):
     (if any) are returned.
     """
 
-    def __init__(self, socket_address):
+    def __init__(self, socket_address, ttl=None, timeout=None, server=None,
+                 logger=None):
         """
         Establish a new :class:`ZombieProxyClient`.
 
         :param socket: a unix socket address to connect to.
+        :param ttl: the number of seconds the client's session may be idle
+                    before the server expires it (by default, the server's
+                    ``idle_timeout``).
+        :param timeout: the default number of seconds to wait for node.js
+                        to respond before raising :class:`TimeoutError` (by
+                        default, wait forever).
+        :param server: the (optional)
+                       :class:`zombie.proxy.server.NodeProcess` listening
+                       on ``socket_address``; if it's respawned, requests
+                       which lose the session raise
+                       :class:`ServerRestarted`.
+        :param logger: a :class:`logging.Logger` for the log records
+                       node.js sends about this client's browser (see
+                       the ``log_level`` of
+                       :class:`zombie.proxy.server.NodeProcess`); needs
+                       ``server``.
         """
-        self.connection = ZombieServerConnection(socket_address)
+        if logger is not None and server is None:
+            raise ValueError("A logger needs the server it's registered with")
+        self.connection = ZombieServerConnection(
+            socket_address, timeout=timeout)
+        self.ttl = ttl
+        self.server = server
+        self.logger = logger
+        self.session = None
+        # Called (with no arguments) once a ServerRestarted error has
+        # reset the session, before it's raised
+        self.on_restart = None
+        self._reset_session()
+        self._batch = None
+        # (session, index) pairs of garbage collected elements, released by
+        # the next request (deque operations are atomic, so this is safe to
+        # append to from Element.__del__, whichever thread that runs in).
+        self._released = collections.deque()
+
+    def __del__(self):
+        # Records about a session nobody will use again go to the default
+        # logger
+        if getattr(self, 'logger', None) is not None:
+            self.server.remove_logger(self.session)
 
-    def _send(self, javascript):
+    def _send(self, javascript, timeout=None, method='script'):
         """
         Establishes a socket connection to the zombie.js server and sends
         Javascript instructions.
 
+        Inside of a :meth:`batch`, the instructions are queued instead and
+        ``None`` is returned.
+
         :param js: the Javascript string to execute
+        :param method: what to report the request as to
+                       :mod:`zombie.proxy.metrics` hooks.
         """
+        if self._batch is not None:
+            self._batch.append(javascript)
+            return None
 
-        # Prepend JS to switch to the proper client context.
-        message = """
-            var _ctx = ctx_switch('%s'),
+        return self._session_request(
+            self._message(javascript), timeout, method)
+
+    def _message(self, javascript):
+        """
+        Wrap Javascript instructions in a message for this client's session.
+        """
+        # Free any elements which are no longer referenced.
+        released = self._pop_released()
+        if released:
+            javascript = "release_elements(ELEMENTS, %s);\n%s" % (
+                dumps(released), javascript)
+
+        # Prepend JS to switch to the proper client context, starting the
+        # session on first contact.
+        if self._opened:
+            context = "ctx_switch(%s)" % dumps(self.session)
+        else:
+            context = "ctx_open(%s, %s)" % (
+                dumps(self.session), dumps(self.ttl))
+        return """
+            var _ctx = %s,
                 browser = _ctx[0],
                 ELEMENTS = _ctx[1];
             %s
-        """ % (id(self), javascript)
+        """ % (context, javascript)
+
+    def _call_message(self, op, args):
+        """
+        A (json) message calling an operation within this client's session.
+        """
+        message = {'session': self.session, 'op': op, 'args': list(args)}
+        if not self._opened:
+            message['open'] = True
+            message['ttl'] = self.ttl
+        released = self._pop_released()
+        if released:
+            message['release'] = released
+        return encode_call(message)
+
+    def _pop_released(self):
+        released = []
+        while self._released:
+            session, index = self._released.popleft()
+            # The elements of an earlier session went away with it, and
+            # their indexes may have been reused by this one
+            if session == self.session:
+                released.append(index)
+        return released
+
+    def _reset_session(self):
+        """
+        Forget the current session; the next request starts a new one.
+        """
+        if self.logger is not None and self.session is not None:
+            self.server.remove_logger(self.session)
+        self.session = uuid.uuid4().hex
+        if self.logger is not None:
+            self.server.add_logger(self.session, self.logger)
+        self._opened = False
+        # Bumped by node.js whenever the session's document (may have)
+        # changed, i.e., whenever the browser navigates
+        self.generation = None
+
+    def _session_request(self, message, timeout=None, method=None):
+        """
+        Send a message built by :meth:`_message` (or :meth:`_call_message`)
+        and return its result.
+        """
+        with metrics.instrument(method) as timings:
+            try:
+                response = self.connection.request(message, timeout, timings)
+                return self._session_result(response, timings)
+            except socket.error:
+                self._check_restarted()
+                raise
+
+    def _check_restarted(self, dropped=True):
+        """
+        Raise :class:`ServerRestarted` if the server has been respawned
+        since this client's session started or, if the connection
+        ``dropped``, is being respawned (which may take a moment to tell,
+        so the latter blocks).
+        """
+        if self.server is None:
+            return
+        restarts = self._restarts if self._opened else self.server.restarts
+        if not dropped:
+            # The server answered, so it has been respawned already if at
+            # all
+            if self.server.restarts == restarts:
+                return
+        elif not self.server.wait_for_restart(restarts):
+            return
+        self._reset_session()
+        if self.on_restart is not None:
+            self.on_restart()
+        raise ServerRestarted(
+            "The node.js server at %s was restarted" % self.server.socket)
+
+    def _request(self, message, method=None):
+        """
+        Send a message as-is (i.e., outside of any client context) and
+        return its result.
+        """
+        with metrics.instrument(method) as timings:
+            response = self.connection.request(message, timings=timings)
+            return self._handle_response(response, timings)
 
-        response = self.connection.send(message)
+    def _session_result(self, response, timings=None):
+        """
+        Track the session through a response to a message built by
+        :meth:`_message`, and return its result.
+        """
+        try:
+            result = self._handle_response(response, timings)
+        except SessionExpired:
+            self._check_restarted(dropped=False)
+            self._reset_session()
+            raise
+        except NodeError:
+            self._session_opened()
+            raise
+        self._session_opened()
+        return result
 
-        return self._handle_response(response)
+    def _session_opened(self):
+        if not self._opened and self.server is not None:
+            # Sessions only outlive the server process they started in
+            # until it's respawned
+            self._restarts = self.server.restarts
+        self._opened = True
 
-    def _handle_response(self, response):
-        errno, result = decode(response)
+    def _handle_response(self, response, timings=None):
+        if timings is None:
+            response = decode(response)
+        else:
+            started = metrics.timer()
+            response = decode(response)
+            timings['decode'] = metrics.timer() - started
+        errno, result = response[:2]
+        if len(response) > 2:
+            meta = response[2]
+            if 'generation' in meta:
+                self.generation = meta['generation']
+            if timings is not None:
+                timings['server'] = meta['time'] / 1000.0
+                timings['eval'] = meta['eval'] / 1000.0
         if errno == 1:
             raise NodeError(result)
+        if errno == 2:
+            raise SessionExpired(result)
+        if errno == 4:
+            # The request never ran, as if the connection had dropped
+            raise socket.error(result)
         return result
 
+    def call(self, op, *args, **kwargs):
+        """
+        Call one of the operations the node.js server defines (see
+        ``OPERATIONS`` in server.js) by name, e.g.,
+        ::
+            client.call('visit', 'http://www.example.com/')
+
+        Calls are sent as json rather than Javascript, so nothing is
+        compiled for them.  :class:`Element` arguments (and nodes which wrap
+        one) are passed by reference.  Inside of a :meth:`batch`, the call
+        is queued and ``None`` is returned.
+
+        :param op: the name of the operation
+        :param timeout: (keyword only) the number of seconds to wait for the
+                        call to finish (by default, the client's).
+        """
+        timeout = timeout_option(kwargs)
+        if self._batch is not None:
+            self._batch.append(call_script(op, args))
+            return None
+        return self._session_request(
+            self._call_message(op, args), timeout, op)
+
+    def call_element(self, op, *args):
+        """
+        Call an operation which returns the index of an element, and return
+        the :class:`Element` (or ``None``).
+        """
+        self._check_not_batched(op)
+        index = self.call(op, *args)
+        if index is None:
+            return None
+        return self.element(index)
+
+    def call_elements(self, op, *args):
+        """
+        Call an operation which returns a list of element indexes, and
+        return the :class:`Element` objects.
+        """
+        self._check_not_batched(op)
+        return [self.element(index) for index in self.call(op, *args)]
+
     def json(self, js, args=None):
         """
         A shortcut for passing Javascript instructions and decoding a JSON
@@ -153,51 +1008,107 @@ class ZombieProxyClient(object):
 
         :param js: the Javascript string to execute
         """
-        return self.nowait("result = %s" % js, args)
+        return self._send(nowait_script("result = %s" % js, args),
+                          method='json')
 
     def nowait(self, js, args=None):
+        return self._send(nowait_script(js, args), method='nowait')
+
+    def stream(self, js, args=None, chunk_size=65536):
+        """
+        Evaluate a Javascript expression (called with ``args``, if given)
+        whose value is a string, and yield it in pieces of up to
+        ``chunk_size`` characters as they arrive, so it's never held in
+        memory as a whole (by either process).
+
+        :param js: the Javascript string to execute
+        """
+        self._check_not_batched('stream')
         if args:
             js = "%s(%s)" % (js, encode_args(args))
+        window = STREAM_WINDOW if self.connection.persistent else 0
+        responses = self.connection.stream(self._message(
+            "return_chunks(%s, %d, %d);" % (js, chunk_size, window)), window)
+        try:
+            for response in responses:
+                result = self._session_result(response)
+                if not is_partial(response):
+                    return
+                yield result
+        except socket.error:
+            self._check_restarted()
+            raise
+        finally:
+            responses.close()
 
-        js = """
-            %s;
-            return_result(result);
-        """ % js
-        return self._send(js)
-
-    def wait(self, method, *args):
+    def wait(self, method, *args, **kwargs):
         """
         Call a method on the zombie.js Browser instance and wait on a callback.
 
         :param method: the method to call, e.g., html()
         :param args: one of more arguments for the method
+        :param timeout: (keyword only) the number of seconds to wait for the
+                        callback (by default, the client's).
         """
-        methodargs = encode_args(args, extra=True)
-        js = """
-        %s(%s wait_callback);
-        """ % (method, methodargs)
-        self._send(js)
+        self._send(wait_script(method, args), timeout_option(kwargs), method)
 
-    def wait_return(self, method, *args):
+    def wait_return(self, method, *args, **kwargs):
         """
         Call a method on the zombie.js Browser instance and wait on a callback.
 
         :param method: the method to call, e.g., html()
         :param args: one of more arguments for the method
+        :param timeout: (keyword only) the number of seconds to wait for the
+                        callback (by default, the client's).
+        """
+        return self._send(
+            wait_script(method, args, 'wait_n_return_callback'),
+            timeout_option(kwargs), method)
+
+    @contextlib.contextmanager
+    def batch(self):
+        """
+        A context manager which queues every instruction sent within it and
+        sends them to node.js as a single script (and round trip) when the
+        block exits.  The instructions run in order, and the first error
+        aborts the rest of the batch and is raised as a :class:`NodeError`.
+
+        Yields a :class:`Batch`; once the block exits, ``Batch.results``
+        holds the result of each queued instruction.  Results aren't
+        available inside the block, so methods which need them (e.g.,
+        :meth:`create_element`) can't be batched.  Nested batches are merged
+        into the outermost one.
         """
-        methodargs = encode_args(args, extra=True)
-        js = """
-        %s(%s wait_n_return_callback);
-        """ % (method, methodargs)
-        return self._send(js)
+        if self._batch is not None:
+            yield self._batch
+            return
+
+        batch = self._batch = Batch()
+        try:
+            yield batch
+        finally:
+            self._batch = None
+
+        batch.results = []
+        if batch.operations:
+            batch.results = self._send(batch.javascript, method='batch')
 
     def ping(self):
         """
         Send a simple Javascript instruction and wait on a reply.
 
         A live node.js TCP server will cause this method to return "pong".
+        The ping is answered outside of any session, so no browser is
+        created for it.
+        """
+        return self._request('return_result(ping);', 'ping')
+
+    def stats(self):
+        """
+        Returns the server's memory usage and workload; see
+        :meth:`zombie.proxy.server.NodeProcess.stats`.
         """
-        return self.json('ping')
+        return self._request('return_result(stats());', 'stats')
 
     def cleanup(self):
         """
@@ -207,8 +1118,24 @@ class ZombieProxyClient(object):
         process. In order to avoid memory problems you will need to clean up
         those browsers or one by one, or using this clean up in a specific
         moment in your code
+
+        To destroy only this client's browser, use :meth:`close`.  Other
+        clients will raise :class:`SessionExpired` on their next request.
         """
         self.nowait('cleanup()')
+        self._reset_session()
+
+    def close(self):
+        """
+        Destroy this client's browser (and the elements it references) in
+        the server, leaving every other client untouched.  Using the client
+        again afterwards starts over with a new browser.
+        """
+        self._released.clear()
+        self._request(
+            "destroy_client(%s); return_result(null);" % dumps(self.session),
+            'close')
+        self._reset_session()
 
     def create_element(self, method, args=None):
         """
@@ -227,22 +1154,12 @@ class ZombieProxyClient(object):
                         (http://zombie.labnotes.org/selectors)
         :param context: an (optional) instance of :class:`zombie.dom.DOMNode`
         """
-        if args is None:
-            arguments = ''
-        else:
-            arguments = "(%s)" % encode_args(args)
-        js = """
-            create_element(ELEMENTS, %(method)s%(args)s);
-        """ % {
-            'method': method,
-            'args': arguments
-        }
-
-        index = self.json(js)
+        self._check_not_batched('create_element')
+        index = self.json(create_element_script(method, args))
         if index is None:
             return None
 
-        return Element(index)
+        return self.element(index)
 
     def create_elements(self, method, args=[]):
         """
@@ -250,14 +1167,21 @@ class ZombieProxyClient(object):
 
         Returns a list of the element indexes
         """
-        args = encode_args(args)
+        self._check_not_batched('create_elements')
+        indexes = self.json(create_elements_script(method, args))
+        return [self.element(index) for index in indexes]
 
-        js = """
-            create_elements(ELEMENTS, %(method)s(%(args)s))
-        """ % {
-            'method': method,
-            'args': args,
-        }
+    def element(self, index):
+        """
+        Return an :class:`Element` referencing an index in this client's
+        element cache, which is released once it's garbage collected (unless
+        the session has changed since).
+        """
+        released, session = self._released, self.session
+        return Element(index, lambda index: released.append((session, index)))
 
-        indexes = self.json(js)
-        return map(Element, indexes)
+    def _check_not_batched(self, method):
+        if self._batch is not None:
+            raise RuntimeError(
+                "%s() needs its result immediately and can't be used "
+                "inside a batch" % method)
@@ -1,28 +1,122 @@
+var fs = require('fs');
 var net = require('net');
 var Browser = require('zombie');
 
 // Defaults
 var ping = 'pong'
+var OPTIONS = parse_options(process.argv.slice(3), {
+    // The largest message (in bytes) a client may send
+    'max-message-size': 64 * 1024 * 1024,
+    // The most DOM nodes to keep per client (0 means no limit)
+    'max-elements': 0,
+    // Destroy clients which haven't sent a request for this many seconds
+    // (0 means never)
+    'idle-timeout': 0,
+    // The number of idle, ready-made browsers to keep for new clients
+    'browser-pool': 0,
+    // Exit once no connection has held a lease (see lease() below) for this
+    // many seconds (0 means never)
+    'linger': 0,
+    // Recycle the server (see recycle() below) once it has handled this
+    // many requests (0 means never)
+    'max-requests': 0,
+    // Recycle the server once its resident set exceeds this many megabytes
+    // (0 means never)
+    'max-rss': 0,
+    // The file descriptor to write log records to (see log() below; 0
+    // means stdout, as plain text)
+    'log-fd': 0,
+    // The least severe level of the records to write
+    'log-level': 'warning'
+});
 var browser = null;
 var ELEMENTS = [];
 
 //
-// Store global client states indexed by ZombieProxyClient (memory address):
+// Store global client states indexed by ZombieProxyClient session id (a
+// UUID chosen by the client, which opens its session with ctx_open):
 //
 // {
-//   'CLIENTID': [X, Y]
+//   'SESSIONID': {'browser': X, 'elements': Y, 'last_used': Z, 'ttl': T}
 // }
 //
 // ...where X is some zombie.Browser instance...
 //
-// ...and Y is a per-browser cache (a list) used to store  NodeList results.
+// ...Y is a per-browser ElementCache used to store NodeList results.
 // Subsequent TCP API calls will reference indexes to retrieve DOM
 // attributes/properties accumulated in previous browser.querySelectorAll()
-// calls.
+// calls...
+//
+// ...Z is the time of the client's latest request...
+//
+// ...and T is the number of seconds the session may be idle before it
+// expires (0 falls back to the --idle-timeout option).
 //
 //
 var CLIENTS = {};
 
+//
+// Idle browsers, constructed ahead of time (and whenever a client is done
+// with one) so new clients don't wait for `new Browser()`.
+//
+var BROWSER_POOL = [];
+
+//
+// The number of connections holding a lease.  A server shared by several
+// processes (zombie.proxy.server's daemon mode) is kept alive by their
+// leases, and exits `--linger` seconds after the last one is released.
+//
+var LEASES = 0;
+var shutdown_timer = null;
+
+//
+// The number of requests handled so far, and being handled right now.
+//
+var REQUESTS = 0;
+var IN_FLIGHT = 0;
+
+//
+// Once a limit (--max-requests or --max-rss) is hit, the server stops
+// taking connections and requests (other than the CONTROL_MESSAGEs clients
+// send about requests in flight: aborts and stream credit), waits (for up
+// to DRAIN_TIMEOUT milliseconds) for those in flight to be answered, and
+// exits with RECYCLE_STATUS so zombie.proxy.server respawns it.
+//
+var RECYCLE_STATUS = 75;
+var DRAIN_TIMEOUT = 30 * 1000;
+var CONTROL_MESSAGE = new RegExp(
+    '^(abort_request\\(\\d+\\)|stream_credit\\(\\d+, \\d+\\)); ' +
+    'return_result\\(null\\);$');
+var recycling = false,
+    exiting = false;
+
+//
+// Open client connections.
+//
+var CONNECTIONS = [];
+
+//
+// Log records are written to --log-fd as lines of JSON, e.g.,
+//
+// {"level": "warning", "session": "SESSIONID", "source": "console",
+//  "message": "...", "time": 1400000000000}
+//
+// ...where `session` is the session of the browser the record is about
+// (or null, for the server's own records).  Records below --log-level are
+// never serialized, and records are dropped (and counted) rather than
+// buffered without bound when the reader can't keep up.
+//
+var LOG_LEVELS = {'debug': 10, 'info': 20, 'warning': 30, 'error': 40};
+var LOG_BUFFER_LIMIT = 1024 * 1024;
+var log_stream = null;
+var dropped_records = 0;
+
+// zombie.js' console levels
+var CONSOLE_LEVELS = {
+    'debug': 'debug', 'log': 'info', 'info': 'info', 'warn': 'warning',
+    'error': 'error'
+};
+
 //
 // Simple proxy server implementation
 // for proxying streamed (Javascript) content via HTTP
@@ -32,13 +126,257 @@ var CLIENTS = {};
 // https://github.com/plataformatec/capybara-zombie
 //
 //
+//
+// Parse `--name=value` command line options, falling back to defaults.
+//
+function parse_options(args, defaults) {
+    var options = {};
+    for (var key in defaults) options[key] = defaults[key];
+    for (var i = 0; i < args.length; i++) {
+        var match = /^--([^=]+)=(.*)$/.exec(args[i]);
+        if (!match || !(match[1] in defaults))
+            throw new Error('Unknown option: ' + args[i]);
+        var value = match[2];
+        if (typeof defaults[match[1]] == 'number') value = Number(value);
+        options[match[1]] = value;
+    }
+    return options;
+}
+
+//
+// Browser methods which (may) change the document: navigation, scripts,
+// events and forms (whose change events may run scripts, too).  Each call
+// bumps the browser's generation, both when it's made and when its
+// callback is called, and every response reports the generation so
+// clients can cache what they read from a document until it changes.
+//
+var MUTATING_METHODS = [
+    'visit', 'back', 'reload', 'clickLink', 'pressButton', 'fire', 'load',
+    'wait', 'evaluate', 'fill', 'check', 'uncheck', 'select', 'selectOption',
+    'unselect', 'unselectOption', 'attach', 'choose'
+];
+
+function create_browser() {
+    var browser = new Browser();
+    browser.generation = 0;
+    // The session the browser belongs to (see ctx_open), which its log
+    // records are routed to
+    browser.session = null;
+    if (browser.on) {
+        browser.on('console', function (level, message) {
+            log(CONSOLE_LEVELS[level] || 'info', browser.session, 'console',
+                message);
+        });
+        browser.on('error', function (err) {
+            log('error', browser.session, 'page',
+                err && err.message || String(err));
+        });
+    }
+    MUTATING_METHODS.forEach(function (name) {
+        var method = browser[name];
+        if (typeof method != 'function') return;
+        browser[name] = function () {
+            var args = Array.prototype.slice.call(arguments),
+                callback = args[args.length - 1];
+            browser.generation++;
+            if (typeof callback == 'function') {
+                args[args.length - 1] = function () {
+                    browser.generation++;
+                    return callback.apply(this, arguments);
+                };
+            }
+            return method.apply(browser, args);
+        };
+    });
+    return browser;
+}
+
+function fill_browser_pool() {
+    while (BROWSER_POOL.length < OPTIONS['browser-pool'])
+        BROWSER_POOL.push(create_browser());
+}
+
+//
+// Refill the pool once the current request is done.
+//
+function refill_browser_pool() {
+    if (OPTIONS['browser-pool'])
+        (global.setImmediate || process.nextTick)(fill_browser_pool);
+}
+
+//
+// Hand out a pooled browser (or construct one if the pool has run dry).
+//
+function take_browser() {
+    if (BROWSER_POOL.length) return BROWSER_POOL.pop();
+    refill_browser_pool();
+    return create_browser();
+}
+
+//
+// Destroy a browser once its client is done with it.  Browsers are never
+// handed to another client: too much of what a client did lingers in one
+// (cookies, headers, credentials, storage, properties set on it...), so
+// the pool is refilled with a new browser instead.
+//
+function release_browser(browser) {
+    browser.session = null;
+    browser.destroy();
+    refill_browser_pool();
+}
+
 function cleanup() {
     for (var key in CLIENTS) {
-        CLIENTS[key][0].destroy();
+        release_browser(CLIENTS[key].browser);
     }
     CLIENTS = {};
 }
 
+//
+// Destroy a single client's element cache and release its browser.
+//
+function destroy_client(id) {
+    var client = CLIENTS[id];
+    if (client) {
+        delete CLIENTS[id];
+        release_browser(client.browser);
+    }
+}
+
+//
+// Stop whatever a browser is loading (when a client gives up waiting on it).
+//
+function stop_browser(browser) {
+    try {
+        if (browser.window && browser.window.stop) browser.window.stop();
+    } catch(err) {}
+}
+
+//
+// The milliseconds elapsed since a process.hrtime().
+//
+function milliseconds_since(started) {
+    var elapsed = process.hrtime(started);
+    return Math.round(elapsed[0] * 1e6 + elapsed[1] / 1e3) / 1e3;
+}
+
+function stats() {
+    var memory = process.memoryUsage();
+    return {
+        'rss': memory.rss,
+        'heap_total': memory.heapTotal,
+        'heap_used': memory.heapUsed,
+        'requests': REQUESTS,
+        'in_flight': IN_FLIGHT,
+        'sessions': Object.keys(CLIENTS).length,
+        'pool': BROWSER_POOL.length,
+        'uptime': process.uptime(),
+        'recycling': recycling
+    };
+}
+
+function open_log() {
+    if (!OPTIONS['log-fd']) return;
+    log_stream = new net.Socket({
+        'fd': OPTIONS['log-fd'], 'readable': false, 'writable': true
+    });
+    // Whoever reads the records went away; stop writing them
+    log_stream.on('error', function () {
+        log_stream = null;
+    });
+    log_stream.on('drain', function () {
+        if (!dropped_records) return;
+        var dropped = dropped_records;
+        dropped_records = 0;
+        log('warning', null, 'server',
+            dropped + ' log records were dropped');
+    });
+}
+
+function log(level, session, source, message) {
+    if (!(LOG_LEVELS[level] >= LOG_LEVELS[OPTIONS['log-level']])) return;
+    if (!OPTIONS['log-fd']) {
+        console.log('[' + level + '] ' + message);
+        return;
+    }
+    if (!log_stream) return;
+    var buffered = log_stream.writableLength || log_stream.bufferSize || 0;
+    if (buffered > LOG_BUFFER_LIMIT) {
+        dropped_records++;
+        return;
+    }
+    log_stream.write(JSON.stringify({
+        'level': level,
+        'session': session,
+        'source': source,
+        'message': String(message),
+        'time': Date.now()
+    }) + '\n');
+}
+
+function recycle(reason) {
+    if (recycling) return;
+    recycling = true;
+    log('info', null, 'server',
+        'Recycling the Zombie.js server (' + reason + ')');
+    // Connections are refused until the server has been respawned
+    SERVER.close();
+    var deadline = setTimeout(exit_drained, DRAIN_TIMEOUT);
+    if (deadline.unref) deadline.unref();
+    if (!IN_FLIGHT) exit_drained();
+}
+
+function exit_drained() {
+    if (exiting) return;
+    exiting = true;
+    // Flush the last responses (by ending every connection) before exiting
+    CONNECTIONS.forEach(function (stream) {
+        stream.end();
+    });
+    if (!CONNECTIONS.length) process.exit(RECYCLE_STATUS);
+    setTimeout(function () {
+        process.exit(RECYCLE_STATUS);
+    }, 1000);
+}
+
+//
+// Called as each request is answered.
+//
+function request_done() {
+    IN_FLIGHT--;
+    if (recycling) {
+        if (!IN_FLIGHT) exit_drained();
+    } else if (OPTIONS['max-requests'] &&
+               REQUESTS >= OPTIONS['max-requests']) {
+        recycle(REQUESTS + ' requests');
+    }
+}
+
+function check_memory() {
+    var rss = process.memoryUsage().rss;
+    if (rss > OPTIONS['max-rss'] * 1024 * 1024)
+        recycle(Math.round(rss / 1024 / 1024) + 'MB resident');
+}
+
+function schedule_shutdown() {
+    if (!OPTIONS['linger'] || LEASES) return;
+    clearTimeout(shutdown_timer);
+    shutdown_timer = setTimeout(function () {
+        if (LEASES) return;
+        try { fs.unlinkSync(process.argv[2]); } catch(err) {}
+        process.exit(0);
+    }, OPTIONS['linger'] * 1000);
+}
+
+function reap_idle_clients() {
+    var now = Date.now();
+    for (var id in CLIENTS) {
+        var ttl = CLIENTS[id].ttl || OPTIONS['idle-timeout'];
+        if (ttl && CLIENTS[id].last_used < now - ttl * 1000)
+            destroy_client(id);
+    }
+}
+
 function check_field(browser, node, value) {
     var type = node.getAttribute('type');
     if (type == "radio") browser.choose(node);
@@ -61,38 +399,530 @@ function set_field(browser, node, value) {
     }
 }
 
+//
+// Run a list of queued operations (see ZombieProxyClient.batch) one after
+// another, then call `callback(err, results)`.  Each operation is a function
+// which receives its own response callbacks; the first error stops the
+// batch.
+//
+function run_batch(steps, callback) {
+    var results = [];
+
+    function next(i) {
+        if (i == steps.length) return callback(null, results);
+
+        var done = false;
+        function return_result(value) {
+            if (done) return;
+            done = true;
+            results.push(value);
+            next(i + 1);
+        }
+        function return_error(err) {
+            if (done) return;
+            done = true;
+            callback(err);
+        }
+        function wait_callback(err) {
+            if (err) return_error(err);
+            else return_result(null);
+        }
+        function wait_n_return_callback(err, value) {
+            if (err) return_error(err);
+            else return_result(value);
+        }
+
+        try {
+            steps[i](return_result, return_error,
+                     wait_callback, wait_n_return_callback);
+        } catch(err) {
+            return_error(err);
+        }
+    }
+    next(0);
+}
+
+//
+// Read several properties of a DOM node at once.
+//
+function get_attrs(node, names) {
+    var attrs = {};
+    for (var i = 0; i < names.length; i++)
+        attrs[names[i]] = node[names[i]];
+    return attrs;
+}
+
+//
+// Read several properties of every node matching a selector, without
+// storing the nodes in the ELEMENTS cache.
+//
+function query_attrs(browser, selector, context, names) {
+    var nodes = browser.queryAll(selector, context),
+        result = [];
+    for (var i = 0; i < nodes.length; i++)
+        result.push(get_attrs(nodes[i], names));
+    return result;
+}
+
+//
+// Copy the commonly used properties (and attributes) of a DOM node, so
+// they can be read client-side without further round trips.  The node is
+// stored in the ELEMENTS cache so the snapshot can be turned back into a
+// live reference.
+//
+function snapshot(ELEMENTS, node) {
+    if (!node) return null;
+    var attributes = {};
+    for (var i = 0; node.attributes && i < node.attributes.length; i++)
+        attributes[node.attributes[i].name] = node.attributes[i].value;
+    return {
+        'index': create_element(ELEMENTS, node),
+        'tagName': node.tagName,
+        'id': node.id,
+        'className': node.className,
+        'value': node.value,
+        'textContent': node.textContent,
+        'checked': node.checked,
+        'attributes': attributes
+    };
+}
+
+function query_snapshot(browser, ELEMENTS, selector, context) {
+    return snapshot(ELEMENTS, browser.query(selector, context));
+}
+
+function query_all_snapshots(browser, ELEMENTS, selector, context) {
+    var nodes = browser.queryAll(selector, context),
+        result = [];
+    for (var i = 0; i < nodes.length; i++)
+        result.push(snapshot(ELEMENTS, nodes[i]));
+    return result;
+}
+
+//
+// Named operations clients can call with a JSON message (see
+// ZombieProxyClient.call) instead of sending Javascript to evaluate.  Each
+// is called with the session's browser and element cache, the call's
+// arguments and a callback(err, result).
+//
+var slice = Array.prototype.slice;
+
+// Call a Browser method, and return nothing (e.g., because it returns the
+// browser itself)
+function calls(method) {
+    return function (browser, ELEMENTS) {
+        var callback = arguments[arguments.length - 1];
+        browser[method].apply(browser, slice.call(arguments, 2, -1));
+        callback(null, null);
+    };
+}
+
+// Call a Browser method and return its result
+function returns(method) {
+    return function (browser, ELEMENTS) {
+        var callback = arguments[arguments.length - 1];
+        callback(null, browser[method].apply(
+            browser, slice.call(arguments, 2, -1)));
+    };
+}
+
+// Call an asynchronous Browser method, and return nothing (or, if `result`
+// is set, the value it calls back with) once it's done
+function waits(method, result) {
+    return function (browser, ELEMENTS) {
+        var callback = arguments[arguments.length - 1],
+            args = slice.call(arguments, 2, -1);
+        args.push(function (err, value) {
+            callback(err, result ? value : null);
+        });
+        browser[method].apply(browser, args);
+    };
+}
+
+// Call a Browser method which returns a node (or a list of nodes), and
+// return the index(es) it's stored at in the element cache
+function stores(method, all) {
+    return function (browser, ELEMENTS) {
+        var callback = arguments[arguments.length - 1],
+            value = browser[method].apply(
+                browser, slice.call(arguments, 2, -1));
+        callback(null, all ? create_elements(ELEMENTS, value) :
+                             create_element(ELEMENTS, value));
+    };
+}
+
+// Read a Browser property
+function property(name) {
+    return function (browser, ELEMENTS, callback) {
+        callback(null, browser[name]);
+    };
+}
+
+var OPERATIONS = {
+    // Forms
+    'fill': calls('fill'),
+    'check': calls('check'),
+    'uncheck': calls('uncheck'),
+    'select': calls('select'),
+    'selectOption': calls('selectOption'),
+    'unselect': calls('unselect'),
+    'unselectOption': calls('unselectOption'),
+    'attach': calls('attach'),
+    'choose': calls('choose'),
+    'pressButton': waits('pressButton'),
+
+    // Document content
+    'load': waits('load'),
+    'body': function (browser, ELEMENTS, callback) {
+        callback(null, create_element(ELEMENTS, browser.body));
+    },
+    'html': returns('html'),
+    'text': returns('text'),
+    'field': stores('field'),
+    'link': stores('link'),
+    'query': stores('query'),
+    'queryAll': stores('queryAll', true),
+    'query_attrs': function (browser, ELEMENTS, selector, context, names,
+                             callback) {
+        callback(null, query_attrs(browser, selector, context, names));
+    },
+    'query_snapshot': function (browser, ELEMENTS, selector, context,
+                                callback) {
+        callback(null, query_snapshot(browser, ELEMENTS, selector, context));
+    },
+    'query_all_snapshots': function (browser, ELEMENTS, selector, context,
+                                     callback) {
+        callback(null, query_all_snapshots(
+            browser, ELEMENTS, selector, context));
+    },
+
+    // Navigation
+    'visit': waits('visit'),
+    'back': waits('back'),
+    'reload': waits('reload'),
+    'clickLink': waits('clickLink'),
+    'fire': waits('fire'),
+    'wait': waits('wait'),
+    'location': function (browser, ELEMENTS, callback) {
+        callback(null, browser.location.toString());
+    },
+    'statusCode': property('statusCode'),
+    'success': property('success'),
+    'redirected': property('redirected'),
+
+    // Debugging
+    'evaluate': returns('evaluate'),
+    'get_resource': function (browser, ELEMENTS, url, callback) {
+        browser.resources.get(url, callback);
+    },
+    'post_resource': function (browser, ELEMENTS, url, options, callback) {
+        browser.resources.post(url, options, callback);
+    },
+
+    // Nodes
+    'attr': function (browser, ELEMENTS, node, name, callback) {
+        callback(null, node[name]);
+    },
+    'attrs': function (browser, ELEMENTS, node, names, callback) {
+        callback(null, get_attrs(node, names));
+    },
+    'set_field': function (browser, ELEMENTS, node, value, callback) {
+        // Textareas are set directly, rather than with browser.fill()
+        browser.generation++;
+        set_field(browser, node, value);
+        callback(null, null);
+    },
+    'check_field': function (browser, ELEMENTS, node, value, callback) {
+        browser.generation++;
+        check_field(browser, node, value);
+        callback(null, null);
+    }
+};
+
+//
+// Replace element references (`{"$element": index}`) in an operation's
+// arguments with the nodes they refer to.  References to nodes which have
+// been released (or evicted) are an error, rather than `undefined` (which
+// operations would take for a missing argument, e.g., no context).
+//
+function resolve_elements(ELEMENTS, value) {
+    if (value === null || typeof value != 'object') return value;
+    if (value.hasOwnProperty('$element')) {
+        var index = value['$element'];
+        if (typeof index != 'number' || !(index in ELEMENTS))
+            throw new Error('Element ' + index + ' has been released or ' +
+                            'has expired');
+        return ELEMENTS[index];
+    }
+    var resolved = Array.isArray(value) ? [] : {};
+    for (var key in value)
+        resolved[key] = resolve_elements(ELEMENTS, value[key]);
+    return resolved;
+}
+
+function call_operation(browser, ELEMENTS, name, args, callback) {
+    if (!OPERATIONS.hasOwnProperty(name))
+        throw new Error('Unknown operation: ' + name);
+    OPERATIONS[name].apply(null, [browser, ELEMENTS].concat(
+        resolve_elements(ELEMENTS, args), [callback]));
+}
+
+//
+// Raised when a client refers to a session which doesn't exist (anymore).
+//
+function UnknownSession(id) {
+    this.message = 'Unknown or expired session: ' + id;
+}
+
+//
+// Start a session (unless it has been started already) and switch to it.
+//
+function ctx_open(id, ttl){
+    if(!CLIENTS[id]) {
+        CLIENTS[id] = {
+            'browser': take_browser(),
+            'elements': new ElementCache(OPTIONS['max-elements']),
+            'ttl': ttl || 0
+        };
+        CLIENTS[id].browser.session = id;
+    }
+    return ctx_switch(id);
+}
+
 function ctx_switch(id){
-    if(!CLIENTS[id])
-        CLIENTS[id] = [new Browser(), []];
-    return CLIENTS[id];
+    var client = CLIENTS[id];
+    if (!client) throw new UnknownSession(id);
+    client.last_used = Date.now();
+    return [client.browser, client.elements];
+}
+
+//
+// Stores the DOM nodes a client references by index (as `ELEMENTS[index]`).
+// Clients release indexes once they no longer reference them; if `size` is
+// non-zero, the oldest nodes are also evicted once more than `size` are
+// stored.  (Reads of `ELEMENTS[index]` can't be observed, so eviction is in
+// insertion order.)
+//
+function ElementCache(size) {
+    this.size = size;
+    this.count = 0;
+    this.next = 0;
+    this.oldest = 0;
 }
 
+ElementCache.prototype.store = function (node) {
+    var index = this.next++;
+    this[index] = node;
+    this.count++;
+    while (this.size && this.count > this.size) this.evict();
+    return index;
+};
+
+ElementCache.prototype.release = function (indexes) {
+    for (var i = 0; i < indexes.length; i++) {
+        var index = indexes[i];
+        if (typeof index == 'number' && index in this) {
+            delete this[index];
+            this.count--;
+        }
+    }
+};
+
+ElementCache.prototype.evict = function () {
+    while (!(this.oldest in this)) this.oldest++;
+    delete this[this.oldest++];
+    this.count--;
+};
+
 function create_elements(ELEMENTS, results) {
+    // Storing them all would evict some of them before they're returned
+    if (ELEMENTS.size && results.length > ELEMENTS.size)
+        throw new Error(results.length + ' elements matched, more than ' +
+                        'can be referenced at once (--max-elements=' +
+                        ELEMENTS.size + ')');
     var result = [];
     for(var i = 0; i < results.length; i++) {
-        ELEMENTS.push(results[i]);
-        result.push(ELEMENTS.length - 1);
+        result.push(ELEMENTS.store(results[i]));
     }
     return result;
 }
 
 function create_element(ELEMENTS, result) {
     if (result) {
-        ELEMENTS.push(result);
-        return ELEMENTS.length - 1;
+        return ELEMENTS.store(result);
     }
     return null;
 }
 
-net.createServer(function (stream){
-  stream.setEncoding('utf8');
+function release_elements(ELEMENTS, indexes) {
+    ELEMENTS.release(indexes);
+}
+
+//
+// Every message exchanged with a ZombieProxyClient is prefixed with its
+// length (in bytes) and a request id, both unsigned, big-endian 32-bit
+// integers.  Responses are tagged with the id of the request they answer,
+// so a single connection can carry any number of in-flight requests and
+// (asynchronous) responses may be sent in any order.
+//
+var HEADER_SIZE = 8;
+
+// Buffer.alloc/Buffer.from aren't available on older versions of node.
+function alloc(size) {
+    return Buffer.alloc ? Buffer.alloc(size) : new Buffer(size);
+}
+
+function to_buffer(string) {
+    return Buffer.from ? Buffer.from(string, 'utf8') : new Buffer(string, 'utf8');
+}
+
+function frame(id, payload) {
+    var body = to_buffer(payload),
+        header = alloc(HEADER_SIZE);
+    header.writeUInt32BE(body.length, 0);
+    header.writeUInt32BE(id, 4);
+    return Buffer.concat([header, body]);
+}
+
+//
+// Reassembles framed messages from the chunks a stream emits.  Chunks are
+// only joined once a whole header or message has arrived, so large messages
+// split over many 'data' events are neither copied repeatedly nor evaluated
+// in fragments.  Messages larger than `max_size` are skipped (never
+// buffered) and reported via `on_overflow(id, size)`.
+//
+function FrameReader(max_size, on_message, on_overflow) {
+    this.max_size = max_size;
+    this.on_message = on_message;
+    this.on_overflow = on_overflow;
+    this.chunks = [];
+    this.length = 0;
+    this.expected = null;
+    this.id = null;
+    this.skip = 0;
+}
+
+FrameReader.prototype.push = function (data) {
+    if (this.skip) {
+        var skipped = Math.min(this.skip, data.length);
+        this.skip -= skipped;
+        data = data.slice(skipped);
+    }
+    if (!data.length) return;
+
+    this.chunks.push(data);
+    this.length += data.length;
+
+    while (true) {
+        if (this.expected === null) {
+            if (this.length < HEADER_SIZE) return;
+            var header = this.take(HEADER_SIZE),
+                size = header.readUInt32BE(0),
+                id = header.readUInt32BE(4);
+            if (size > this.max_size) {
+                var discarded = Math.min(size, this.length);
+                this.take(discarded);
+                this.skip = size - discarded;
+                this.on_overflow(id, size);
+                if (this.skip) return;
+                continue;
+            }
+            this.expected = size;
+            this.id = id;
+        }
+        if (this.length < this.expected) return;
+        var message = this.take(this.expected).toString('utf8');
+        this.expected = null;
+        this.on_message(this.id, message);
+    }
+};
+
+FrameReader.prototype.take = function (size) {
+    var buffered = this.chunks.length == 1 ?
+            this.chunks[0] : Buffer.concat(this.chunks, this.length),
+        rest = buffered.slice(size);
+    this.chunks = rest.length ? [rest] : [];
+    this.length = rest.length;
+    return buffered.slice(0, size);
+};
+
+var SERVER = net.createServer(function (stream){
+
+  CONNECTIONS.push(stream);
+
+  var leased = false,
+      // Aborts for the requests still being worked on, by request id
+      pending = {},
+      // Streamed responses (see return_chunks) waiting for the client to
+      // consume pieces, by request id
+      streams = {};
+
+  // Keep the server alive (when --linger is set) until this connection
+  // closes, whether cleanly or because its process died.
+  function lease() {
+    if (leased) return;
+    leased = true;
+    LEASES++;
+  };
+
+  // Drop a request the client has stopped waiting for.
+  function abort_request(id) {
+    if (pending[id]) pending[id]();
+  };
+
+  // Let a streamed response send `count` more pieces, once the client has
+  // consumed as many.
+  function stream_credit(id, count) {
+    if (streams[id]) streams[id](count);
+  };
+
+  function send(id, response) {
+    stream.write(frame(id, JSON.stringify(response)));
+  };
+
+  function handle(id, message) {
+    // Requests sent while recycling are turned away at once (the client
+    // retries them once the server has been respawned); only those which
+    // control requests already in flight are still handled.
+    if (recycling && !CONTROL_MESSAGE.test(message)) {
+        send(id, [4, 'The Zombie.js server is restarting']);
+        return;
+    }
+    REQUESTS++;
+    IN_FLIGHT++;
+
+    // `browser` is set by the session preamble of client messages
+    var result = null,
+        browser = null,
+        responded = false,
+        started = process.hrtime(),
+        // How long evaluating the message took, unless it's still running
+        evaluated = null;
+
+    function respond(response) {
+      // Only the first response counts; the client has stopped waiting
+      // for anything else.
+      if (responded) return;
+      responded = true;
+      delete pending[id];
+      delete streams[id];
+      // Every response reports how long the server took to handle it
+      // (`time`), and how much of that was spent evaluating the message
+      // rather than waiting (e.g., for a page to load)
+      var time = milliseconds_since(started),
+          meta = {'eval': evaluated === null ? time : evaluated, 'time': time};
+      if (browser) meta['generation'] = browser.generation;
+      response.push(meta);
+      send(id, response);
+      request_done();
+    };
 
     function return_error(err) {
-      stream.end(JSON.stringify([1, err.stack]));
+      respond([1, err.stack]);
     };
 
     function return_result(result) {
-      stream.end(JSON.stringify([0, result]));
+      respond([0, result]);
     };
 
     function wait_callback(err, browser) {
@@ -105,15 +935,116 @@ net.createServer(function (stream){
       else return_result(value);
     };
 
-  stream.on('data', function (data){
-    var result = null;
+    // Send a (long) string as [3, piece] partial responses of up to `size`
+    // characters, then respond with null.  Pieces are only written as fast
+    // as the client reads them, so at most one is ever buffered and, if a
+    // `window` is given, no more than `window` pieces ahead of those the
+    // client has consumed (see stream_credit).
+    function return_chunks(text, size, window) {
+      var offset = 0,
+          credit = window || Infinity,
+          draining = false;
+      text = text == null ? '' : String(text);
+
+      function next() {
+        draining = false;
+        while (!responded && offset < text.length) {
+          if (credit <= 0) return;
+          var end = Math.min(offset + size, text.length);
+          // Don't split a surrogate pair across pieces
+          var code = text.charCodeAt(end - 1);
+          if (end < text.length && end - offset > 1 &&
+              code >= 0xD800 && code <= 0xDBFF) end--;
+          var piece = text.slice(offset, end);
+          offset = end;
+          credit--;
+          if (!stream.write(frame(id, JSON.stringify([3, piece])))) {
+            draining = true;
+            stream.once('drain', next);
+            return;
+          }
+        }
+        return_result(null);
+      };
+
+      streams[id] = function (count) {
+        credit += count;
+        if (!draining) next();
+      };
+      next();
+    };
+
     try {
-        eval(data);
+        if (message.charAt(0) == '{') {
+            // A call to one of the OPERATIONS, e.g.,
+            // {"session": "...", "op": "visit", "args": ["http://..."]}
+            var call = JSON.parse(message),
+                ctx = call.open ? ctx_open(call.session, call.ttl) :
+                                  ctx_switch(call.session);
+            browser = ctx[0];
+            if (call.release) release_elements(ctx[1], call.release);
+            call_operation(ctx[0], ctx[1], call.op, call.args || [],
+                           wait_n_return_callback);
+        } else {
+            eval(message);
+        }
     } catch(err) {
-        return_error(err);
+        if (err instanceof UnknownSession) respond([2, err.message]);
+        else return_error(err);
+    }
+
+    if (!responded) {
+      evaluated = milliseconds_since(started);
+      pending[id] = function () {
+        responded = true;
+        delete pending[id];
+        delete streams[id];
+        request_done();
+        if (browser) stop_browser(browser);
+      };
+    }
+  };
+
+  var reader = new FrameReader(
+    OPTIONS['max-message-size'],
+    handle,
+    function (id, size) {
+      send(id, [1, 'Message of ' + size + ' bytes exceeds the maximum ' +
+                   'message size (' + OPTIONS['max-message-size'] + ')']);
     }
+  );
+
+  stream.on('data', function (data){
+    reader.push(data);
+  });
+
+  // Clients may go away at any time (even with requests in flight); that
+  // must not take the whole server down.
+  stream.on('error', function (){});
+
+  stream.on('close', function (){
+    CONNECTIONS.splice(CONNECTIONS.indexOf(stream), 1);
+    if (exiting && !CONNECTIONS.length) process.exit(RECYCLE_STATUS);
+    for (var id in pending) abort_request(id);
+    if (!leased) return;
+    leased = false;
+    LEASES--;
+    schedule_shutdown();
   });
 
 }).listen(process.argv[2], function(){
+    open_log();
+    fill_browser_pool();
+    // Exit if nobody ever leases the server
+    schedule_shutdown();
+    // Whoever spawned the server may exit (closing its stdout) first
+    process.stdout.on('error', function (){});
+    var reaper = setInterval(reap_idle_clients, 1000);
+    if (reaper.unref) reaper.unref();
+    if (OPTIONS['max-rss']) {
+        var monitor = setInterval(check_memory, 1000);
+        if (monitor.unref) monitor.unref();
+    }
+    // zombie.proxy.server waits for this line before using the server
     console.log('Zombie.js server running on ' + process.argv[2] + '...');
 });
@@ -1,28 +1,43 @@
 from socket import error as SocketError
+import contextlib
+import errno
+import fcntl
+import json
 import os
 import subprocess
 import signal
 import threading
-import time
 import atexit
+import itertools
+import multiprocessing
 import random
+import stat
 import sys
+import tempfile
+import time
 import logging
 
-from zombie.proxy.client import ZombieProxyClient
+from zombie.proxy.client import Channel, ZombieProxyClient
 
-__all__ = ['ZombieProxyServer']
+__all__ = ['ZombieProxyServer', 'ZombieProxyServerPool']
 
 
 class PipeWorker(threading.Thread):
     """
     A thread that monitors and redirects node.js stdout and stderr to the
     parent process console.
+
+    It also watches for the line node.js prints once its server is
+    listening: ``ready`` is set when it's seen (``listening`` becomes
+    True), or when the pipe closes without it.
     """
 
-    def __init__(self, pipe):
+    def __init__(self, pipe, ready_marker=None):
         super(PipeWorker, self).__init__()
         self.pipe = pipe
+        self.ready_marker = ready_marker
+        self.ready = threading.Event()
+        self.listening = False
         self.daemon = True
         self.log = logging.getLogger(__name__)
 
@@ -30,6 +45,12 @@ class PipeWorker(threading.Thread):
         while True:
             line = pipe.readline()
             if line:
+                if not isinstance(line, str):  # pragma: nocover
+                    line = line.decode('utf-8', 'replace')
+                if (not self.listening and self.ready_marker and
+                        line.startswith(self.ready_marker)):
+                    self.listening = True
+                    self.ready.set()
                 self.log.debug(line[:-1])
             else:
                 break
@@ -42,13 +63,110 @@ class PipeWorker(threading.Thread):
                 self.log.error(e)
             except:
                 pass
+        finally:
+            self.ready.set()
+
+
+class LogWorker(threading.Thread):
+    """
+    A thread that reads the JSON log records node.js writes to a pipe of
+    their own (see ``log()`` in server.js), and logs each to the logger
+    registered for its session (see :meth:`NodeProcess.add_logger`), to
+    the ``zombie.proxy.session`` logger if there's none, or (for the
+    server's own records) to the ``zombie.proxy.server`` logger.  Records
+    carry their ``session`` and ``source`` (e.g., ``console``) as extra
+    attributes.
+    """
+
+    def __init__(self, fd, loggers):
+        super(LogWorker, self).__init__()
+        self.fd = fd
+        self.loggers = loggers
+        self.daemon = True
+
+    def run(self):
+        pending = b''
+        try:
+            while True:
+                data = os.read(self.fd, 65536)
+                if not data:
+                    break
+                lines = (pending + data).split(b'\n')
+                pending = lines.pop()
+                for line in lines:
+                    if line:
+                        self.emit(line)
+        finally:
+            os.close(self.fd)
+
+    def emit(self, line):
+        try:
+            record = json.loads(line.decode('utf-8'))
+        except ValueError:
+            logging.getLogger(__name__).warning(
+                "Malformed log record: %r" % line)
+            return
+        session = record.get('session')
+        if session is None:
+            logger = logging.getLogger(__name__)
+        else:
+            logger = (self.loggers.get(session) or
+                      logging.getLogger(SESSION_LOGGER))
+        logger.log(
+            LOG_LEVELS.get(record.get('level'), logging.INFO),
+            record.get('message'),
+            extra={'session': session, 'source': record.get('source')})
+
+
+class Supervisor(threading.Thread):
+    """
+    A thread that waits for a node.js subprocess to exit and, unless it was
+    stopped on purpose, has its :class:`NodeProcess` respawn it.
+    """
+
+    def __init__(self, process, child):
+        super(Supervisor, self).__init__()
+        self.process = process
+        self.child = child
+        self.daemon = True
+
+    def run(self):
+        self.child.wait()
+        self.process.restart(self.child)
+
 
-__server_instance__ = None
 proxy_path = os.path.join(
     os.path.dirname(os.path.abspath(__file__)),
     'server.js'
 )
 
+# Printed by server.js once it is listening on its socket
+READY_MARKER = 'Zombie.js server running on'
+
+# The levels server.js logs at (see its --log-level option)
+LOG_LEVELS = {
+    'debug': logging.DEBUG,
+    'info': logging.INFO,
+    'warning': logging.WARNING,
+    'error': logging.ERROR
+}
+
+# Where log records about sessions without a logger of their own go
+SESSION_LOGGER = 'zombie.proxy.session'
+
+# The status server.js exits with when it recycles itself
+RECYCLE_STATUS = 75
+
+# How long a node.js subprocess may take to exit once its connections close
+EXIT_GRACE = 2
+
+# The socket of the (per-user) server shared by every daemon mode process,
+# in runtime_dir()
+DAEMON_SOCKET = 'zombie-daemon.sock'
+
+# Every node.js subprocess spawned, so they can be killed at exit
+__server_instances__ = []
+
 
 def singleton(cls):
     instances = {}
@@ -56,16 +174,76 @@ def singleton(cls):
     def ZombieProxyServer(*args, **kwargs):
         if cls not in instances:
             instances[cls] = cls(*args, **kwargs)
-            global __server_instance__
-            __server_instance__ = instances[cls]
         return instances[cls]
     return ZombieProxyServer
 
 
-@singleton
-class ZombieProxyServer(object):
+def exited(child, timeout):
+    """
+    Wait up to ``timeout`` seconds for a subprocess to exit, and return
+    whether it did.
+    """
+    deadline = time.time() + timeout
+    while child.poll() is None:
+        if time.time() > deadline:
+            return False
+        time.sleep(.01)
+    return True
+
+
+def runtime_dir():
+    """
+    The directory for the daemon's socket (and lock): ``$XDG_RUNTIME_DIR``
+    if it's set, or ``zombie-<uid>`` in the temporary directory otherwise
+    (created if need be).  Either must belong to the current user, and be
+    private to them, so no other user can take the socket's place.
+    """
+    path = os.environ.get('XDG_RUNTIME_DIR')
+    if not path:
+        path = os.path.join(tempfile.gettempdir(), 'zombie-%d' % os.getuid())
+        try:
+            os.mkdir(path, 0o700)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+    info = os.lstat(path)
+    if (not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or
+            info.st_mode & 0o077):
+        raise RuntimeError(
+            "%s isn't a directory private to the current user." % path)
+    return path
 
-    def __init__(self, socket=None, wait=True):
+
+def check_owner(path):
+    """
+    Raise a :class:`RuntimeError` unless ``path`` belongs to the current
+    user.
+    """
+    if os.lstat(path).st_uid != os.getuid():
+        raise RuntimeError("%s belongs to another user." % path)
+
+
+@contextlib.contextmanager
+def locked(path):
+    """
+    Hold an exclusive lock on a file (shared by every process on the
+    machine).
+    """
+    with open(path, 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+class NodeProcess(object):
+
+    def __init__(self, socket=None, wait=True, max_message_size=None,
+                 max_elements=None, idle_timeout=None, browser_pool=None,
+                 ready_timeout=10, daemon=False, linger=30, respawn=True,
+                 max_old_space_size=None, max_requests=None, max_rss=None,
+                 log_level=None):
         """
         Spawns a node.js subprocess that listens on a TCP socket.
         A :class:`zombie.proxy.client.ZombieProxyClient` streams data to
@@ -76,13 +254,100 @@ class ZombieProxyServer(object):
                        intended TCP socket location
         :param wait: when True, wait until the node.js subprocess is responsive
                     via the specified TCP socket.
+        :param ready_timeout: how many seconds to wait for the node.js
+                              subprocess to start listening before giving up
+                              (with a :class:`RuntimeError`).
+        :param max_message_size: the largest message (in bytes) the server
+                                 will accept from a client; larger messages
+                                 are rejected with a
+                                 :class:`zombie.proxy.client.NodeError`.
+                                 Defaults to 64MB.
+        :param max_elements: the most DOM nodes to keep referenced per
+                             browser; once exceeded, the oldest are evicted.
+                             Unlimited by default (elements are still freed
+                             as their Python references are garbage
+                             collected).  Queries which match more nodes
+                             than this raise a
+                             :class:`zombie.proxy.client.NodeError` (query
+                             their attributes, or snapshots, instead).
+        :param idle_timeout: destroy browsers which haven't been used for
+                             this many seconds (e.g., because their process
+                             went away without closing them).  Disabled by
+                             default.
+        :param browser_pool: the number of browsers to construct ahead of
+                             time (and to replace with new ones once their
+                             clients close them), so opening a browser
+                             doesn't wait for zombie.js.  Disabled by
+                             default.
+        :param daemon: when True, share one server between every process
+                       on the machine: attach to the server already
+                       listening on ``socket`` (by default,
+                       ``DAEMON_SOCKET`` in :func:`runtime_dir`, which
+                       only the current user can access) if there's one,
+                       or spawn it (in the background, so it outlives this
+                       process) otherwise.  A socket which belongs to
+                       another user raises a :class:`RuntimeError`.  Each
+                       process leases the server until it
+                       calls :meth:`stop` (or exits); the other options
+                       only apply when the server is spawned.
+        :param linger: in daemon mode, how many seconds the server lives on
+                       once no process leases it.
+        :param respawn: when True (the default), respawn the node.js
+                        subprocess on the same socket if it dies (e.g.,
+                        because it ran out of memory).  Browsers which had
+                        a session in it raise
+                        :class:`zombie.proxy.client.ServerRestarted`.  Not
+                        supported in daemon mode.
+        :param max_old_space_size: the size (in megabytes) of node.js' old
+                                   heap, past which it runs out of memory
+                                   (by default, node's own limit).
+        :param max_requests: recycle the node.js subprocess once it has
+                             handled this many requests.
+        :param max_rss: recycle the node.js subprocess once its resident set
+                        exceeds this many megabytes (checked every second).
+                        A recycled subprocess turns new connections and
+                        requests away (they fail as if the connection had
+                        dropped), answers those in flight and exits, to be
+                        respawned; like any restart, its sessions are
+                        lost.  Recycling
+                        needs ``respawn`` (so isn't supported in daemon
+                        mode).
+        :param log_level: when given (``debug``, ``info``, ``warning`` or
+                          ``error``), node.js sends structured log records
+                          of at least that level (e.g., the console output
+                          of pages) on a pipe of their own, which are
+                          logged to per-session loggers (see
+                          :meth:`add_logger` and :class:`LogWorker`).
+                          Records below the level aren't even serialized.
+                          Not supported in daemon mode.
         """
-        socket = socket or '/tmp/zombie-%s.sock' % random.randint(0, 10000)
+        self.daemon = daemon
+        if (max_requests or max_rss) and (daemon or not respawn):
+            raise ValueError(
+                "max_requests and max_rss need a respawned server")
+        if log_level is not None and log_level not in LOG_LEVELS:
+            raise ValueError(
+                "log_level must be one of %s" % ', '.join(sorted(LOG_LEVELS)))
+        if daemon:
+            socket = socket or os.path.join(runtime_dir(), DAEMON_SOCKET)
+        socket = socket or '/tmp/zombie-%08x.sock' % random.getrandbits(32)
 
         self.socket = socket
+        self.ready_timeout = ready_timeout
+        self.child = self.pipe = self.lease = None
+        self.respawn = respawn and not daemon
+        # The number of times the subprocess has died (and been respawned)
+        self.restarts = 0
+        # Set while the subprocess is listening
+        self.running = threading.Event()
+        self.stopped = False
+        self.__lock = threading.RLock()
+        self.log_level = None if daemon else log_level
+        # Loggers for the records about specific sessions, by session
+        self.loggers = {}
 
         # Kill the node process when finished
-        atexit.register(__kill_node_processes__)
+        __server_instances__.append(self)
 
         #
         # Spawn the node proxy server in a subprocess.
@@ -90,43 +355,329 @@ class ZombieProxyServer(object):
         # evaluates it as Javascript, and passes the eval'ed
         # input to a Zombie.js Browser object.
         #
-        args = ['env', 'node', proxy_path, self.socket]
-        self.child = subprocess.Popen(
-            args,
-            stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT
-        )
+        args = ['env', 'node']
+        if max_old_space_size is not None:
+            args.append('--max-old-space-size=%d' % max_old_space_size)
+        args += [proxy_path, self.socket]
+        if max_message_size is not None:
+            args.append('--max-message-size=%d' % max_message_size)
+        if max_elements is not None:
+            args.append('--max-elements=%d' % max_elements)
+        if idle_timeout is not None:
+            args.append('--idle-timeout=%s' % idle_timeout)
+        if browser_pool is not None:
+            args.append('--browser-pool=%d' % browser_pool)
+        if max_requests is not None:
+            args.append('--max-requests=%d' % max_requests)
+        if max_rss is not None:
+            args.append('--max-rss=%d' % max_rss)
+
+        if not daemon:
+            self.args = args
+            self.spawn(args)
+            if wait:
+                self.wait_until_ready()
+            return
+
+        if self.acquire_lease():
+            return
+        # Only one process may spawn the server; the others wait for it
+        with locked(self.socket + '.lock'):
+            if self.acquire_lease():
+                return
+            if os.path.exists(self.socket):
+                os.remove(self.socket)
+            args.append('--linger=%s' % linger)
+            if sys.version_info >= (3, 2):  # pragma: nocover
+                self.spawn(args, start_new_session=True)
+            else:  # pragma: nocover
+                self.spawn(args, preexec_fn=os.setsid)
+            self.wait_until_ready()
+            if not self.acquire_lease():  # pragma: nocover
+                raise RuntimeError(
+                    "The proxy server at %s couldn't be leased." % self.socket
+                )
+
+    def spawn(self, args, **kwargs):
+        log_fd = None
+        if self.log_level is not None:
+            reader, log_fd = os.pipe()
+            args = args + [
+                '--log-fd=%d' % log_fd, '--log-level=%s' % self.log_level]
+            if sys.version_info >= (3, 2):  # pragma: nocover
+                kwargs['pass_fds'] = (log_fd,)
+        try:
+            self.child = subprocess.Popen(
+                args,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                **kwargs
+            )
+        finally:
+            # Only node.js writes to the log pipe
+            if log_fd is not None:
+                os.close(log_fd)
         self.child.stdin.close()
-        PipeWorker(self.child.stdout).start()
+        self.pipe = PipeWorker(self.child.stdout, READY_MARKER)
+        self.pipe.start()
+        if log_fd is not None:
+            LogWorker(reader, self.loggers).start()
+        if self.respawn:
+            Supervisor(self, self.child).start()
+
+    def restart(self, child):
+        """
+        Respawn the node.js subprocess after ``child`` (the current one)
+        has exited.  It isn't respawned if it was stopped, or if it died
+        before it ever started listening (it would most likely die again).
+        """
+        log = logging.getLogger(__name__)
+        with self.__lock:
+            if self.stopped or child is not self.child:
+                # Stopped on purpose, or respawned already
+                return
+            self.running.clear()
+            self.restarts += 1
+            if not self.pipe.listening:
+                log.error(
+                    "The proxy server at %s exited (with status %s) before "
+                    "it started listening; not respawning it." %
+                    (self.socket, child.returncode))
+                return
+            if child.returncode == RECYCLE_STATUS:
+                log.info(
+                    "The proxy server at %s hit a limit; respawning it." %
+                    self.socket)
+            else:
+                log.warning(
+                    "The proxy server at %s exited (with status %s); "
+                    "respawning it." % (self.socket, child.returncode))
+            if os.path.exists(self.socket):
+                os.remove(self.socket)
+            self.spawn(self.args)
+        try:
+            self.wait_until_ready()
+        except RuntimeError as e:
+            log.error(e)
+
+    def wait_for_restart(self, restarts, timeout=None):
+        """
+        Check whether the node.js subprocess has died since it had been
+        restarted ``restarts`` times and, if so, wait until it's respawned.
+
+        Returns True if the subprocess has been respawned since.
+
+        :param timeout: the number of seconds to wait (by default,
+                        ``ready_timeout``).
+        """
+        if not self.respawn or self.stopped:
+            return False
+        child = self.child
+        if self.restarts == restarts:
+            # Connections see node.js go away slightly before it exits
+            if not exited(child, EXIT_GRACE):
+                return False
+            # The supervisor hasn't noticed yet
+            self.restart(child)
+        self.running.wait(self.ready_timeout if timeout is None else timeout)
+        return self.running.is_set()
+
+    def acquire_lease(self):
+        """
+        Lease the server listening on ``socket`` (if any), keeping it alive
+        until :meth:`stop` is called or this process exits.
+
+        Returns True if a server replied.
+        """
+        if os.path.exists(self.socket):
+            # Never send anything to a server another user may control
+            check_owner(self.socket)
+        try:
+            lease = Channel(self.socket)
+        except SocketError:
+            return False
+        try:
+            lease.request(b'lease(); return_result(ping);')
+        except SocketError:
+            lease.close()
+            return False
+        self.lease = lease
+        return True
+
+    def wait_until_ready(self, timeout=None):
+        """
+        Wait until the node.js subprocess reports (on its stdout) that it is
+        listening on its socket.
+
+        :param timeout: the number of seconds to wait (by default,
+                        ``ready_timeout``).
+        """
+        if self.pipe is None:
+            # Attached to a daemon which is up already
+            return
+        if timeout is None:
+            timeout = self.ready_timeout
+        self.pipe.ready.wait(timeout)
+        if not self.pipe.ready.is_set():
+            raise RuntimeError(
+                "The proxy server has not started within %s seconds." %
+                timeout
+            )
+        if not self.pipe.listening:
+            raise RuntimeError(
+                "The proxy server exited before it started listening "
+                "(see the %s logger for its output)." % __name__
+            )
+        self.running.set()
+
+    def add_logger(self, session, logger):
+        """
+        Log the records about a session (see ``log_level``) to ``logger``.
+        """
+        self.loggers[session] = logger
+
+    def remove_logger(self, session):
+        self.loggers.pop(session, None)
+
+    def stats(self):
+        """
+        Returns the node.js subprocess' memory usage (``rss``,
+        ``heap_total`` and ``heap_used``, in bytes) and workload
+        (``requests`` handled, ``in_flight``, open ``sessions``, pooled
+        browsers, ``uptime`` in seconds and whether it's ``recycling``).
+        """
+        return ZombieProxyClient(self.socket).stats()
+
+    def acquire(self):
+        """
+        Return the server a new :class:`zombie.browser.Browser` should use
+        (i.e., this one).
+        """
+        return self
+
+    def release(self, server):
+        """
+        Called once a :class:`zombie.browser.Browser` is done with a server
+        returned by :meth:`acquire`.
+        """
+        pass
+
+    def stop(self):
+        """
+        Kill the node.js subprocess and remove its socket.
+
+        In daemon mode, release this process's lease instead; the server
+        exits ``linger`` seconds after the last lease is released.
+        """
+        if self.daemon:
+            if self.lease is not None:
+                self.lease.close()
+                self.lease = None
+            return
+
+        self.stopped = True
+        self.running.clear()
+        if hasattr(self.child, 'kill') and self.child.poll() is None:
+            self.child.kill()
+            self.child.wait()
+
+        # Cleanup the closed socket
+        if os.path.exists(self.socket):
+            os.remove(self.socket)
+
+
+@singleton
+class ZombieProxyServer(NodeProcess):
+    """
+    The :class:`NodeProcess` shared by every :class:`zombie.browser.Browser`
+    which isn't given a server explicitly.  Only one is ever spawned; later
+    calls return the same instance.
+    """
+
+
+class ZombieProxyServerPool(object):
+    """
+    Spawns several node.js servers, each on its own socket (and, since node
+    runs on a single core, its own core), and spreads
+    :class:`zombie.browser.Browser` instances across them, e.g.,
+    ::
+        pool = ZombieProxyServerPool(4)
+        browsers = [Browser(server=pool) for i in range(32)]
+    """
+
+    strategies = ('least-load', 'round-robin')
+
+    def __init__(self, size=None, strategy='least-load', **kwargs):
+        """
+        :param size: the number of node.js servers to spawn (by default, one
+                     per CPU).
+        :param strategy: how to assign browsers to servers: ``least-load``
+                         picks the server with the fewest open browsers,
+                         ``round-robin`` takes turns.
+        :param kwargs: any other arguments accepted by :class:`NodeProcess`
+                       (except for ``socket``, which is always random).
+        """
+        if strategy not in self.strategies:
+            raise ValueError(
+                "strategy must be one of %s" % ', '.join(self.strategies))
+        self.strategy = strategy
+        if kwargs.get('daemon'):
+            raise ValueError("pooled servers can't run in daemon mode")
+
+        wait = kwargs.pop('wait', True)
+        self.workers = [
+            NodeProcess(wait=False, **kwargs)
+            for i in range(size or multiprocessing.cpu_count())
+        ]
+        # Wait for the servers once they're all booting in parallel
         if wait:
-            # Wait until we can ping the node.js server
-            client = ZombieProxyClient(socket)
-            retries = 30
-            while True:
-                retries -= 1
-                if retries < 0:  # pragma: nocover
-                    raise RuntimeError(
-                        "The proxy server has not replied within 3 seconds."
-                    )
-                try:
-                    assert client.ping() == 'pong'
-                except (SocketError, AssertionError):
-                    pass
-                else:
-                    break
-                time.sleep(.1)
+            for worker in self.workers:
+                worker.wait_until_ready()
+
+        self.__load = dict((worker, 0) for worker in self.workers)
+        self.__turns = itertools.cycle(self.workers)
+        self.__lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Pick the server a new :class:`zombie.browser.Browser` should use.
+        """
+        with self.__lock:
+            if self.strategy == 'round-robin':
+                worker = next(self.__turns)
+            else:
+                worker = min(self.workers, key=self.__load.get)
+            self.__load[worker] += 1
+            return worker
+
+    def release(self, worker):
+        """
+        Called once a :class:`zombie.browser.Browser` is done with a server
+        returned by :meth:`acquire`.
+        """
+        with self.__lock:
+            self.__load[worker] = max(self.__load[worker] - 1, 0)
+
+    def load(self):
+        """
+        Returns the number of open browsers assigned to each server, by
+        socket address.
+        """
+        with self.__lock:
+            return dict((w.socket, n) for w, n in self.__load.items())
+
+    def stop(self):
+        """
+        Kill every node.js subprocess in the pool.
+        """
+        for worker in self.workers:
+            worker.stop()
 
 
 # When this process ends, ensure all node subprocesses terminate
 def __kill_node_processes__():  # pragma: nocover
-    instance = __server_instance__
-    if instance:
-        from os import path
-        if hasattr(instance.child, 'kill'):
-            instance.child.kill()
+    for instance in __server_instances__:
+        instance.stop()
 
-        # Cleanup the closed socket
-        if path.exists(instance.socket):
-            from os import remove
-            remove(instance.socket)
+atexit.register(__kill_node_processes__)
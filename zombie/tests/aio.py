@@ -0,0 +1,187 @@
+"""
+The tests of :mod:`zombie.proxy.aioclient` and :mod:`zombie.aiobrowser`,
+which use syntax older versions of Python can't parse; they're run by
+:mod:`zombie.tests.test_aio` on Python 3.5+.
+"""
+import asyncio
+
+from zombie.aiobrowser import AsyncBrowser, AsyncDOMNode
+from zombie.proxy.aioclient import AsyncZombieProxyClient
+from zombie.proxy.client import NodeError, SessionExpired, TimeoutError
+from zombie.proxy.server import ZombieProxyServer
+from zombie.tests.webserver import WebServerTestCase
+
+__all__ = ['AsyncZombieProxyClientTests', 'AsyncBrowserTests']
+
+loop = asyncio.new_event_loop()
+
+
+def run(coroutine):
+    return loop.run_until_complete(coroutine)
+
+
+class AsyncZombieProxyClientTests(WebServerTestCase):
+    def setUp(self):
+        super(AsyncZombieProxyClientTests, self).setUp()
+        self.server = ZombieProxyServer()
+        self.client = AsyncZombieProxyClient(self.server.socket)
+
+    def test_ping(self):
+        self.assertEqual('pong', run(self.client.ping()))
+
+    def test_json(self):
+        self.assertEqual({'foo': 'bar'}, run(self.client.json({'foo': 'bar'})))
+
+    def test_malformed_command(self):
+        with self.assertRaises(NodeError):
+            run(self.client.json('banana'))
+
+    def test_wait(self):
+        run(self.client.wait('browser.visit', self.base_url))
+        self.assertEqual(200, run(self.client.json('browser.statusCode')))
+
+    def test_wait_timeout(self):
+        client = self.client
+        with self.assertRaises(TimeoutError):
+            run(client.wait(
+                'browser.visit', self.base_url + 'slow', timeout=.2))
+        self.assertEqual('pong', run(client.ping()))
+
+    def test_cancel(self):
+        client = self.client
+        task = loop.create_task(
+            client.wait('browser.visit', self.base_url + 'slow'))
+        run(asyncio.sleep(.2))
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            run(task)
+        # The visit has been aborted (only the stats request is left)
+        self.assertEqual(1, run(client.json('stats().in_flight')))
+
+    def test_concurrent(self):
+        clients = [AsyncZombieProxyClient(self.server.socket)
+                   for i in range(10)]
+        tasks = [loop.create_task(c.json('%d' % i))
+                 for i, c in enumerate(clients)]
+        results = run(asyncio.gather(*tasks))
+        self.assertEqual(list(range(10)), results)
+
+    def test_concurrent_connect(self):
+        # Clients which connect at once share a single connection
+        fresh = asyncio.new_event_loop()
+        connect = asyncio.open_unix_connection
+        connections = []
+
+        def counted(*args, **kwargs):
+            connections.append(args)
+            return connect(*args, **kwargs)
+
+        async def pings():
+            clients = [AsyncZombieProxyClient(self.server.socket)
+                       for i in range(20)]
+            return await asyncio.gather(*[c.ping() for c in clients])
+
+        asyncio.open_unix_connection = counted
+        try:
+            results = fresh.run_until_complete(pings())
+        finally:
+            asyncio.open_unix_connection = connect
+            fresh.close()
+        self.assertEqual(['pong'] * 20, results)
+        self.assertEqual(1, len(connections))
+
+    def test_close(self):
+        client = self.client
+        run(client.nowait('browser.testing = 1'))
+        run(client.close())
+        self.assertFalse(run(client.json('"testing" in browser')))
+
+    def test_session_expired(self):
+        client = self.client
+        run(client.nowait('browser.testing = 1'))
+        run(AsyncZombieProxyClient(self.server.socket).cleanup())
+        with self.assertRaises(SessionExpired):
+            run(client.json('browser.testing'))
+
+    def test_create_elements(self):
+        client = self.client
+        run(client.wait('browser.visit', self.base_url))
+        res = run(client.create_elements('browser.queryAll', ('input', )))
+        self.assertEqual(list(range(6)), [x.index for x in res])
+
+    def test_batch(self):
+        client = self.client
+
+        async def batched():
+            async with client.batch() as batch:
+                self.assertIsNone(await client.call('visit', self.base_url))
+                await client.json('browser.statusCode')
+                with self.assertRaises(RuntimeError):
+                    await client.call_element('query', 'p')
+            return batch
+
+        self.assertEqual([None, 200], run(batched()).results)
+        self.assertEqual(200, run(client.call('statusCode')))
+
+    def test_batch_error(self):
+        client = self.client
+
+        async def batched():
+            async with client.batch():
+                await client.json('banana')
+                await client.nowait('browser.testing = 1')
+
+        with self.assertRaises(NodeError):
+            run(batched())
+        self.assertFalse(run(client.json('"testing" in browser')))
+
+    def test_stream(self):
+        with self.assertRaises(NotImplementedError):
+            self.client.stream('browser.html()')
+
+
+class AsyncBrowserTests(WebServerTestCase):
+    def setUp(self):
+        super(AsyncBrowserTests, self).setUp()
+        self.browser = AsyncBrowser()
+        run(self.browser.visit(self.base_url))
+
+    def tearDown(self):
+        run(self.browser.close())
+        super(AsyncBrowserTests, self).tearDown()
+
+    def test_location(self):
+        self.assertEqual(self.base_url, run(self.browser.location))
+
+    def test_fill(self):
+        browser = self.browser
+        run(browser.fill('q', 'Zombie.js'))
+        node = run(browser.query('input[name=q]'))
+        self.assertEqual('Zombie.js', run(node.value))
+
+    def test_query(self):
+        node = run(self.browser.query('button'))
+        assert isinstance(node, AsyncDOMNode)
+        self.assertEqual('button', run(node.tagName))
+        self.assertEqual('Search', run(node.innerHTML))
+
+    def test_query_no_results(self):
+        self.assertIsNone(run(self.browser.query('blink')))
+
+    def test_query_all_attrs(self):
+        matches = run(self.browser.queryAll('input', attrs=['name']))
+        self.assertEqual({'name': 'q'}, matches[0])
+
+    def test_snapshot_live(self):
+        snapshot = run(self.browser.query('button', snapshot=True))
+        self.assertEqual('submit', snapshot.id)
+        self.assertEqual('Search', run(snapshot.live().innerHTML))
+
+    def test_set_checked(self):
+        node = run(self.browser.query('input[name=mycheckbox]'))
+        run(node.set_checked(True))
+        self.assertTrue(run(node.checked))
+
+    def test_press_button(self):
+        run(self.browser.pressButton('Search'))
+        self.assertEqual(self.base_url + 'submit', run(self.browser.location))
@@ -0,0 +1,9 @@
+import sys
+from unittest import SkipTest
+
+if sys.version_info < (3, 5):  # pragma: nocover
+    raise SkipTest('asyncio support requires Python 3.5+')
+
+# Imported rather than defined here, so older versions can skip the tests
+# without parsing them
+from zombie.tests.aio import *  # noqa
@@ -0,0 +1,53 @@
+import json
+
+from zombie.bench import percentile, run, summarize
+from zombie.bench.__main__ import main, report
+from zombie.compat import TestCase
+
+
+class Output(list):
+    write = list.append
+
+
+class PercentileTests(TestCase):
+    def test_percentile(self):
+        samples = list(range(1, 101))
+        self.assertEqual(50, percentile(samples, 50))
+        self.assertEqual(95, percentile(samples, 95))
+        self.assertEqual(100, percentile(samples, 100))
+        self.assertEqual(1, percentile(samples, 0))
+
+    def test_single_sample(self):
+        self.assertEqual(3, percentile([3], 99))
+
+    def test_summarize(self):
+        stats = summarize([.002, .001, .003, .004])
+        self.assertEqual(4, stats['iterations'])
+        self.assertAlmostEqual(1, stats['min'])
+        self.assertAlmostEqual(4, stats['max'])
+        self.assertAlmostEqual(2.5, stats['mean'])
+        self.assertAlmostEqual(2, stats['p50'])
+        self.assertAlmostEqual(400, stats['per_second'])
+
+    def test_report_missing(self):
+        out = Output()
+        report({'benchmarks': {'ping': summarize([0, 0])}}, out)
+        self.assertEqual('-', ''.join(out).split()[-1])
+
+
+class RunTests(TestCase):
+    def test_run(self):
+        results = run(['ping', 'html'], iterations=3, warmup=0, size=4)
+        self.assertEqual(['ping', 'html'], list(results['benchmarks']))
+        self.assertEqual(3, results['benchmarks']['ping']['iterations'])
+        self.assertEqual(3, results['options']['iterations'])
+        # The results are meant to be saved as json
+        json.dumps(results)
+
+    def test_unknown(self):
+        self.assertRaises(ValueError, run, ['banana'])
+        self.assertRaises(TypeError, run, ['ping'], bananas=3)
+
+    def test_no_iterations(self):
+        self.assertRaises(ValueError, run, ['ping'], iterations=0)
+        self.assertRaises(SystemExit, main, ['--iterations', '0'])
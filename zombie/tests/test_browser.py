@@ -1,8 +1,11 @@
 from unittest import TestCase
 import os
+import shutil
+import tempfile
 
-from zombie.browser import Browser, DOMNode
-from zombie.proxy.client import ZombieProxyClient
+from zombie.browser import Browser, DOMNode, DOMSnapshot
+from zombie.proxy.client import ZombieProxyClient, TimeoutError
+from zombie.proxy.server import ZombieProxyServerPool
 from zombie.compat import urlparse, PY3
 from zombie.tests.webserver import WebServerTestCase
 
@@ -91,6 +94,43 @@ class TestBrowser(BaseTestCase):
         field = self.browser.field('mycheckbox')
         self.assertEqual('checkbox', field.type)
 
+    def test_close(self):
+        browser = self.browser
+        browser.close()
+        self.assertEqual('about:blank', browser.location)
+
+    def test_context_manager(self):
+        with Browser() as browser:
+            browser.visit(self.base_url)
+            self.assertEqual(200, browser.statusCode)
+        self.assertEqual('about:blank', browser.location)
+        self.assertEqual(self.base_url, self.browser.location)
+
+    def test_server_pool(self):
+        pool = ZombieProxyServerPool(2)
+        try:
+            browsers = [Browser(server=pool) for i in range(4)]
+            self.assertEqual(
+                [1, 2, 1, 2],
+                [pool.workers.index(b.worker) + 1 for b in browsers])
+            for b in browsers:
+                b.visit(self.base_url)
+                self.assertEqual(200, b.statusCode)
+            browsers[0].close()
+            self.assertEqual([1, 2], sorted(pool.load().values()))
+        finally:
+            pool.stop()
+
+    def test_batch(self):
+        browser = self.browser
+        with browser.batch() as batch:
+            browser.fill('q', 'Zombie.js').check('input[name=mycheckbox]')
+            browser.select('select[name=planet]', 'Planet Mars')
+        self.assertEqual([None, None, None], batch.results)
+        self.assertEqual('Zombie.js', browser.query('input[name=q]').value)
+        self.assertTrue(browser.query('input[name=mycheckbox]').checked)
+        self.assertEqual('mars', browser.query('select[name=planet]').value)
+
     #
     # Document Content
     #
@@ -122,6 +162,21 @@ class TestBrowser(BaseTestCase):
         assert '<title>Example</title>' not in html
         assert '<p>This is an HTML document</p>' in html
 
+    def test_iter_html(self):
+        chunks = list(self.browser.iter_html(chunk_size=16))
+        assert len(chunks) > 1
+        self.assertEqual(self.browser.html(), ''.join(chunks))
+
+    def test_save_html(self):
+        path = os.path.join(tempfile.mkdtemp(), 'page.html')
+        try:
+            self.browser.save_html(path, '#content')
+            with open(path, 'rb') as f:
+                html = f.read().decode('utf-8')
+        finally:
+            shutil.rmtree(os.path.dirname(path))
+        self.assertEqual(self.browser.html('#content'), html)
+
     def test_text(self):
         text = self.browser.text('title')
         assert text == 'Example'
@@ -147,6 +202,19 @@ class TestBrowser(BaseTestCase):
         matches = self.browser.css('blink')
         self.assertEqual(0, len(matches))
 
+    def test_query_all_attrs(self):
+        matches = self.browser.queryAll('input', attrs=['type', 'name'])
+        self.assertEqual(6, len(matches))
+        self.assertEqual({'type': 'text', 'name': 'q'}, matches[0])
+
+    def test_query_all_attrs_with_context(self):
+        matches = self.browser.queryAll(
+            'button', self.browser.query('form'), attrs=['id'])
+        self.assertEqual([{'id': 'submit'}], matches)
+
+    def test_query_all_attrs_no_results(self):
+        self.assertEqual([], self.browser.css('blink', attrs=['id']))
+
     def test_query(self):
         for tag in ['h1', 'p', 'form', 'input', 'button']:
             match = self.browser.query(tag)
@@ -212,6 +280,18 @@ class TestBrowser(BaseTestCase):
         self.browser.reload()
         assert self.browser.css('input')[0].value == ''
 
+    def test_visit_timeout(self):
+        browser = self.browser
+        with self.assertRaises(TimeoutError):
+            browser.visit(self.base_url + 'slow', timeout=.2)
+        browser.visit(self.base_url + 'location2')
+        self.assertTrue(browser.location.endswith('location2'))
+
+    def test_default_timeout(self):
+        with Browser(timeout=.2) as browser:
+            with self.assertRaises(TimeoutError):
+                browser.visit(self.base_url + 'slow')
+
     def test_status_code_200(self):
         assert self.browser.statusCode == 200
 
@@ -259,6 +339,62 @@ class TestBrowser(BaseTestCase):
         self.assertTrue(self.browser.redirected)
 
 
+class TestBrowserCache(BaseTestCase):
+
+    def setUp(self):
+        super(TestBrowserCache, self).setUp()
+        self.browser = Browser(cache=True)
+        self.browser.visit(self.base_url)
+        self.requests = []
+        call = self.browser.client.call
+
+        def counted(op, *args, **kwargs):
+            self.requests.append(op)
+            return call(op, *args, **kwargs)
+        self.browser.client.call = counted
+
+    def test_cached(self):
+        location = self.browser.location
+        self.assertEqual(location, self.browser.location)
+        html = self.browser.html()
+        self.assertEqual(html, self.browser.html())
+        self.assertEqual(2, len(self.requests))
+
+    def test_arguments(self):
+        self.browser.html()
+        self.browser.html('#content')
+        self.assertEqual(2, len(self.requests))
+
+    def test_navigation(self):
+        self.assertEqual(self.base_url, self.browser.location)
+        self.browser.visit(self.base_url + 'location2')
+        self.assertEqual(self.base_url + 'location2', self.browser.location)
+        self.assertEqual(['location', 'visit', 'location'], self.requests)
+
+    def test_fill(self):
+        self.browser.html()
+        self.browser.text('form')
+        self.browser.fill('q', 'Zombie.js')
+        self.browser.html()
+        self.browser.text('form')
+        self.assertEqual(['html', 'text', 'fill', 'html', 'text'],
+                         self.requests)
+
+    def test_set_field(self):
+        node = self.browser.query('textarea')
+        self.browser.html()
+        node.value = 'Zombie.js'
+        self.browser.html()
+        self.assertEqual(['query', 'html', 'set_field', 'html'],
+                         self.requests)
+
+    def test_disabled(self):
+        self.browser.cache = False
+        self.browser.location
+        self.browser.location
+        self.assertEqual(2, len(self.requests))
+
+
 class TestDOMNode(BaseTestCase):
     def test_attribute_lookup(self):
         button = self.browser.query('button')
@@ -272,6 +408,17 @@ class TestDOMNode(BaseTestCase):
         btn = self.browser.query('button')
         assert btn.innerHTML == btn.html == 'Search'
 
+    def test_attrs(self):
+        button = self.browser.query('button')
+        self.assertEqual(
+            {'id': 'submit', 'innerHTML': 'Search'},
+            button.attrs('id', 'innerHTML'))
+
+    def test_css_attrs(self):
+        form = self.browser.query('form')
+        self.assertEqual([{'tagName': 'BUTTON'}], form.css(
+            'button', attrs=['tagName']))
+
     def test_item_lookup(self):
         button = self.browser.query('button')
         assert button['innerHTML'] == 'Search'
@@ -448,3 +595,52 @@ class TestDOMNode(BaseTestCase):
     def test_field(self):
         element = self.browser.query('body')
         self.assertIs(element, element.field())
+
+
+class TestDOMSnapshot(BaseTestCase):
+    def test_query(self):
+        form = self.browser.query('form', snapshot=True)
+        assert isinstance(form, DOMSnapshot)
+        self.assertEqual('form', form.tagName)
+        self.assertEqual('form', form.id)
+        self.assertEqual('submittable', form.className)
+        self.assertEqual('POST', form.attributes['method'])
+
+    def test_query_no_results(self):
+        self.assertIsNone(self.browser.query('blink', snapshot=True))
+
+    def test_query_all(self):
+        inputs = self.browser.queryAll('input', snapshot=True)
+        self.assertEqual(6, len(inputs))
+        self.assertTrue(all(isinstance(i, DOMSnapshot) for i in inputs))
+        self.assertFalse(inputs[1].checked)
+        self.assertTrue(inputs[2].checked)
+        self.assertEqual('2', inputs[2].value)
+
+    def test_query_all_with_context(self):
+        form = self.browser.query('form')
+        buttons = form.css('button', snapshot=True)
+        self.assertEqual(['Search'], [b.text for b in buttons])
+
+    def test_textarea_value(self):
+        textarea = self.browser.query('textarea', snapshot=True)
+        self.assertEqual('', textarea.value)
+
+    def test_item_lookup(self):
+        button = self.browser.query('button', snapshot=True)
+        self.assertEqual('submit', button['id'])
+
+    def test_printable(self):
+        form = self.browser.query('form', snapshot=True)
+        self.assertEqual('<FORM#form.submittable>', repr(form))
+
+    def test_stale(self):
+        field = self.browser.query('input[name=q]', snapshot=True)
+        field.live().fill('Zombie.js')
+        self.assertEqual('', field.value)
+        self.assertEqual('Zombie.js', field.live().value)
+
+    def test_slots(self):
+        button = self.browser.query('button', snapshot=True)
+        with self.assertRaises(AttributeError):
+            button.innerHTML = 'Search'
@@ -4,7 +4,10 @@ if PY3:
     from socketserver import UnixStreamServer, StreamRequestHandler
 else:
     from SocketServer import UnixStreamServer, StreamRequestHandler
+import socket
+import struct
 import threading
+import time
 
 try:
     from json import loads, dumps
@@ -15,9 +18,18 @@ import fudge
 from zombie.proxy.client import (
     encode,
     encode_args,
+    encode_call,
     decode,
+    frame,
+    receive_exactly,
+    use_json_codec,
+    JSON_CODECS,
     Element,
     NodeError,
+    SessionExpired,
+    TimeoutError,
+    Channel,
+    PendingResponse,
     ZombieServerConnection,
     ZombieProxyClient)
 from zombie.proxy.server import ZombieProxyServer
@@ -54,6 +66,29 @@ class EncodeArgsTests(TestCase):
         self.assertEqual('"one", ', encode_args(['one'], True))
 
 
+class EncodeCallTests(TestCase):
+    def test_element(self):
+        self.assertEqual(
+            {'args': [{'$element': 3}, 'x']},
+            loads(encode_call({'args': [Element(3), 'x']})))
+
+    def test_unencodable(self):
+        self.assertRaises(TypeError, encode_call, [object()])
+
+
+class FrameTests(TestCase):
+    def test_frame(self):
+        self.assertEqual(
+            b'\x00\x00\x00\x05\x00\x00\x00\x00hello', frame(b'hello'))
+
+    def test_request_id(self):
+        self.assertEqual(
+            b'\x00\x00\x00\x02\x00\x00\x01\x00hi', frame(b'hi', 256))
+
+    def test_empty(self):
+        self.assertEqual(b'\x00' * 8, frame(b''))
+
+
 class DecodeTests(TestCase):
     def test_none(self):
         self.assertEqual(None, decode(None))
@@ -61,6 +96,47 @@ class DecodeTests(TestCase):
     def test_something(self):
         self.assertEqual([1], decode("[1]"))
 
+    def test_buffer(self):
+        data = u'["caf\u00e9"]'.encode('utf-8')
+        self.assertEqual([u'caf\u00e9'], decode(data))
+        self.assertEqual([u'caf\u00e9'], decode(bytearray(data)))
+
+    def test_codecs(self):
+        data = bytearray(u'[1, "caf\u00e9"]'.encode('utf-8'))
+        try:
+            for name in JSON_CODECS:
+                use_json_codec(name)
+                self.assertEqual([1, u'caf\u00e9'], decode(data))
+        finally:
+            use_json_codec()
+
+    def test_unknown_codec(self):
+        self.assertRaises(ValueError, use_json_codec, 'yaml')
+
+
+class ReceiveTests(TestCase):
+    def test_receive_exactly(self):
+        data = u'\u00e9'.encode('utf-8') * 100000
+        ours, theirs = socket.socketpair()
+        try:
+            sender = threading.Thread(target=theirs.sendall, args=(data,))
+            sender.start()
+            received = receive_exactly(ours, len(data))
+            sender.join()
+        finally:
+            ours.close()
+            theirs.close()
+        self.assertEqual(data, bytes(received))
+
+    def test_closed(self):
+        ours, theirs = socket.socketpair()
+        theirs.sendall(b'abc')
+        theirs.close()
+        try:
+            self.assertRaises(socket.error, receive_exactly, ours, 4)
+        finally:
+            ours.close()
+
 
 class ElementTests(TestCase):
     def test_index(self):
@@ -72,17 +148,46 @@ class ElementTests(TestCase):
     def test_str(self):
         self.assertEqual("ELEMENTS[15]", str(Element(15)))
 
+    def test_release(self):
+        released = []
+        element = Element(15, released.append)
+        self.assertEqual([], released)
+        del element
+        self.assertEqual([15], released)
+
 
 class EchoHandler(StreamRequestHandler):
+    def read_frame(self):
+        header = self.rfile.read(8)
+        if not header:
+            return None
+        size, request_id = struct.unpack('!II', header)
+        return header + self.rfile.read(size)
+
+    def handle(self):
+        # Echo every framed message until the client hangs up
+        while True:
+            message = self.read_frame()
+            if message is None:
+                break
+            self.wfile.write(message)
+            self.wfile.flush()
+
+
+class ReverseEchoHandler(EchoHandler):
     def handle(self):
-        self.wfile.write(self.rfile.readline())
+        # Wait for two messages, then answer them in reverse order
+        messages = [self.read_frame(), self.read_frame()]
+        for message in reversed(messages):
+            self.wfile.write(message)
+        self.wfile.flush()
 
 
 class EchoServer(threading.Thread):
-    def __init__(self, address):
+    def __init__(self, address, handler=EchoHandler):
         super(EchoServer, self).__init__()
         self.daemon = True
-        self.server = UnixStreamServer(address, EchoHandler)
+        self.server = UnixStreamServer(address, handler)
 
     def run(self):
         self.server.handle_request()
@@ -105,12 +210,99 @@ class ZombieServerConnectionTests(TestCase):
         self.connection = ZombieServerConnection(self.address)
 
     def tearDown(self):
+        self.connection.channel.close()
         self.cleanup()
 
     def test_send(self):
         res = self.connection.send('Hello world!\n')
         self.assertEqual('Hello world!\n', res)
 
+    def test_send_reuses_connection(self):
+        self.assertEqual('one', self.connection.send('one'))
+        self.assertEqual('two', self.connection.send('two'))
+
+    def test_send_not_persistent(self):
+        connection = ZombieServerConnection(self.address, persistent=False)
+        self.assertIsNone(connection.channel)
+        self.assertEqual('Hello world!', connection.send('Hello world!'))
+
+
+class PendingResponseTests(TestCase):
+    def test_timeout(self):
+        with self.assertRaises(TimeoutError):
+            PendingResponse().get(.01)
+
+    def test_timeout_is_node_error(self):
+        self.assertTrue(issubclass(TimeoutError, NodeError))
+
+
+class ChannelTests(TestCase):
+    address = '/tmp/testing-unix-server'
+
+    def cleanup(self):
+        if os.path.exists(self.address):
+            os.remove(self.address)
+
+    def setUp(self):
+        self.cleanup()
+
+    def tearDown(self):
+        self.cleanup()
+
+    def start(self, handler=EchoHandler):
+        self.server = EchoServer(self.address, handler)
+        self.server.start()
+        return Channel.for_address(self.address)
+
+    def test_for_address(self):
+        channel = self.start()
+        self.assertIs(channel, Channel.for_address(self.address))
+        channel.close()
+
+    def test_reconnect_after_close(self):
+        channel = self.start()
+        channel.close()
+        self.assertTrue(channel.closed)
+        self.assertIsNot(channel, Channel.for_address(self.address))
+
+    def test_out_of_order_responses(self):
+        channel = self.start(ReverseEchoHandler)
+        first = channel.send(b'first')
+        second = channel.send(b'second')
+        self.assertEqual(b'second', second.get())
+        self.assertEqual(b'first', first.get())
+        channel.close()
+
+    def test_concurrent_requests(self):
+        channel = self.start()
+        results = {}
+
+        def request(n):
+            payload = ('request %d' % n).encode('ascii')
+            results[n] = channel.request(payload) == payload
+
+        threads = [threading.Thread(target=request, args=(n,))
+                   for n in range(10)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(dict((n, True) for n in range(10)), results)
+        channel.close()
+
+    def test_pending_requests_fail_on_close(self):
+        channel = self.start(ReverseEchoHandler)
+        pending = channel.send(b'never answered')
+        channel.close()
+        with self.assertRaises(socket.error):
+            pending.get()
+
+    def test_request_timeout(self):
+        channel = self.start(ReverseEchoHandler)
+        with self.assertRaises(TimeoutError):
+            channel.request(b'never answered', timeout=.1)
+        channel.close()
+
 
 class ZombieProxyClientTests(WebServerTestCase):
     def setUp(self):
@@ -129,6 +321,66 @@ class ZombieProxyClientTests(WebServerTestCase):
         }
         self.assertEqual(obj, self.client.json(obj))
 
+    def test_fork(self):
+        client = self.client
+        self.assertEqual(2, client.json('1 + 1'))
+        pid = os.fork()
+        if pid == 0:  # pragma: nocover
+            # The child can't use its parent's channel (nor its reader)
+            try:
+                child = ZombieProxyClient(self.server.socket, timeout=3)
+                os._exit(0 if child.json('1 + 1') == 2 else 1)
+            except BaseException:
+                os._exit(2)
+        self.assertEqual((pid, 0), os.waitpid(pid, 0))
+        # ...nor did it break the parent's
+        self.assertEqual(2, client.json('1 + 1'))
+
+    def test_large_message(self):
+        # Large enough to arrive in many chunks on the server side
+        html = '<p>%s</p>' % ('x' * 4 * 1024 * 1024)
+        self.assertEqual(html, self.client.json(dumps(html)))
+        self.assertEqual("pong", self.client.ping())
+
+    def test_stream(self):
+        text = u'\U0001f600' + 'x' * 9 + u'caf\u00e9' * 1000
+        chunks = list(self.client.stream('String', (text,), 10))
+        self.assertEqual(text, u''.join(chunks))
+        assert len(chunks) > 1
+        assert all(len(chunk) <= 10 for chunk in chunks)
+        # A surrogate pair is never split
+        self.assertEqual(u'\U0001f600' + 'x' * 8, chunks[0])
+
+    def test_stream_empty(self):
+        self.assertEqual([], list(self.client.stream('String', ('',))))
+
+    def test_stream_error(self):
+        with self.assertRaises(NodeError):
+            list(self.client.stream('banana'))
+
+    def test_stream_abandoned(self):
+        chunks = self.client.stream('String', ('x' * 100000,), 10)
+        self.assertEqual('x' * 10, next(chunks))
+        chunks.close()
+        self.assertEqual("pong", self.client.ping())
+        self.assertEqual(5, self.client.json('5'))
+        # The request has been aborted (only the stats request is left)
+        for i in range(10):
+            if self.client.stats()['in_flight'] == 1:
+                break
+            time.sleep(.1)
+        self.assertEqual(1, self.client.stats()['in_flight'])
+
+    def test_stream_interleaved(self):
+        # Requests made while consuming a stream don't wait for it
+        client = self.client
+        text = 'x' * 1000
+        chunks = []
+        for chunk in client.stream('String', (text,), 10):
+            chunks.append(chunk)
+            self.assertEqual(len(chunks), client.json(str(len(chunks))))
+        self.assertEqual(text, ''.join(chunks))
+
     def test_malformed_command(self):
         with self.assertRaises(NodeError):
             self.client.json("banana")
@@ -146,12 +398,152 @@ class ZombieProxyClientTests(WebServerTestCase):
     def test_ping(self):
         self.assertEqual("pong", self.client.ping())
 
+    def test_generation(self):
+        self.assertIsNone(self.client.generation)
+        self.client.json('null')
+        generation = self.client.generation
+        self.assertIsNotNone(generation)
+        self.client.json('null')
+        self.assertEqual(generation, self.client.generation)
+        self.client.wait('browser.visit', self.base_url)
+        self.assertGreater(self.client.generation, generation)
+
+    def test_batch(self):
+        client = self.client
+        with client.batch() as batch:
+            self.assertIsNone(client.json('1 + 1'))
+            client.wait('browser.visit', self.base_url)
+            client.json('browser.statusCode')
+        self.assertEqual([2, None, 200], batch.results)
+
+    def test_call(self):
+        client = self.client
+        self.assertIsNone(client.call('visit', self.base_url))
+        self.assertEqual(200, client.call('statusCode'))
+        self.assertEqual(self.base_url, client.call('location'))
+
+    def test_call_element(self):
+        client = self.client
+        client.call('visit', self.base_url)
+        element = client.call_element('query', 'title')
+        self.assertEqual('TITLE', client.call('attr', element, 'tagName'))
+        self.assertEqual(
+            {'tagName': 'TITLE'}, client.call('attrs', element, ['tagName']))
+        self.assertIsNone(client.call_element('query', 'blink'))
+
+    def test_call_released_element(self):
+        client = self.client
+        client.call('visit', self.base_url)
+        element = client.call_element('query', 'form')
+        client.nowait('release_elements(ELEMENTS, [%d])' % element.index)
+        calls = [('attr', element, 'tagName'), ('query', 'input', element)]
+        for args in calls:
+            with self.assertRaises(NodeError) as raised:
+                client.call(*args)
+            self.assertIn('has been released', str(raised.exception))
+
+    def test_call_timeout(self):
+        client = self.client
+        with self.assertRaises(TimeoutError):
+            client.call('visit', self.base_url + 'slow', timeout=.2)
+        # The session is still usable once the visit has been aborted
+        self.assertEqual('pong', client.ping())
+        client.call('visit', self.base_url)
+        self.assertEqual(200, client.call('statusCode'))
+
+    def test_wait_timeout(self):
+        with self.assertRaises(TimeoutError):
+            self.client.wait(
+                'browser.visit', self.base_url + 'slow', timeout=.2)
+
+    def test_default_timeout(self):
+        client = ZombieProxyClient(self.server.socket, timeout=.2)
+        with self.assertRaises(TimeoutError):
+            client.call('visit', self.base_url + 'slow')
+        client.close()
+
+    def test_call_unexpected_keyword(self):
+        with self.assertRaises(TypeError):
+            self.client.call('location', banana=1)
+
+    def test_call_unknown(self):
+        with self.assertRaises(NodeError):
+            self.client.call('banana')
+
+    def test_call_batch(self):
+        client = self.client
+        with client.batch() as batch:
+            self.assertIsNone(client.call('visit', self.base_url))
+            client.call('statusCode')
+            self.assertRaises(RuntimeError, client.call_element, 'query', 'p')
+        self.assertEqual([None, 200], batch.results)
+
+    def test_batch_empty(self):
+        with self.client.batch() as batch:
+            pass
+        self.assertEqual([], batch.results)
+
+    def test_batch_nested(self):
+        client = self.client
+        with client.batch() as outer:
+            client.json('1')
+            with client.batch() as inner:
+                client.json('2')
+            self.assertIs(outer, inner)
+        self.assertEqual([1, 2], outer.results)
+
+    def test_batch_error(self):
+        client = self.client
+        with self.assertRaises(NodeError):
+            with client.batch():
+                client.nowait('browser.testing = 1')
+                client.json('banana')
+                client.nowait('browser.testing = 2')
+        self.assertEqual(1, client.json('browser.testing'))
+
+    def test_batch_create_element(self):
+        client = self.client
+        with self.assertRaises(RuntimeError):
+            with client.batch():
+                client.create_element('browser.query', ('form',))
+
     def test_cleanup(self):
         client = self.client
         self.assertEqual(1, client.json('browser.testing = 1'))
         client.cleanup()
         self.assertFalse(client.json('"testing" in browser'))
 
+    def test_session(self):
+        other = ZombieProxyClient(self.server.socket)
+        self.assertEqual(32, len(self.client.session))
+        self.assertNotEqual(self.client.session, other.session)
+
+    def test_session_expired(self):
+        client, other = self.client, ZombieProxyClient(self.server.socket)
+        client.nowait('browser.testing = 1')
+        other.cleanup()
+        session = client.session
+        with self.assertRaises(SessionExpired):
+            client.json('browser.testing')
+        self.assertNotEqual(session, client.session)
+        self.assertFalse(client.json('"testing" in browser'))
+
+    def test_session_ttl(self):
+        client = ZombieProxyClient(self.server.socket, ttl=0.1)
+        client.nowait('browser.testing = 1')
+        time.sleep(1.5)
+        with self.assertRaises(SessionExpired):
+            client.json('browser.testing')
+
+    def test_close(self):
+        client, other = self.client, ZombieProxyClient(self.server.socket)
+        client.nowait('browser.testing = 1')
+        other.nowait('browser.testing = 2')
+        client.close()
+        self.assertFalse(client.json('"testing" in browser'))
+        self.assertEqual(2, other.json('browser.testing'))
+        other.close()
+
     def test_create_element(self):
         client = self.client
         client.wait('browser.visit', self.base_url)
@@ -173,3 +565,26 @@ class ZombieProxyClientTests(WebServerTestCase):
         client.wait('browser.visit', self.base_url)
         res = client.create_elements('browser.queryAll', ('input', ))
         self.assertEqual(list(range(6)), [x.index for x in res])
+
+    def test_release_elements(self):
+        client = self.client
+        client.wait('browser.visit', self.base_url)
+        element = client.create_element('browser.query', ('form',))
+        index = element.index
+        self.assertTrue(client.json('%d in ELEMENTS' % index))
+        del element
+        self.assertFalse(client.json('%d in ELEMENTS' % index))
+        self.assertEqual(0, client.json('ELEMENTS.count'))
+
+    def test_release_elements_of_closed_session(self):
+        client = self.client
+        client.wait('browser.visit', self.base_url)
+        stale = client.create_element('browser.query', ('form',))
+        client.close()
+        client.wait('browser.visit', self.base_url)
+        element = client.create_element('browser.query', ('form',))
+        # The new session's element reuses the index
+        self.assertEqual(stale.index, element.index)
+        del stale
+        self.assertEqual(
+            'FORM', client.json('ELEMENTS[%d].tagName' % element.index))
@@ -0,0 +1,59 @@
+import threading
+
+from zombie.crawl import crawl, parse_spec, CrawlTimeout, CrawlWorker
+from zombie.compat import TestCase
+from zombie.proxy.client import NodeError
+from zombie.tests.webserver import WebServerTestCase
+
+
+class ParseSpecTests(TestCase):
+    def test_selector(self):
+        self.assertEqual(
+            [('title', 'title', 'textContent')],
+            parse_spec({'title': 'title'}))
+
+    def test_property(self):
+        self.assertEqual(
+            [('links', 'a', 'href')], parse_spec({'links': ('a', 'href')}))
+
+
+class CrawlTests(WebServerTestCase):
+    def test_crawl(self):
+        urls = [self.base_url, self.base_url + 'location2']
+        results = list(crawl(urls, {'title': 'title'}, concurrency=2))
+        self.assertEqual(set(urls), set(r.url for r in results))
+        fields = dict((r.url, r.fields) for r in results)
+        self.assertEqual({'title': ['Example']}, fields[self.base_url])
+        self.assertEqual(
+            {'title': ['Location 2']}, fields[self.base_url + 'location2'])
+        assert all(r.error is None for r in results)
+
+    def test_errors(self):
+        url = self.base_url + 'notfound'
+        results = list(crawl([url, self.base_url], {'title': 'title'}))
+        errors = dict((r.url, r.error) for r in results)
+        self.assertIsInstance(errors[url], NodeError)
+        self.assertIsNone(errors[self.base_url])
+
+    def test_timeout(self):
+        url = self.base_url + 'slow'
+        results = list(crawl([url], {'title': 'title'}, timeout=.2))
+        self.assertEqual(1, len(results))
+        self.assertEqual(url, results[0].url)
+        self.assertIsInstance(results[0].error, CrawlTimeout)
+
+    def test_timeout_workers(self):
+        urls = [self.base_url + 'slow'] * 2
+        results = list(crawl(
+            urls, {'title': 'title'}, concurrency=1, timeout=.2))
+        self.assertEqual(2, len(results))
+        assert all(isinstance(r.error, CrawlTimeout) for r in results)
+        # Timed out workers aren't left behind
+        self.assertEqual(
+            [], [t for t in threading.enumerate()
+                 if isinstance(t, CrawlWorker)])
+
+    def test_more_urls_than_browsers(self):
+        urls = [self.base_url] * 5
+        results = list(crawl(urls, {'title': 'title'}, concurrency=2))
+        self.assertEqual(5, len(results))
@@ -0,0 +1,115 @@
+from zombie.compat import TestCase
+from zombie.proxy import metrics
+from zombie.proxy.client import NodeError, ZombieProxyClient
+from zombie.proxy.metrics import Aggregator, Call, Histogram
+from zombie.proxy.server import ZombieProxyServer
+from zombie.tests.webserver import WebServerTestCase
+
+
+def call(method='visit', total=.1, error=None):
+    return Call(method, 10, 20, 0, .08, .01, .001, total, error)
+
+
+class HistogramTests(TestCase):
+    def test_empty(self):
+        summary = Histogram().as_dict()
+        self.assertEqual(0, summary['count'])
+        self.assertIsNone(summary['p50'])
+
+    def test_percentiles(self):
+        histogram = Histogram()
+        for i in range(1, 101):
+            histogram.add(i / 1000.0)
+        summary = histogram.as_dict()
+        self.assertEqual(100, summary['count'])
+        self.assertEqual(.001, summary['min'])
+        self.assertEqual(.1, summary['max'])
+        # Percentiles are accurate to a bucket's width
+        self.assertTrue(.050 <= summary['p50'] < .050 * Histogram.BASE)
+        self.assertTrue(.099 <= summary['p99'] <= .1)
+
+    def test_zero(self):
+        histogram = Histogram()
+        histogram.add(0)
+        histogram.add(0)
+        histogram.add(1)
+        self.assertEqual(0, histogram.percentile(50))
+        self.assertEqual(1, histogram.percentile(99))
+
+
+class AggregatorTests(TestCase):
+    def test_aggregate(self):
+        aggregator = Aggregator()
+        aggregator(call())
+        aggregator(call(total=.2, error=NodeError('oops')))
+        aggregator(call('location'))
+        summary = aggregator.as_dict()
+        self.assertEqual(set(['visit', 'location']), set(summary))
+        self.assertEqual(2, summary['visit']['calls'])
+        self.assertEqual(1, summary['visit']['errors'])
+        self.assertEqual(.2, summary['visit']['total']['max'])
+        self.assertEqual(40, summary['visit']['received']['sum'])
+
+    def test_reset(self):
+        aggregator = Aggregator()
+        aggregator(call())
+        aggregator.reset()
+        self.assertEqual({}, aggregator.as_dict())
+
+
+class InstrumentationTests(WebServerTestCase):
+    def setUp(self):
+        super(InstrumentationTests, self).setUp()
+        self.server = ZombieProxyServer()
+        self.client = ZombieProxyClient(self.server.socket)
+        self.calls = []
+        metrics.add_hook(self.calls.append)
+
+    def tearDown(self):
+        super(InstrumentationTests, self).tearDown()
+        metrics.remove_hook(self.calls.append)
+
+    def test_call(self):
+        self.client.call('visit', self.base_url)
+        visit, = self.calls
+        self.assertEqual('visit', visit.method)
+        self.assertGreater(visit.sent, 0)
+        self.assertGreater(visit.received, 0)
+        self.assertGreater(visit.server, 0)
+        self.assertLessEqual(visit.eval, visit.server)
+        self.assertLess(visit.server, visit.total)
+        self.assertIsNotNone(visit.connect)
+        self.assertIsNotNone(visit.decode)
+        self.assertIsNone(visit.error)
+
+    def test_methods(self):
+        client = self.client
+        client.ping()
+        client.json('null')
+        client.wait('browser.visit', self.base_url)
+        self.assertEqual(
+            ['ping', 'json', 'browser.visit'],
+            [c.method for c in self.calls])
+
+    def test_error(self):
+        self.assertRaises(NodeError, self.client.call, 'banana')
+        self.assertIsInstance(self.calls[0].error, NodeError)
+
+    def test_broken_hook(self):
+        def broken(call):
+            raise ValueError()
+        metrics.add_hook(broken)
+        try:
+            self.assertEqual('pong', self.client.ping())
+        finally:
+            metrics.remove_hook(broken)
+
+    def test_aggregator(self):
+        aggregator = Aggregator()
+        metrics.add_hook(aggregator)
+        try:
+            for i in range(3):
+                self.client.ping()
+        finally:
+            metrics.remove_hook(aggregator)
+        self.assertEqual(3, aggregator.as_dict()['ping']['calls'])
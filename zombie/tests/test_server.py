@@ -1,11 +1,22 @@
-from unittest import TestCase
+from unittest import SkipTest, TestCase
+import logging
+import shutil
+import socket
 import subprocess
 import os
+import tempfile
+import time
 
 import fudge
 
-from zombie.proxy.server import ZombieProxyServer, proxy_path
+from zombie.browser import Browser
+from zombie.proxy.client import (
+    NodeError, ServerRestarted, SessionExpired, ZombieProxyClient)
+from zombie.proxy.server import (
+    LogWorker, NodeProcess, PipeWorker, READY_MARKER, SESSION_LOGGER,
+    ZombieProxyServer, ZombieProxyServerPool, proxy_path, runtime_dir)
 from zombie.compat import StringIO
+from zombie.tests.webserver import WebServerTestCase
 
 
 class FakeNode(object):
@@ -74,6 +85,54 @@ class TestServerSpawn(TestCase):
                 ).returns(FakePopen()))):
             ZombieProxyServer(socket='/tmp/zombie-custom.sock', wait=False)
 
+    def _spawn(self, args, **kwargs):
+        """
+        Spawn a new (not the singleton) server, expecting it to run ``args``.
+        """
+        with fudge.patched_context(
+            subprocess,
+            'Popen',
+            (fudge.Fake('Popen').
+                expects_call().
+                with_args(
+                    args,
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT
+                ).returns(FakePopen()))):
+            server = NodeProcess(
+                socket='/tmp/zombie.sock', wait=False, respawn=False,
+                **kwargs)
+        assert server.args == args
+
+    @fudge.with_fakes
+    def test_max_message_size(self):
+        self._spawn(
+            self._args + ['--max-message-size=1024'], max_message_size=1024)
+
+    @fudge.with_fakes
+    def test_max_elements(self):
+        self._spawn(self._args + ['--max-elements=100'], max_elements=100)
+
+    @fudge.with_fakes
+    def test_idle_timeout(self):
+        self._spawn(self._args + ['--idle-timeout=300'], idle_timeout=300)
+
+    @fudge.with_fakes
+    def test_browser_pool(self):
+        self._spawn(self._args + ['--browser-pool=4'], browser_pool=4)
+
+    @fudge.with_fakes
+    def test_max_old_space_size(self):
+        args = [
+            'env',
+            'node',
+            '--max-old-space-size=512',
+            proxy_path,
+            '/tmp/zombie.sock'
+        ]
+        self._spawn(args, max_old_space_size=512)
+
     @fudge.with_fakes
     def test_stdout_redirect_exception(self):
 
@@ -111,3 +170,470 @@ class TestServerSpawn(TestCase):
             pass
 
         assert os.path.exists(self.server.socket)
+
+
+class TestServerReadiness(TestCase):
+
+    def test_ready_marker(self):
+        pipe = PipeWorker(
+            StringIO(('starting\n%s /tmp/zombie.sock...\n' %
+                      READY_MARKER).encode('utf-8')),
+            READY_MARKER)
+        pipe.run()
+        assert pipe.ready.is_set()
+        assert pipe.listening
+
+    def test_exit_before_ready(self):
+        pipe = PipeWorker(StringIO(b'Error: listen EACCES\n'), READY_MARKER)
+        pipe.run()
+        assert pipe.ready.is_set()
+        assert not pipe.listening
+
+    def test_unusable_socket(self):
+        server = NodeProcess(socket='/nonexistent/zombie.sock', wait=False)
+        try:
+            self.assertRaises(RuntimeError, server.wait_until_ready)
+        finally:
+            server.stop()
+
+
+class TestBrowserPool(TestCase):
+
+    def setUp(self):
+        super(TestBrowserPool, self).setUp()
+        self.server = NodeProcess(browser_pool=1)
+
+    def tearDown(self):
+        super(TestBrowserPool, self).tearDown()
+        self.server.stop()
+
+    def pooled(self):
+        return ZombieProxyClient(self.server.socket)._request(
+            'return_result(BROWSER_POOL.length);')
+
+    def test_reuse(self):
+        self.assertEqual(1, self.pooled())
+        client = ZombieProxyClient(self.server.socket)
+        client.json('null')
+        self.assertEqual(0, self.pooled())
+        client.close()
+        self.assertEqual(1, self.pooled())
+
+    def test_refill(self):
+        first = ZombieProxyClient(self.server.socket)
+        second = ZombieProxyClient(self.server.socket)
+        first.json('null')
+        second.json('null')
+        # The pool is refilled once the second request has been answered
+        for i in range(10):
+            if self.pooled():
+                break
+            time.sleep(.1)
+        self.assertEqual(1, self.pooled())
+        first.close()
+        second.close()
+        self.assertEqual(1, self.pooled())
+
+    def test_no_state_shared(self):
+        first = ZombieProxyClient(self.server.socket)
+        first.nowait(
+            "browser.headers = {'Authorization': 'token-of-first'};"
+            "browser.testing = 1;")
+        first.close()
+        second = ZombieProxyClient(self.server.socket)
+        self.assertFalse(second.json(
+            '"testing" in browser || '
+            '(browser.headers || {}).Authorization == "token-of-first"'))
+        second.close()
+
+
+class TestMaxElements(WebServerTestCase):
+
+    def setUp(self):
+        super(TestMaxElements, self).setUp()
+        self.server = NodeProcess(max_elements=2, respawn=False)
+        self.client = ZombieProxyClient(self.server.socket)
+        self.client.call('visit', self.base_url)
+
+    def tearDown(self):
+        super(TestMaxElements, self).tearDown()
+        self.server.stop()
+
+    def test_evict_oldest(self):
+        client = self.client
+        elements = [client.call_element('query', 'form') for i in range(3)]
+        self.assertRaises(NodeError, client.call, 'attr', elements[0], 'id')
+        for element in elements[1:]:
+            self.assertEqual('FORM', client.call('attr', element, 'tagName'))
+
+    def test_too_many_matches(self):
+        client = self.client
+        element = client.call_element('query', 'form')
+        with self.assertRaises(NodeError) as raised:
+            client.call_elements('queryAll', 'input')
+        self.assertIn('max-elements', str(raised.exception))
+        self.assertRaises(
+            NodeError, client.create_elements, 'browser.queryAll', ('input',))
+        # Nothing was evicted
+        self.assertEqual('FORM', client.call('attr', element, 'tagName'))
+
+
+class TestRespawn(WebServerTestCase):
+
+    def setUp(self):
+        super(TestRespawn, self).setUp()
+        self.server = NodeProcess()
+
+    def tearDown(self):
+        super(TestRespawn, self).tearDown()
+        self.server.stop()
+
+    def crash(self):
+        child = self.server.child
+        child.kill()
+        child.wait()
+
+    def test_respawn(self):
+        client = ZombieProxyClient(self.server.socket, server=self.server)
+        client.json('null')
+        self.crash()
+        self.assertRaises(ServerRestarted, client.json, 'null')
+        self.assertEqual(1, self.server.restarts)
+        # The client carries on in a new session
+        self.assertIsNone(client.json('null'))
+
+    def test_session_expired(self):
+        client = ZombieProxyClient(self.server.socket, server=self.server)
+        client.json('null')
+        ZombieProxyClient(self.server.socket).cleanup()
+        # Expiry isn't mistaken for a restart, nor waits to tell them apart
+        started = time.time()
+        try:
+            client.json('null')
+        except ServerRestarted:  # pragma: nocover
+            self.fail("ServerRestarted raised")
+        except SessionExpired:
+            pass
+        self.assertLess(time.time() - started, 1)
+
+    def test_restarted_before_request(self):
+        client = ZombieProxyClient(self.server.socket, server=self.server)
+        client.json('null')
+        self.crash()
+        self.assertTrue(self.server.wait_for_restart(0))
+        # The new server knows nothing of the session
+        self.assertRaises(ServerRestarted, client.json, 'null')
+        self.assertIsNone(client.json('null'))
+
+    def test_unaffected_client(self):
+        self.crash()
+        self.assertTrue(self.server.wait_for_restart(0))
+        client = ZombieProxyClient(self.server.socket, server=self.server)
+        self.assertEqual('pong', client.ping())
+        self.assertIsNone(client.json('null'))
+
+    def test_stop(self):
+        self.server.stop()
+        self.assertEqual(0, self.server.restarts)
+        self.assertFalse(self.server.wait_for_restart(0))
+
+    def test_replay(self):
+        browser = Browser(server=self.server, replay=True)
+        browser.visit(self.base_url)
+        self.crash()
+        self.assertRaises(ServerRestarted, getattr, browser, 'location')
+        self.assertEqual(self.base_url, browser.location)
+        browser.close()
+
+
+class TestRecycle(TestCase):
+
+    def setUp(self):
+        super(TestRecycle, self).setUp()
+        self.server = NodeProcess(max_requests=3)
+
+    def tearDown(self):
+        super(TestRecycle, self).tearDown()
+        self.server.stop()
+
+    def test_stats(self):
+        stats = self.server.stats()
+        self.assertGreater(stats['rss'], 0)
+        self.assertGreater(stats['heap_used'], 0)
+        self.assertEqual(1, stats['requests'])
+        self.assertFalse(stats['recycling'])
+
+    def test_max_requests(self):
+        client = ZombieProxyClient(self.server.socket, server=self.server)
+        for i in range(3):
+            client.json('null')
+        self.assertRaises(ServerRestarted, client.json, 'null')
+        self.assertEqual(1, self.server.restarts)
+        self.assertIsNone(client.json('null'))
+
+    def test_stream_while_recycling(self):
+        client = ZombieProxyClient(self.server.socket, server=self.server)
+        chunks = client.stream('String', ('x' * 100,), 10)
+        # Consuming pieces sends (credit) requests, enough to hit the limit
+        pieces = [next(chunks) for i in range(6)]
+        # New requests are turned away while the server drains...
+        other = ZombieProxyClient(self.server.socket, server=self.server)
+        self.assertRaises(socket.error, other.json, 'null')
+        # ...but the stream is still fed
+        pieces.extend(chunks)
+        self.assertEqual(['x' * 10] * 10, pieces)
+        self.assertRaises(ServerRestarted, client.json, 'null')
+        self.assertEqual(1, self.server.restarts)
+
+    def test_needs_respawn(self):
+        self.assertRaises(
+            ValueError, NodeProcess, max_requests=3, respawn=False)
+        self.assertRaises(ValueError, NodeProcess, max_rss=100, daemon=True)
+
+
+class RecordingHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class TestLogging(TestCase):
+
+    def setUp(self):
+        super(TestLogging, self).setUp()
+        self.server = NodeProcess(log_level='info')
+        self.logger = logging.getLogger('zombie.tests.session')
+        self.logger.propagate = False
+        self.handler = RecordingHandler()
+        self.logger.addHandler(self.handler)
+        self.client = ZombieProxyClient(
+            self.server.socket, server=self.server, logger=self.logger)
+
+    def tearDown(self):
+        super(TestLogging, self).tearDown()
+        self.logger.removeHandler(self.handler)
+        self.server.stop()
+
+    def wait_for_records(self, handler, count):
+        for i in range(50):
+            if len(handler.records) >= count:
+                break
+            time.sleep(.02)
+        return handler.records
+
+    def test_session_logger(self):
+        self.client.nowait("log('warning', browser.session, 'test', 'hi')")
+        record, = self.wait_for_records(self.handler, 1)
+        self.assertEqual(logging.WARNING, record.levelno)
+        self.assertEqual('hi', record.getMessage())
+        self.assertEqual(self.client.session, record.session)
+        self.assertEqual('test', record.source)
+
+    def test_level_filtering(self):
+        self.client.nowait("""
+            log('debug', browser.session, 'test', 'hidden');
+            log('error', browser.session, 'test', 'shown');
+        """)
+        records = self.wait_for_records(self.handler, 1)
+        self.assertEqual(['shown'], [r.getMessage() for r in records])
+
+    def test_default_logger(self):
+        handler = RecordingHandler()
+        logger = logging.getLogger(SESSION_LOGGER)
+        logger.addHandler(handler)
+        try:
+            client = ZombieProxyClient(self.server.socket)
+            client.nowait("log('warning', browser.session, 'test', 'hi')")
+            record, = self.wait_for_records(handler, 1)
+        finally:
+            logger.removeHandler(handler)
+        self.assertEqual(client.session, record.session)
+
+    def test_close(self):
+        session = self.client.session
+        self.assertIs(self.logger, self.server.loggers[session])
+        self.client.close()
+        self.assertNotIn(session, self.server.loggers)
+
+    def test_session_reset(self):
+        session = self.client.session
+        self.client.json('null')
+        ZombieProxyClient(self.server.socket).cleanup()
+        self.assertRaises(SessionExpired, self.client.json, 'null')
+        self.assertEqual([self.client.session], list(self.server.loggers))
+        self.assertNotEqual(session, self.client.session)
+
+    def test_collected(self):
+        del self.client
+        self.assertEqual({}, self.server.loggers)
+
+    def test_needs_server(self):
+        self.assertRaises(
+            ValueError, ZombieProxyClient, self.server.socket,
+            logger=self.logger)
+
+    def test_invalid_level(self):
+        self.assertRaises(ValueError, NodeProcess, log_level='loud')
+
+    def test_malformed_record(self):
+        # Logged (to zombie.proxy.server), rather than raised
+        LogWorker(None, {}).emit(b'not json')
+
+
+class TestDaemon(TestCase):
+
+    def setUp(self):
+        super(TestDaemon, self).setUp()
+        self.socket = '/tmp/zombie-test-%d.sock' % os.getpid()
+        self.first = NodeProcess(daemon=True, socket=self.socket, linger=1)
+
+    def tearDown(self):
+        super(TestDaemon, self).tearDown()
+        self.first.stop()
+        if self.first.child.poll() is None:
+            self.first.child.kill()
+            self.first.child.wait()
+        for path in (self.socket, self.socket + '.lock'):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def wait_for_exit(self, seconds):
+        for i in range(seconds * 10):
+            if self.first.child.poll() is not None:
+                return True
+            time.sleep(.1)
+        return False
+
+    def test_attach(self):
+        second = NodeProcess(daemon=True, socket=self.socket)
+        assert self.first.child is not None
+        assert second.child is None
+        self.assertEqual('pong', ZombieProxyClient(self.socket).ping())
+
+        # The server outlives the process which spawned it...
+        self.first.stop()
+        assert not self.wait_for_exit(2)
+        self.assertEqual('pong', ZombieProxyClient(self.socket).ping())
+
+        # ...until every process has released it
+        second.stop()
+        assert self.wait_for_exit(5)
+        assert not os.path.exists(self.socket)
+
+    def test_respawn_stale_socket(self):
+        self.first.stop()
+        assert self.wait_for_exit(5)
+        open(self.socket, 'w').close()
+
+        second = NodeProcess(daemon=True, socket=self.socket, linger=1)
+        try:
+            assert second.child is not None
+            self.assertEqual('pong', ZombieProxyClient(self.socket).ping())
+        finally:
+            second.stop()
+            second.child.kill()
+            second.child.wait()
+
+    def test_no_daemon_pool(self):
+        self.assertRaises(
+            ValueError, ZombieProxyServerPool, 2, daemon=True)
+
+    def test_foreign_socket(self):
+        if os.getuid() != 0:
+            raise SkipTest("only root can give a file to another user")
+        self.first.stop()
+        assert self.wait_for_exit(5)
+        open(self.socket, 'w').close()
+        os.chown(self.socket, 65534, -1)
+        self.assertRaises(
+            RuntimeError, NodeProcess, daemon=True, socket=self.socket)
+
+
+class TestRuntimeDir(TestCase):
+
+    def setUp(self):
+        super(TestRuntimeDir, self).setUp()
+        self.environ = os.environ.pop('XDG_RUNTIME_DIR', None)
+        self.tempdir = tempfile.mkdtemp()
+        self.gettempdir = tempfile.gettempdir
+        tempfile.gettempdir = lambda: self.tempdir
+
+    def tearDown(self):
+        super(TestRuntimeDir, self).tearDown()
+        tempfile.gettempdir = self.gettempdir
+        os.environ.pop('XDG_RUNTIME_DIR', None)
+        if self.environ is not None:
+            os.environ['XDG_RUNTIME_DIR'] = self.environ
+        shutil.rmtree(self.tempdir)
+
+    def test_created(self):
+        path = runtime_dir()
+        self.assertEqual(
+            os.path.join(self.tempdir, 'zombie-%d' % os.getuid()), path)
+        self.assertEqual(0o700, os.stat(path).st_mode & 0o777)
+        # ...once
+        self.assertEqual(path, runtime_dir())
+
+    def test_xdg_runtime_dir(self):
+        os.environ['XDG_RUNTIME_DIR'] = self.tempdir
+        os.chmod(self.tempdir, 0o700)
+        self.assertEqual(self.tempdir, runtime_dir())
+
+    def test_not_private(self):
+        path = os.path.join(self.tempdir, 'zombie-%d' % os.getuid())
+        os.mkdir(path)
+        os.chmod(path, 0o777)
+        self.assertRaises(RuntimeError, runtime_dir)
+
+    def test_not_a_directory(self):
+        path = os.path.join(self.tempdir, 'zombie-%d' % os.getuid())
+        os.symlink(self.tempdir, path)
+        self.assertRaises(RuntimeError, runtime_dir)
+
+
+class TestServerPool(TestCase):
+
+    def setUp(self):
+        super(TestServerPool, self).setUp()
+        self.pool = ZombieProxyServerPool(2)
+
+    def tearDown(self):
+        super(TestServerPool, self).tearDown()
+        self.pool.stop()
+
+    def test_workers_running(self):
+        self.assertEqual(2, len(self.pool.workers))
+        sockets = set(w.socket for w in self.pool.workers)
+        self.assertEqual(2, len(sockets))
+        for socket in sockets:
+            self.assertEqual('pong', ZombieProxyClient(socket).ping())
+
+    def test_least_load(self):
+        pool = self.pool
+        first, second = pool.acquire(), pool.acquire()
+        self.assertIsNot(first, second)
+        pool.release(first)
+        self.assertIs(first, pool.acquire())
+        self.assertEqual(
+            {first.socket: 1, second.socket: 1}, pool.load())
+
+    def test_round_robin(self):
+        pool = self.pool
+        pool.strategy = 'round-robin'
+        first = pool.acquire()
+        pool.release(first)
+        self.assertIsNot(first, pool.acquire())
+        self.assertIs(first, pool.acquire())
+
+    def test_invalid_strategy(self):
+        with self.assertRaises(ValueError):
+            ZombieProxyServerPool(2, strategy='random', wait=False)
+
+    def test_stop(self):
+        self.pool.stop()
+        for worker in self.pool.workers:
+            self.assertIsNotNone(worker.child.poll())
+            self.assertFalse(os.path.exists(worker.socket))
@@ -2,6 +2,7 @@ import logging
 import os.path
 import random
 import threading
+import time
 from wsgiref.simple_server import make_server, WSGIRequestHandler
 from zombie.compat import TestCase, to_bytes
 
@@ -87,6 +88,20 @@ class AppBuilder(object):
             return to_bytes('')
         self.add_route(method, path, action)
 
+    def add_delay(self, method, path, filename, seconds):
+        filepath = os.path.join(self.base, filename)
+        with open(filepath, 'r') as html_file:
+            contents = to_bytes(html_file.read())
+
+        def action(environ, start_response):
+            time.sleep(seconds)
+            start_response(
+                '200 OK',
+                [('Content-Type', 'text/html')])
+            return contents
+
+        self.add_route(method, path, action)
+
     def add_route(self, method, path, action):
         route_item = self.routes.get(path, {})
         route_item[method] = action
@@ -141,6 +156,7 @@ def build_test_app():
     builder.add_html('GET', '/location2', 'location2.html')
     builder.add_html('POST', '/submit', 'submit.html')
     builder.add_redirect('GET', '/redirect', '/')
+    builder.add_delay('GET', '/slow', 'index.html', 1)
     return builder
 
 